@@ -2,21 +2,34 @@ from flask import Flask, request, jsonify, make_response
 from flask_cors import CORS
 import google.auth
 import logging
+import functools
+import hmac
 import os
-import uuid
+import tempfile
 from datetime import datetime
-from io import BytesIO
 
-import pandas as pd
-from flask import Flask, request, jsonify
-from flask import send_file
+from flask import Flask, request, jsonify, Response
+from flask import send_file, stream_with_context
 from flask_cors import CORS
 
-from db_agent import db_agent_loop
-from orch_agent import generate_instructions_with_orchestrator
-from reporter_agent import generate_summary_with_reporter
-from utils import execute_query
+from pipeline import iter_query_pipeline, run_query_pipeline, format_sse
+from utils import iter_query_batches, result_cache, connection_pool, CACHE_DIR
+from exporters import STREAM_FORMATS, XLSX_MIMETYPE, write_excel
+import itertools
+from question_cache import question_cache
+from request_store import request_store
+import snapshots
+import jobs
+from pagination import PaginationError, fetch_page, parse_page_request
 from literature_agent import generate_answer
+from literature_index import literature_index
+from literature_findings import findings_cache
+import llm_client
+import llm_cassettes
+import metrics
+import query_control
+import usage
+import time
 
 
 app = Flask(__name__)
@@ -25,11 +38,56 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-request_id2sql = {}
+EXPORT_DIR = os.path.join(CACHE_DIR, "exports")
+# Bearer token of the operator endpoints (metrics, stats and debug). Without it, they only answer when LOCAL_DEV is set.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 credentials, project = google.auth.default()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logging.info(f"Project ID: {project}")
+llm_client.warm_up()
+connection_pool.warm_up(int(os.getenv("DB_POOL_WARM_UP", str(connection_pool.size))))
+jobs.resume_jobs()
+
+
+@app.before_request
+def start_timer():
+    request.environ['typetwo.start'] = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    start = request.environ.get('typetwo.start')
+    if start is not None and request.url_rule is not None:
+        metrics.HTTP_REQUEST_SECONDS.labels(request.url_rule.rule, request.method, response.status_code).observe(time.perf_counter() - start)
+    return response
+
+
+def require_admin_token(view):
+    """Restricts a route to requests sending `Authorization: Bearer <ADMIN_TOKEN>`. When no token is configured,
+    the route answers only in local development and is hidden (404) otherwise."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            if not os.getenv("LOCAL_DEV"):
+                return jsonify({'error': 'Not found'}), 404
+        else:
+            scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode()):
+                return jsonify({'error': 'Unauthorized'}), 401, {'WWW-Authenticate': 'Bearer'}
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def find_request_with_sql(request_id: str) -> tuple[dict | None, tuple | None]:
+    """Returns a stored request whose results can be fetched, or the error response: 404 when the request is
+    unknown or expired, 409 when no SQL was accepted for it (the Writer/Checker loop ran out of rounds)."""
+    stored_request = request_store.get(request_id)
+    if stored_request is None:
+        return None, (jsonify({'error': f"Unknown or expired request id {request_id}"}), 404)
+    if not stored_request['sql']:
+        return None, (jsonify({'error': f"Request {request_id} has no SQL query, so it has no results"}), 409)
+    return stored_request, None
 
 
 @app.route("/api/health")
@@ -37,7 +95,54 @@ def health():
     return "OK", 200
 
 
+@app.route("/metrics")
+@require_admin_token
+def prometheus_metrics():
+    """Serves the Prometheus metrics, see `metrics`. Scrapers authenticate with the ADMIN_TOKEN bearer token."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.route("/api/cache/stats")
+@require_admin_token
+def cache_stats():
+    return jsonify({
+        'questionCache': question_cache.stats(),
+        'resultCache': result_cache.stats(),
+        'requestStore': request_store.stats(),
+        'snapshots': snapshots.stats(),
+        'jobs': jobs.job_store.stats(),
+        'literatureIndex': literature_index.stats(),
+        'literatureFindings': findings_cache.stats(),
+        'llmCassettes': llm_cassettes.stats()
+    })
+
+
+@app.route("/api/db/stats")
+@require_admin_token
+def db_stats():
+    return jsonify({'connectionPool': connection_pool.stats(), 'abortedQueries': query_control.stats()})
+
+
+@app.route("/api/debug/usage")
+@require_admin_token
+def usage_stats():
+    """Returns the tokens and prompt characters per agent and per prompt section since this worker started."""
+    return jsonify(usage.stats())
+
+
+@app.route("/api/debug/usage/<request_id>")
+@require_admin_token
+def request_usage(request_id: str):
+    """Returns the token and prompt-size accounting of one answered question, see `usage`."""
+    stored = request_store.get(request_id)
+    if stored is None or stored["usage"] is None:
+        return jsonify({'error': 'Unknown request id or usage not recorded'}), 404
+    return jsonify(stored["usage"])
+
+
 @app.route('/api/query', methods=['OPTIONS'])
+@app.route('/api/query/stream', methods=['OPTIONS'])
 def options():
     response = make_response()
     response.headers['Access-Control-Allow-Origin'] = '*'
@@ -52,64 +157,154 @@ def process_query():
         user_question = data.get('query', '')
         logger.info(f"Received user query: {user_question}")
 
-        orchestrator_response, writer_input = generate_instructions_with_orchestrator(user_question)
-        logging.info(writer_input)
+        with query_control.cancel_scope() as token, query_control.cancel_on_disconnect(request.environ.get('gunicorn.socket'), token):
+            result = run_query_pipeline(user_question)
 
-        sql_query, query_result = db_agent_loop(user_question, writer_input, sql_query="", query_result="", depth=0, max_depth=5)
+        return jsonify({
+            'requestId': result['requestId'],
+            'summary': result['summary'],
+            'searchResults': result['searchResults']
+        })
 
-        request_id = str(uuid.uuid4())
+    except Exception as e:
+        logger.exception("Error processing query")
+        return jsonify({'error': str(e)}), 500
 
-        request_id2sql[request_id] = sql_query
 
-        reporter_response, answer_summary = generate_summary_with_reporter(user_question, writer_input, sql_query, query_result)
-        logging.info(answer_summary)
+@app.route('/api/query/stream', methods=['POST'])
+def process_query_stream():
+    """Streams the pipeline stages of a query as Server-Sent Events.
 
-        return jsonify({
-            'requestId': request_id,
-            'summary': answer_summary,
-            'searchResults': query_result if query_result else []
-        })
+    Emits "orchestrator", "sql_attempt", "traffic_light", "results", "summary_chunk" and "done" events as they
+    happen, so the first result rows reach the client before the Reporter has finished. Failures are reported
+    with an "error" event, since the status code has already been sent. The queries of the pipeline are killed
+    if the client disconnects, see `query_control.cancel_on_disconnect`.
+    """
+    data = request.json
+    user_question = data.get('query', '')
+    logger.info(f"Received streaming user query: {user_question}")
+    client_socket = request.environ.get('gunicorn.socket')
 
+    def generate():
+        with query_control.cancel_scope() as token, query_control.cancel_on_disconnect(client_socket, token):
+            try:
+                for event in iter_query_pipeline(user_question):
+                    yield format_sse(event)
+            except Exception as e:
+                logger.exception("Error processing streaming query")
+                yield format_sse({'event': 'error', 'error': str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.post('/api/jobs')
+def create_query_job():
+    """Queues a question and returns its job id at once, see `jobs.submit_query`. Poll /api/jobs/<job_id> for progress."""
+    data = request.json
+    user_question = data.get('query', '')
+    logger.info(f"Queued user query: {user_question}")
+    return jsonify({'jobId': jobs.submit_query(user_question)}), 202
+
+
+@app.post('/api/jobs/export/<request_id>')
+def create_export_job(request_id: str):
+    """Queues the export of the full results of a query, see `jobs.submit_export`.
+
+    The format ("xlsx", "csv", "parquet" or "arrow") is read from the `format` argument or JSON field. Once the job
+    is done, the file is served by /api/jobs/<job_id>/download.
+    """
+    export_format = request.args.get('format') or (request.get_json(silent=True) or {}).get('format', 'xlsx')
+    _, error = find_request_with_sql(request_id)
+    if error:
+        return error
+    try:
+        job_id = jobs.submit_export(request_id, export_format)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'jobId': job_id}), 202
+
+
+@app.get('/api/jobs/<job_id>')
+def job_status(job_id: str):
+    """Reports the status ("queued", "running", "done" or "failed"), the current stage and the partial results of a job."""
+    job = jobs.job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job id {job_id}"}), 404
+    return jsonify({
+        'jobId': job['job_id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'result': {key: value for key, value in job['result'].items() if key != 'path'},
+        'error': job['error'],
+        'createdAt': job['created_at'],
+        'updatedAt': job['updated_at']
+    })
+
+
+@app.get('/api/jobs/<job_id>/download')
+def download_job(job_id: str):
+    job = jobs.job_store.get(job_id)
+    if job is None or job['kind'] != 'export':
+        return jsonify({'error': f"Unknown export job id {job_id}"}), 404
+    if job['status'] != jobs.DONE:
+        return jsonify({'error': f"Export job {job_id} is {job['status']}", 'status': job['status']}), 409
+    result = job['result']
+    if not os.path.exists(result['path']):
+        return jsonify({'error': f"The export of job {job_id} has expired"}), 410
+    filename = f"chembl35_result_{datetime.fromtimestamp(job['updated_at']).strftime('%Y%m%d_%H%M%S')}.{result['extension']}"
+    return send_file(result['path'], mimetype=result['mimetype'], as_attachment=True, download_name=filename)
+
+
+@app.route('/api/query/<request_id>/rows', methods=['GET', 'POST'])
+def query_rows(request_id: str):
+    """Returns a page of the full results of a query, see `pagination.fetch_page`.
+
+    Paging, sorting and filtering parameters are read from the query string and, for POST, the JSON body, see
+    `pagination.parse_page_request`.
+    """
+    stored_request, error = find_request_with_sql(request_id)
+    if error:
+        return error
+    try:
+        page = parse_page_request({**request.args.to_dict(), **(request.get_json(silent=True) or {})})
+        return jsonify(fetch_page(stored_request, page))
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.exception("Error processing query")
+        logger.exception("Error fetching result rows")
         return jsonify({'error': str(e)}), 500
 
 
 @app.post("/api/download-excel/<request_id>")
 def download_excel(request_id: str):
-    results = execute_query(request_id2sql[request_id], limit=10000000)
+    stored_request, error = find_request_with_sql(request_id)
+    if error:
+        return error
     try:
-        df = pd.DataFrame(results)
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Search Results', index=False)
-            workbook = writer.book
-            worksheet = writer.sheets['Search Results']
-            header_format = workbook.add_format({
-                'bold': True,
-                'bg_color': '#D3D3D3',
-                'border': 1,
-                'align': 'center',
-                'valign': 'vcenter'
-            })
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
-            for i, col in enumerate(df.columns):
-                max_width = max(
-                    df[col].astype(str).map(len).max(),
-                    len(str(col))
-                ) + 2
-                worksheet.set_column(i, i, max_width)
-        output.seek(0)
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=".xlsx", dir=EXPORT_DIR)
+        os.close(fd)
+        try:
+            write_excel(snapshots.iter_request_batches(stored_request, snapshots.SNAPSHOT_WAIT_SECONDS), path)
+        except Exception:
+            os.remove(path)
+            raise
 
         filename = f"chembl35_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
 
-        return send_file(
-            output,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        response = send_file(
+            path,
+            mimetype=XLSX_MIMETYPE,
             as_attachment=True,
             download_name=filename
         )
+        response.call_on_close(lambda: os.remove(path))
+        return response
     except Exception as e:
         import traceback
         from flask import make_response
@@ -117,11 +312,48 @@ def download_excel(request_id: str):
         response.status_code = 500
         return response
 
+
+@app.route("/api/download-csv/<request_id>", methods=['GET', 'POST'], defaults={'export_format': 'csv'})
+@app.route("/api/download-parquet/<request_id>", methods=['GET', 'POST'], defaults={'export_format': 'parquet'})
+@app.route("/api/download-arrow/<request_id>", methods=['GET', 'POST'], defaults={'export_format': 'arrow'})
+def download_stream(request_id: str, export_format: str):
+    """Streams the full results of a query as gzip CSV, Parquet or Arrow IPC with chunked transfer encoding.
+
+    Results are read from the request's snapshot when it has one (a Parquet snapshot is sent as is), and fetched
+    from the database otherwise. The query is started before the response, so SQL errors still produce a 500; rows
+    are then fetched, encoded and sent batch by batch without ever materializing the full result.
+    """
+    stored_request, error = find_request_with_sql(request_id)
+    if error:
+        return error
+    stream, mimetype, extension = STREAM_FORMATS[export_format]
+    filename = f"chembl35_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    snapshot = snapshots.find_snapshot(stored_request, snapshots.SNAPSHOT_WAIT_SECONDS)
+    if snapshot is not None and export_format == 'parquet':
+        return send_file(snapshot, mimetype=mimetype, as_attachment=True, download_name=filename)
+    try:
+        batches = snapshots.iter_snapshot_batches(snapshot) if snapshot else iter_query_batches(stored_request['sql'], limit=10000000)
+        first_batch = next(batches)
+    except Exception as e:
+        logger.exception(f"Error starting {export_format} export")
+        return jsonify({'error': str(e)}), 500
+
+    return Response(
+        stream(itertools.chain([first_batch], batches)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
 @app.route('/api/literature', methods=['POST'])
 def process_lit_query():
     data = request.get_json()
     user_question = data.get('query', '')
-    answer = generate_answer(user_question)
+    tracker = usage.track_request()
+    try:
+        answer = generate_answer(user_question)
+    finally:
+        usage.finish_request(tracker, None)
     return jsonify({'summary': answer})
 
 if __name__ == '__main__':
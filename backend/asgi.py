@@ -0,0 +1,76 @@
+"""ASGI entry point: the query endpoints run on the asyncio pipeline, every other route on the Flask app.
+
+A question waiting on the model or on MySQL only holds a coroutine, so one process serves dozens of questions at
+once instead of one per sync worker. Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --timeout-keep-alive 120
+"""
+import logging
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app
+from pipeline import format_sse, iter_query_pipeline_async, run_query_pipeline_async
+
+logger = logging.getLogger(__name__)
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+
+
+async def options(request: Request) -> Response:
+    return Response(headers={
+        **CORS_HEADERS,
+        'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+    })
+
+
+async def process_query(request: Request) -> JSONResponse:
+    try:
+        data = await request.json()
+        user_question = data.get('query', '')
+        logger.info(f"Received user query: {user_question}")
+
+        result = await run_query_pipeline_async(user_question)
+
+        return JSONResponse({
+            'requestId': result['requestId'],
+            'summary': result['summary'],
+            'searchResults': result['searchResults']
+        }, headers=CORS_HEADERS)
+    except Exception as e:
+        logger.exception("Error processing query")
+        return JSONResponse({'error': str(e)}, status_code=500, headers=CORS_HEADERS)
+
+
+async def process_query_stream(request: Request) -> StreamingResponse:
+    """Streams the pipeline stages of a query as Server-Sent Events, like the Flask route of the same path."""
+    data = await request.json()
+    user_question = data.get('query', '')
+    logger.info(f"Received streaming user query: {user_question}")
+
+    async def generate():
+        try:
+            async for event in iter_query_pipeline_async(user_question):
+                yield format_sse(event)
+        except Exception as e:
+            logger.exception("Error processing streaming query")
+            yield format_sse({'event': 'error', 'error': str(e)})
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={**CORS_HEADERS, 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+app = Starlette(routes=[
+    Route('/api/query', process_query, methods=['POST']),
+    Route('/api/query/stream', process_query_stream, methods=['POST']),
+    Route('/api/query', options, methods=['OPTIONS']),
+    Route('/api/query/stream', options, methods=['OPTIONS']),
+    Mount('/', WSGIMiddleware(flask_app))
+])
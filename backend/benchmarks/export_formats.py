@@ -0,0 +1,122 @@
+"""Benchmarks the export formats on synthetic, activities-shaped query results.
+
+Each format runs in a fresh process, so the reported peak RSS is that format's own. "xlsx_legacy" is the former
+download path: fetchall into a list of dicts, a pandas DataFrame and an in-memory workbook.
+
+Run from the backend directory:
+    python -m benchmarks.export_formats [--rows 200000] [--batch-size 5000] [--json results.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from io import BytesIO
+
+FORMATS = ("xlsx_legacy", "xlsx", "csv_gzip", "parquet", "arrow")
+COLUMNS = ["activity_id", "molregno", "standard_type", "standard_relation", "standard_value", "standard_units",
+           "pchembl_value", "assay_description", "canonical_smiles"]
+STANDARD_TYPES = ["IC50", "Ki", "EC50", "Kd", "Potency", "Inhibition", "Activity"]
+
+
+def synthetic_batches(rows: int, batch_size: int, seed: int = 0):
+    """Yields (columns, rows) batches shaped like an activities export, see `utils.iter_query_batches`."""
+    rng = random.Random(seed)
+    for start in range(0, rows, batch_size):
+        batch = []
+        for activity_id in range(start, min(start + batch_size, rows)):
+            value = rng.lognormvariate(5, 2) if rng.random() > 0.1 else None
+            batch.append((
+                activity_id,
+                rng.randint(1, 2500000),
+                rng.choice(STANDARD_TYPES),
+                "=",
+                value,
+                "nM" if value is not None else None,
+                round(rng.uniform(4, 10), 2) if value is not None and rng.random() > 0.4 else None,
+                f"Inhibition of human target {rng.randint(1, 9999)} expressed in HEK293 cells, assay {activity_id % 977}",
+                "C" * rng.randint(10, 40) + "(=O)N"
+            ))
+        yield COLUMNS, batch
+
+
+def run_format(export_format: str, rows: int, batch_size: int, queue) -> None:
+    import exporters
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if export_format in ("xlsx", "xlsx_legacy"):
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            if export_format == "xlsx":
+                exporters.write_excel(synthetic_batches(rows, batch_size), path)
+            else:
+                _write_excel_legacy(rows, batch_size, path)
+            size = os.path.getsize(path)
+        finally:
+            os.remove(path)
+    else:
+        stream = {"csv_gzip": exporters.stream_csv_gzip, "parquet": exporters.stream_parquet, "arrow": exporters.stream_arrow}[export_format]
+        size = sum(len(chunk) for chunk in stream(synthetic_batches(rows, batch_size)))
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        "format": export_format,
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed,
+        "output_mb": size / 1e6,
+        "peak_rss_mb": peak_rss / 1024,
+        "rss_growth_mb": (peak_rss - baseline_rss) / 1024,
+    })
+
+
+def _write_excel_legacy(rows: int, batch_size: int, path: str) -> None:
+    import pandas as pd
+
+    results = [dict(zip(columns, row)) for columns, batch in synthetic_batches(rows, batch_size) for row in batch]
+    df = pd.DataFrame(results)
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, sheet_name='Search Results', index=False)
+        worksheet = writer.sheets['Search Results']
+        for i, col in enumerate(df.columns):
+            worksheet.set_column(i, i, max(df[col].map(lambda value: len(str(value))).max(), len(str(col))) + 2)
+    with open(path, "wb") as f:
+        f.write(output.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=FORMATS)
+    parser.add_argument("--json", help="Write the results to this file.")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for export_format in args.formats:
+        queue = context.Queue()
+        process = context.Process(target=run_format, args=(export_format, args.rows, args.batch_size, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"{export_format:<12} failed (exit code {process.exitcode})")
+            continue
+        result = queue.get()
+        results.append(result)
+        print(f"{export_format:<12} {result['seconds']:7.2f}s {result['rows_per_second']:>10,.0f} rows/s "
+              f"{result['output_mb']:8.1f} MB out  peak RSS {result['peak_rss_mb']:7.1f} MB "
+              f"(+{result['rss_growth_mb']:.1f} MB)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Load-tests the sync and asyncio pipelines in one process, with simulated model and database latency.
+
+The model and the database are replaced by stand-ins that wait for a fixed time (blocking for the sync path,
+awaiting for the async one), so the benchmark measures how many questions one worker process completes per
+second, not the speed of Vertex AI or MySQL:
+    - "sync": one question at a time, as a gunicorn sync worker serves them.
+    - "threads": questions on a thread pool, as a gthread worker serves them (capped by LLM_MAX_CONCURRENCY).
+    - "async": questions as concurrent coroutines on one event loop, as the ASGI entry point serves them.
+
+Run from the backend directory:
+    python -m benchmarks.pipeline_concurrency [--questions 64] [--concurrency 32] [--llm-latency 0.2] [--json results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="pipeline_concurrency_"))
+os.environ["QUESTION_CACHE"] = "0"
+os.environ["SNAPSHOTS"] = "0"
+
+import db_agent  # noqa: E402
+import llm_client  # noqa: E402
+import utils  # noqa: E402
+from pipeline import run_query_pipeline, run_query_pipeline_async  # noqa: E402
+
+SQL = "SELECT molregno, pref_name FROM molecule_dictionary WHERE max_phase = 4"
+ROWS = [{"molregno": i, "pref_name": f"DRUG {i}"} for i in range(100)]
+
+
+class FakeModel:
+    """Answers like Gemini would for each agent, after `latency` seconds."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, contents, tools=None, **kwargs):
+        time.sleep(self.latency)
+        return self._response(tools)
+
+    async def generate_content_async(self, contents, tools=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._response(tools)
+
+    @staticmethod
+    def _response(tools):
+        if tools is None:
+            function_calls, text = [], "Instructions or summary text."
+        elif tools[0] is db_agent.create_execute_query_tool():
+            function_calls, text = [SimpleNamespace(args={"query": SQL})], ""
+        else:
+            function_calls, text = [SimpleNamespace(args={"color": "green"})], ""
+        part = SimpleNamespace(text=text)
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]), function_calls=function_calls)])
+
+
+def install_fakes(llm_latency: float, db_latency: float) -> None:
+    model = FakeModel(llm_latency)
+    llm_client.get_model = lambda model_name: model
+
+    def execute_query(query, limit=100, use_cache=True, offset=0, timeout_ms=0):
+        time.sleep(db_latency)
+        return [dict(row) for row in ROWS[:limit]]
+
+    utils.execute_query = execute_query
+    db_agent.execute_query = execute_query
+
+
+def run_sync(questions: list[str]) -> list[float]:
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        run_query_pipeline(question)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_threads(questions: list[str], threads: int) -> list[float]:
+    def timed(question):
+        start = time.perf_counter()
+        run_query_pipeline(question)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(timed, questions))
+
+
+def run_async(questions: list[str], concurrency: int) -> list[float]:
+    async def main():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def timed(question):
+            async with slots:
+                start = time.perf_counter()
+                await run_query_pipeline_async(question)
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*(timed(question) for question in questions))
+
+    return asyncio.run(main())
+
+
+def summarize(mode: str, questions: int, seconds: float, latencies: list[float]) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "mode": mode,
+        "questions": questions,
+        "seconds": seconds,
+        "questions_per_second": questions / seconds,
+        "p50_seconds": statistics.median(latencies),
+        "p95_seconds": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=64, help="Questions per concurrent mode.")
+    parser.add_argument("--sync-questions", type=int, default=8, help="Questions for the one-at-a-time mode.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Questions in flight for the async mode.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads for the threads mode.")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per model call.")
+    parser.add_argument("--db-latency", type=float, default=0.05, help="Seconds per SQL query.")
+    parser.add_argument("--json", help="Write the results to this file.")
+    args = parser.parse_args()
+
+    install_fakes(args.llm_latency, args.db_latency)
+    modes = [
+        ("sync", args.sync_questions, lambda questions: run_sync(questions)),
+        (f"threads x{args.threads}", args.questions, lambda questions: run_threads(questions, args.threads)),
+        (f"async x{args.concurrency}", args.questions, lambda questions: run_async(questions, args.concurrency)),
+    ]
+    results = []
+    for mode, count, run in modes:
+        questions = [f"Which approved drugs target kinase number {i}?" for i in range(count)]
+        start = time.perf_counter()
+        latencies = run(questions)
+        result = summarize(mode, count, time.perf_counter() - start, latencies)
+        results.append(result)
+        print(f"{mode:<12} {result['questions_per_second']:7.2f} questions/s  p50 {result['p50_seconds']:.2f}s  "
+              f"p95 {result['p95_seconds']:.2f}s  ({count} questions in {result['seconds']:.1f}s)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
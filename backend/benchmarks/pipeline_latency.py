@@ -0,0 +1,381 @@
+"""Measures the end-to-end latency of the pipeline over questions.txt, offline and reproducibly.
+
+Every question runs through `generate_instructions_with_orchestrator` -> `db_agent_loop` ->
+`generate_summary_with_reporter`, with the real prompt building (schema and protein class selection), but:
+    - the model is a fake answering each agent after a latency drawn from a per-agent distribution, with scripted
+      responses from a JSON file (--responses) or synthetic ones. The Checker gives the red light with probability
+      --red-rate, so questions take a realistic number of Writer/Checker rounds.
+    - the database is a local SQLite fixture with ChEMBL-shaped activities, assays, target_dictionary and
+      molecule_dictionary tables, built in a temporary directory unless --database points at an existing file.
+
+Random draws are seeded per question and repetition, so two runs of the same commit simulate the same latencies
+and rounds, and the JSON results of two commits can be diffed (or compared with --baseline).
+
+Latency distributions are "fixed:SECONDS", "uniform:LOW:HIGH" or "lognormal:MEDIAN:SIGMA", per agent, e.g.
+--latency writer=lognormal:1.2:0.3. --time-scale shrinks every simulated latency, to keep runs short.
+
+Run from the backend directory:
+    python -m benchmarks.pipeline_latency [--repeat 3] [--time-scale 0.1] [--json results.json] [--baseline old.json]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Callable
+
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="pipeline_latency_"))
+os.environ["RESULT_CACHE"] = "0"
+
+import db_agent  # noqa: E402
+import llm_client  # noqa: E402
+import usage  # noqa: E402
+import utils  # noqa: E402
+from benchmarks.schema_pruning import load_questions  # noqa: E402
+from orch_agent import generate_instructions_with_orchestrator  # noqa: E402
+from reporter_agent import generate_summary_with_reporter  # noqa: E402
+
+AGENTS = ("orchestrator", "writer", "checker", "reporter")
+DEFAULT_LATENCIES = {
+    "orchestrator": "lognormal:4.0:0.35",
+    "writer": "lognormal:1.6:0.3",
+    "checker": "lognormal:1.0:0.3",
+    "reporter": "lognormal:6.0:0.35",
+}
+CHARS_PER_TOKEN = 4
+STANDARD_TYPES = ("IC50", "Ki", "Kd", "EC50", "Potency", "Inhibition")
+TARGET_TYPES = ("SINGLE PROTEIN", "PROTEIN COMPLEX", "PROTEIN FAMILY", "ORGANISM", "CELL-LINE")
+
+WRITER_TEMPLATES = (
+    "SELECT md.chembl_id, md.pref_name, md.max_phase, td.pref_name AS target, act.standard_type, act.standard_value, "
+    "act.standard_units FROM activities act JOIN assays a ON a.assay_id = act.assay_id "
+    "JOIN target_dictionary td ON td.tid = a.tid JOIN molecule_dictionary md ON md.molregno = act.molregno "
+    "WHERE td.pref_name LIKE '%{keyword}%' AND act.standard_type IN ('IC50', 'Ki') ORDER BY act.standard_value LIMIT 100",
+    "SELECT td.chembl_id, td.pref_name, COUNT(*) AS activities, MIN(act.standard_value) AS best_value "
+    "FROM activities act JOIN assays a ON a.assay_id = act.assay_id JOIN target_dictionary td ON td.tid = a.tid "
+    "WHERE td.pref_name LIKE '%{keyword}%' GROUP BY td.chembl_id, td.pref_name ORDER BY activities DESC LIMIT 100",
+    "SELECT md.chembl_id, md.pref_name, md.max_phase, COUNT(DISTINCT a.tid) AS targets FROM molecule_dictionary md "
+    "JOIN activities act ON act.molregno = md.molregno JOIN assays a ON a.assay_id = act.assay_id "
+    "WHERE md.max_phase >= 2 GROUP BY md.molregno ORDER BY targets DESC LIMIT 100",
+)
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Parses a latency distribution ("fixed:S", "uniform:LOW:HIGH" or "lognormal:MEDIAN:SIGMA") into a sampler."""
+    kind, *values = spec.split(":")
+    values = [float(value) for value in values]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+class FakeModel:
+    """Answers like Gemini would for each agent, after a latency drawn from the agent's distribution.
+
+    Text calls are attributed to the stage the harness is running (Orchestrator or Reporter), function calls to
+    the Writer or the Checker by their tool. Responses come from the question's script when it has one.
+    """
+
+    def __init__(self, latencies: dict[str, Callable[[random.Random], float]], red_rate: float, scripts: dict, time_scale: float):
+        self.latencies = latencies
+        self.red_rate = red_rate
+        self.scripts = scripts
+        self.time_scale = time_scale
+        self.stage = "orchestrator"
+        self.question = ""
+        self.rng = random.Random(0)
+        self.calls = {agent: 0 for agent in AGENTS}
+
+    def start_question(self, question: str, seed: str) -> None:
+        self.question, self.rng = question, random.Random(seed)
+        self.calls = {agent: 0 for agent in AGENTS}
+
+    def generate_content(self, contents, tools=None, **kwargs):
+        if tools is None:
+            agent = self.stage
+        elif tools[0] is db_agent.create_execute_query_tool():
+            agent = "writer"
+        else:
+            agent = "checker"
+        call = self.calls[agent]
+        self.calls[agent] += 1
+        time.sleep(self.latencies[agent](self.rng) * self.time_scale)
+        text, function_calls = self._answer(agent, call)
+        prompt_chars = sum(len(part.text) for content in contents for part in content.parts)
+        part = SimpleNamespace(text=text)
+        return SimpleNamespace(
+            candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]), function_calls=function_calls)],
+            usage_metadata=SimpleNamespace(prompt_token_count=prompt_chars // CHARS_PER_TOKEN,
+                                           candidates_token_count=len(text) // CHARS_PER_TOKEN)
+        )
+
+    def _answer(self, agent: str, call: int) -> tuple[str, list]:
+        script = self.scripts.get(self.question, {})
+        if agent == "writer":
+            queries = script.get("writer") or [template.format(keyword=keyword(self.question)) for template in WRITER_TEMPLATES]
+            return "", [SimpleNamespace(args={"query": queries[call % len(queries)]})]
+        if agent == "checker":
+            colors = script.get("checker")
+            color = colors[call] if colors and call < len(colors) else ("red" if self.rng.random() < self.red_rate else "green")
+            return "", [SimpleNamespace(args={"color": color})]
+        default = f"{agent.capitalize()} text for: {self.question}\n" + "Lorem ipsum dolor sit amet. " * 40
+        return script.get(agent, default), []
+
+
+def keyword(question: str) -> str:
+    """The longest word of a question, which the synthetic Writer queries look up in the target names."""
+    words = [word.strip("?,.()'\"") for word in question.split()]
+    return max(words, key=len).replace("'", "")
+
+
+def build_fixture(path: str, questions: list[str], scale: float, seed: int = 0) -> dict:
+    """Builds a small ChEMBL-shaped SQLite database: molecules, targets named after the question vocabulary (so the
+    Writer queries find rows), assays, and activities skewed towards a few popular targets and compounds.
+
+    Returns:
+        dict: The number of rows per table.
+    """
+    rng = random.Random(seed)
+    counts = {"molecule_dictionary": int(5000 * scale), "target_dictionary": int(300 * scale),
+              "assays": int(3000 * scale), "activities": int(50000 * scale)}
+    vocabulary = sorted({keyword(question) for question in questions} | {
+        word.strip("?,.()'\"") for question in questions for word in question.split() if len(word) > 6
+    })
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE molecule_dictionary (molregno INTEGER PRIMARY KEY, chembl_id TEXT UNIQUE, pref_name TEXT, max_phase REAL);
+        CREATE TABLE target_dictionary (tid INTEGER PRIMARY KEY, chembl_id TEXT UNIQUE, pref_name TEXT, target_type TEXT);
+        CREATE TABLE assays (assay_id INTEGER PRIMARY KEY, chembl_id TEXT UNIQUE, tid INTEGER REFERENCES target_dictionary (tid),
+                             assay_type TEXT);
+        CREATE TABLE activities (activity_id INTEGER PRIMARY KEY, assay_id INTEGER REFERENCES assays (assay_id),
+                                 molregno INTEGER REFERENCES molecule_dictionary (molregno), standard_type TEXT,
+                                 standard_value REAL, standard_units TEXT);
+    """)
+    conn.executemany("INSERT INTO molecule_dictionary VALUES (?, ?, ?, ?)", [
+        (i, f"CHEMBL{i}", f"DRUG-{i}" if rng.random() < 0.2 else None, rng.choice((None, 0.5, 1, 2, 3, 4)))
+        for i in range(1, counts["molecule_dictionary"] + 1)
+    ])
+    conn.executemany("INSERT INTO target_dictionary VALUES (?, ?, ?, ?)", [
+        (i, f"CHEMBL{1000000 + i}", f"{rng.choice(vocabulary)} {rng.choice(('receptor', 'kinase', 'protease', 'channel'))} {i}",
+         rng.choice(TARGET_TYPES))
+        for i in range(1, counts["target_dictionary"] + 1)
+    ])
+    conn.executemany("INSERT INTO assays VALUES (?, ?, ?, ?)", [
+        (i, f"CHEMBL{2000000 + i}", _skewed(rng, counts["target_dictionary"]), rng.choice("BFAT"))
+        for i in range(1, counts["assays"] + 1)
+    ])
+    conn.executemany("INSERT INTO activities VALUES (?, ?, ?, ?, ?, ?)", [
+        (i, _skewed(rng, counts["assays"]), _skewed(rng, counts["molecule_dictionary"]), rng.choice(STANDARD_TYPES),
+         round(rng.lognormvariate(math.log(500), 2.0), 2), "nM")
+        for i in range(1, counts["activities"] + 1)
+    ])
+    conn.executescript("""
+        CREATE INDEX activities_assay_id ON activities (assay_id);
+        CREATE INDEX activities_molregno ON activities (molregno);
+        CREATE INDEX assays_tid ON assays (tid);
+    """)
+    conn.commit()
+    conn.close()
+    return counts
+
+
+def _skewed(rng: random.Random, n: int) -> int:
+    """A key between 1 and n, Zipf-like: a few keys get most of the references, as targets and compounds do in ChEMBL."""
+    return min(n, int(rng.paretovariate(1.2)) if rng.random() < 0.5 else rng.randint(1, n))
+
+
+def install_fakes(model: FakeModel, database: str, timings: dict) -> None:
+    """Routes the model calls to `model`, the SQL queries to the SQLite `database`, and records the time of every
+    Writer, Checker and SQL call in `timings`."""
+    llm_client.get_model = lambda model_name: model
+    local = threading.local()
+
+    def execute_query(query, limit=100, use_cache=True, offset=0, timeout_ms=0):
+        if getattr(local, "conn", None) is None:
+            local.conn = sqlite3.connect(database)
+            local.conn.row_factory = sqlite3.Row
+        sql = utils.remove_limit_clause(query)
+        try:
+            cursor = local.conn.execute(f"{sql} LIMIT -1 OFFSET {offset}" if offset else sql)
+            return [dict(row) for row in cursor.fetchmany(limit)]
+        except sqlite3.Error as e:
+            return f"Error: {e}"
+
+    def timed(name, function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.setdefault(name, []).append(time.perf_counter() - start)
+        return wrapper
+
+    utils.execute_query = execute_query
+    db_agent.execute_query = timed("sql", execute_query)
+    db_agent.generate_sql_with_writer = timed("writer", db_agent.generate_sql_with_writer)
+    db_agent.evaluate_query_with_checker = timed("checker", db_agent.evaluate_query_with_checker)
+
+
+def run_question(model: FakeModel, question: str, seed: str, max_depth: int) -> dict:
+    """Runs one question through the three stages and returns its stage timings, rounds and tokens."""
+    model.start_question(question, seed)
+    tracker = usage.track_request()
+    timings = {}
+
+    start = time.perf_counter()
+    model.stage = "orchestrator"
+    _, writer_input = generate_instructions_with_orchestrator(question)
+    timings["orchestrator"] = time.perf_counter() - start
+
+    stage_start = time.perf_counter()
+    sql_query, query_result = db_agent.db_agent_loop(question, writer_input, "", "", 0, max_depth)
+    timings["db_agent"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    model.stage = "reporter"
+    generate_summary_with_reporter(question, writer_input, sql_query, query_result)
+    timings["reporter"] = time.perf_counter() - stage_start
+    timings["total"] = time.perf_counter() - start
+
+    summary = usage.finish_request(tracker, None)
+    return {
+        "question": question,
+        "seed": seed,
+        "timings": timings,
+        "rounds": model.calls["checker"],
+        "rows": len(query_result) if isinstance(query_result, list) else 0,
+        "prompt_tokens": {agent: stats["promptTokens"] for agent, stats in summary["agents"].items()},
+    }
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize_stage(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50_seconds": statistics.median(values),
+        "p95_seconds": percentile(values, 0.95),
+        "mean_seconds": statistics.fmean(values),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_path: str) -> None:
+    """Prints the p50/p95 change of every stage against the results of an earlier run."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nAgainst {baseline_path} (commit {baseline.get('commit')}):")
+    for stage, stats in results["stages"].items():
+        old = baseline["stages"].get(stage)
+        if old is None:
+            continue
+        changes = "  ".join(
+            f"{key[:3]} {old[key]:.3f}s -> {stats[key]:.3f}s ({stats[key] / old[key] - 1:+.1%})" if old[key] else ""
+            for key in ("p50_seconds", "p95_seconds")
+        )
+        print(f"{stage:<13} {changes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", default="questions.txt")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per question, each with its own seed.")
+    parser.add_argument("--max-depth", type=int, default=5, help="The maximum number of Writer/Checker rounds.")
+    parser.add_argument("--latency", action="append", default=[], metavar="AGENT=DISTRIBUTION",
+                        help="Latency distribution of an agent's model calls, e.g. writer=lognormal:1.2:0.3.")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Factor applied to every simulated latency.")
+    parser.add_argument("--red-rate", type=float, default=0.3, help="Probability that the Checker gives the red light.")
+    parser.add_argument("--responses", help="JSON file of scripted responses per question: orchestrator, writer "
+                                            "(list of SQL), checker (list of colors), reporter.")
+    parser.add_argument("--database", help="An existing SQLite database to query instead of the built-in fixture, e.g. "
+                                           "one generated by benchmarks.synthetic_chembl.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size factor of the built-in fixture.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="Also report the peak Python heap (slower).")
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--baseline", help="Compare with the JSON results of an earlier run.")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    specs = {**DEFAULT_LATENCIES, **dict(latency.split("=", 1) for latency in args.latency)}
+    scripts = {}
+    if args.responses:
+        with open(args.responses, "r", encoding="utf-8") as f:
+            scripts = json.load(f)
+
+    database, fixture = args.database, None
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(prefix="pipeline_latency_db_"), "chembl_fixture.sqlite3")
+        fixture = build_fixture(database, questions, args.scale, args.seed)
+
+    model = FakeModel({agent: parse_latency(specs[agent]) for agent in AGENTS}, args.red_rate, scripts, args.time_scale)
+    calls = {}
+    install_fakes(model, database, calls)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    runs = []
+    start = time.perf_counter()
+    for repetition in range(args.repeat):
+        for number, question in enumerate(questions):
+            run = run_question(model, question, f"{args.seed}:{repetition}:{number}", args.max_depth)
+            runs.append(run)
+            print(f"{question[:60]:<60} rounds={run['rounds']} rows={run['rows']:>3} "
+                  + " ".join(f"{stage}={seconds:.2f}s" for stage, seconds in run["timings"].items()))
+    seconds = time.perf_counter() - start
+
+    stages = {stage: summarize_stage([run["timings"][stage] for run in runs]) for stage in runs[0]["timings"]}
+    stages.update({name: summarize_stage(values) for name, values in calls.items()})
+    rounds = [run["rounds"] for run in runs]
+    memory = {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    if args.trace_memory:
+        memory["peak_python_heap_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    results = {
+        "commit": git_commit(),
+        "config": {**{key: value for key, value in vars(args).items() if key not in ("json", "baseline", "latency")},
+                   "latencies": specs, "fixture": fixture},
+        "questions": len(runs),
+        "seconds": seconds,
+        "stages": stages,
+        "rounds": {"mean": statistics.fmean(rounds), "max": max(rounds),
+                   "distribution": {str(count): rounds.count(count) for count in sorted(set(rounds))}},
+        "memory": memory,
+        "runs": runs,
+    }
+
+    print(f"\n{len(runs)} questions in {seconds:.1f}s, {results['rounds']['mean']:.2f} Writer/Checker rounds per "
+          f"question, peak RSS {memory['peak_rss_mb']:.0f} MB")
+    for stage, stats in stages.items():
+        print(f"{stage:<13} p50 {stats['p50_seconds']:.3f}s  p95 {stats['p95_seconds']:.3f}s  ({stats['count']} calls)")
+    if args.baseline:
+        compare(results, args.baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
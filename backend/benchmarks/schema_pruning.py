@@ -0,0 +1,75 @@
+"""Benchmarks per-question schema pruning over questions.txt.
+
+Reports, for every question, how many tables are kept and how many schema characters / estimated prompt tokens
+the Orchestrator, Writer and Checker prompts save, how many protein classification characters each Writer round
+saves, plus the time spent selecting the tables.
+
+Run from the backend directory:
+    python -m benchmarks.schema_pruning [--repeat 50] [--json results.json]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from database_schema import DATABASE_SCHEMA, TABLES
+from protein_classification import select_classification
+from schema_index import select_schema, select_tables, SCHEMA_TOP_K, SCHEMA_ORCHESTRATOR_TOP_K
+
+CHARS_PER_TOKEN = 4
+
+
+def load_questions(path: str = "questions.txt") -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [question.strip() for question in f.read().split("\n\n") if question.strip()]
+
+
+def benchmark_question(question: str, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        select_tables.cache_clear()
+        start = time.perf_counter()
+        orchestrator_schema = select_schema(question, SCHEMA_ORCHESTRATOR_TOP_K)
+        agent_schema = select_schema(question, SCHEMA_TOP_K)
+        timings.append(time.perf_counter() - start)
+    full = len(DATABASE_SCHEMA)
+    # One Orchestrator prompt, plus one Writer and one Checker prompt per round.
+    full_chars = 3 * full
+    pruned_chars = len(orchestrator_schema) + 2 * len(agent_schema)
+    return {
+        "question": question,
+        "tables": select_tables(question, SCHEMA_TOP_K),
+        "full_schema_tokens": full_chars // CHARS_PER_TOKEN,
+        "pruned_schema_tokens": pruned_chars // CHARS_PER_TOKEN,
+        "reduction": 1 - pruned_chars / full_chars,
+        "protein_class_chars": len(select_classification(question)),
+        "full_protein_class_chars": len(TABLES),
+        "selection_ms_p50": statistics.median(timings) * 1000,
+        "selection_ms_max": max(timings) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", default="questions.txt")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", help="Write the results to this file.")
+    args = parser.parse_args()
+
+    results = [benchmark_question(question, args.repeat) for question in load_questions(args.questions)]
+    for result in results:
+        print(f"{result['question'][:60]:<60} tables={len(result['tables']):>2} "
+              f"tokens {result['full_schema_tokens']:>6} -> {result['pruned_schema_tokens']:>6} "
+              f"(-{result['reduction']:.0%}) protein classes {result['full_protein_class_chars']} -> "
+              f"{result['protein_class_chars']} chars select p50={result['selection_ms_p50']:.2f}ms")
+    full = sum(result["full_schema_tokens"] for result in results)
+    pruned = sum(result["pruned_schema_tokens"] for result in results)
+    print(f"\nSchema tokens for the Orchestrator and one Writer/Checker round, {len(results)} questions: "
+          f"{full} -> {pruned} (-{1 - pruned / full:.0%})")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,565 @@
+"""Generates a synthetic database shaped like chembl_35, to benchmark queries, exports and pagination at scale.
+
+Every table, column and key of `DATABASE_SCHEMA` (parsed by `schema_index`) is created and filled with random rows:
+    - primary keys are 1..N (or a vocabulary for the lookup tables keyed by text), one-to-one tables (compound
+      structures and properties, ligand efficiencies...) reuse the keys of the table they extend, and ChEMBL ids are
+      unique and registered in chembl_id_lookup.
+    - foreign keys follow a Zipf-like distribution over the referenced keys, so a few assays, targets and compounds
+      hold most of the activities, as in ChEMBL. The popular keys of a table are the same for every reference.
+    - activities, assays, target_dictionary, molecule_dictionary, compound_properties and docs get realistic value
+      distributions (activity types and units, log-normal potencies and matching pChEMBL values, assay types and
+      confidence scores, target types and organisms, clinical phases and approved drug names...); other columns get
+      generic values by type.
+
+At scale 1 the large tables hold about 1% of the rows of chembl_35 (210k activities); 100 is about its full size.
+Lookup tables keep their size. Rows are generated in batches from seeded generators, so a scale and seed always
+produce the same database.
+
+Run from the backend directory, into SQLite or into a MySQL database on the local server (MYSQL_USER and
+MYSQL_PASSWORD). The MySQL database must be named explicitly; it is created if missing, and writing into
+CHEMBL_VERSION, any chembl_<release> database or a remote server is refused, since --replace drops its tables:
+    python -m benchmarks.synthetic_chembl --scale 10 --sqlite chembl_10x.sqlite3
+    python -m benchmarks.synthetic_chembl --scale 1 --mysql --mysql-database chembl_synthetic --replace
+"""
+import argparse
+import math
+import os
+import re
+import sqlite3
+import time
+from typing import Callable, Iterator
+
+import numpy as np
+
+from schema_index import TABLES_BY_NAME, SchemaColumn, SchemaTable
+
+# Rows at scale 1, about 1% of chembl_35. Tables missing here get DEFAULT_ROWS per unit of scale.
+BASE_ROWS = {
+    "ACTIVITIES": 210_000,
+    "ACTIVITY_PROPERTIES": 18_000,
+    "ACTIVITY_SUPP": 6_000,
+    "ACTIVITY_SUPP_MAP": 6_000,
+    "ASSAYS": 17_000,
+    "ASSAY_CLASS_MAP": 1_000,
+    "ASSAY_PARAMETERS": 3_000,
+    "BIO_COMPONENT_SEQUENCES": 150,
+    "COMPONENT_SEQUENCES": 110,
+    "COMPONENT_CLASS": 110,
+    "COMPONENT_GO": 500,
+    "COMPONENT_SYNONYMS": 900,
+    "COMPOUND_PROPERTIES": 24_000,
+    "COMPOUND_RECORDS": 29_000,
+    "COMPOUND_STRUCTURAL_ALERTS": 69_000,
+    "COMPOUND_STRUCTURES": 24_000,
+    "DOCS": 900,
+    "DRUG_INDICATION": 550,
+    "DRUG_MECHANISM": 80,
+    "LIGAND_EFF": 90_000,
+    "MOLECULE_DICTIONARY": 25_000,
+    "MOLECULE_HIERARCHY": 25_000,
+    "MOLECULE_SYNONYMS": 2_000,
+    "TARGET_COMPONENTS": 170,
+    "TARGET_DICTIONARY": 160,
+}
+DEFAULT_ROWS = 100
+# Lookup tables, whose size does not grow with the data.
+FIXED_ROWS = {
+    "ACTIVITY_SMID": 100,
+    "ACTIVITY_STDS_LOOKUP": 150,
+    "ASSAY_CLASSIFICATION": 300,
+    "ATC_CLASSIFICATION": 500,
+    "BIOASSAY_ONTOLOGY": 300,
+    "CHEMBL_RELEASE": 35,
+    "CONFIDENCE_SCORE_LOOKUP": 10,
+    "FRAC_CLASSIFICATION": 50,
+    "GO_CLASSIFICATION": 300,
+    "HRAC_CLASSIFICATION": 50,
+    "IRAC_CLASSIFICATION": 50,
+    "ORGANISM_CLASS": 200,
+    "PATENT_USE_CODES": 100,
+    "PROTEIN_CLASSIFICATION": 200,
+    "SOURCE": 70,
+    "STRUCTURAL_ALERT_SETS": 8,
+    "STRUCTURAL_ALERTS": 1_300,
+    "USAN_STEMS": 800,
+    "VERSION": 1,
+}
+# Lookup tables keyed by text, with their keys (and the share of references to each, when known).
+LOOKUP_KEYS = {
+    "ASSAY_TYPE": {"B": 0.45, "F": 0.40, "A": 0.08, "T": 0.05, "P": 0.01, "U": 0.01},
+    "TARGET_TYPE": {"SINGLE PROTEIN": 0.60, "ORGANISM": 0.12, "CELL-LINE": 0.10, "PROTEIN COMPLEX": 0.05,
+                    "PROTEIN FAMILY": 0.04, "TISSUE": 0.03, "SELECTIVITY GROUP": 0.02, "NUCLEIC-ACID": 0.02,
+                    "PROTEIN-PROTEIN INTERACTION": 0.01, "UNKNOWN": 0.01},
+    "RELATIONSHIP_TYPE": {"D": 0.55, "H": 0.10, "M": 0.05, "N": 0.25, "S": 0.03, "U": 0.02},
+    "CURATION_LOOKUP": {"autocuration": 0.75, "intermediate": 0.15, "expert": 0.10},
+    "DATA_VALIDITY_LOOKUP": {"Outside typical range": 0.5, "Non standard unit for type": 0.2, "Potential missing data": 0.1,
+                             "Potential transcription error": 0.1, "Potential author error": 0.05, "Manually validated": 0.05},
+    "ACTION_TYPE": {"INHIBITOR": 0.40, "ANTAGONIST": 0.20, "AGONIST": 0.15, "BLOCKER": 0.06, "MODULATOR": 0.05,
+                    "POSITIVE ALLOSTERIC MODULATOR": 0.04, "NEGATIVE ALLOSTERIC MODULATOR": 0.02, "OPENER": 0.02,
+                    "PARTIAL AGONIST": 0.03, "DEGRADER": 0.01, "SUBSTRATE": 0.02},
+}
+# The only MySQL hosts --mysql writes to, besides a unix socket.
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+# Zipf exponent of the references of a foreign key: 0 is uniform, higher is more skewed.
+FK_SKEW = {
+    ("ACTIVITIES", "ASSAY_ID"): 0.8,
+    ("ACTIVITIES", "MOLREGNO"): 0.7,
+    ("ACTIVITIES", "DOC_ID"): 0.8,
+    ("ASSAYS", "TID"): 1.0,
+    ("ASSAYS", "DOC_ID"): 0.8,
+    ("COMPOUND_RECORDS", "DOC_ID"): 0.8,
+}
+DEFAULT_SKEW = 0.6
+NULL_FRACTION = 0.15
+FK_NULL_FRACTION = 0.02
+BATCH_ROWS = 20_000
+CHEMBL_ENTITY_TYPES = {"MOLECULE_DICTIONARY": "COMPOUND", "ASSAYS": "ASSAY", "TARGET_DICTIONARY": "TARGET",
+                       "DOCS": "DOCUMENT", "CELL_DICTIONARY": "CELL", "TISSUE_DICTIONARY": "TISSUE"}
+
+STANDARD_TYPES = {"IC50": 0.28, "Potency": 0.17, "Inhibition": 0.14, "Ki": 0.09, "MIC": 0.06, "EC50": 0.05,
+                  "Activity": 0.06, "GI50": 0.05, "Kd": 0.03, "AC50": 0.03, "T1/2": 0.02, "CL": 0.02}
+ORGANISMS = {("Homo sapiens", 9606): 0.55, ("Rattus norvegicus", 10116): 0.12, ("Mus musculus", 10090): 0.12,
+             ("Plasmodium falciparum", 5833): 0.04, ("Escherichia coli", 562): 0.04, ("Bos taurus", 9913): 0.03,
+             ("Mycobacterium tuberculosis", 1773): 0.03, ("Cavia porcellus", 10141): 0.02, ("Sus scrofa", 9823): 0.02,
+             ("Saccharomyces cerevisiae", 4932): 0.03}
+TARGET_FAMILIES = ("Tyrosine-protein kinase", "Serine/threonine-protein kinase", "Dopamine D{} receptor",
+                   "Adenosine receptor A{}", "Carbonic anhydrase {}", "Histone deacetylase {}", "Cytochrome P450 {}",
+                   "Cyclin-dependent kinase {}", "Muscarinic acetylcholine receptor M{}", "Phosphodiesterase {}",
+                   "Sodium channel protein type {}", "Potassium voltage-gated channel {}", "Estrogen receptor {}",
+                   "Cannabinoid receptor {}", "Beta-secretase {}", "Bromodomain-containing protein {}")
+JOURNALS = ("J Med Chem", "Bioorg Med Chem Lett", "Eur J Med Chem", "Bioorg Med Chem", "J Nat Prod", "ACS Med Chem Lett",
+            "J Biol Chem", "Nat Chem Biol", "Antimicrob Agents Chemother", "Drug Metab Dispos")
+
+Generator = Callable[[np.random.Generator, int], list]
+
+
+def plan_rows(scale: float) -> dict[str, int]:
+    """Returns the number of rows of every table at a scale factor, one-to-one tables capped by the table they extend."""
+    rows = {}
+    for name, table in TABLES_BY_NAME.items():
+        if name in LOOKUP_KEYS:
+            rows[name] = len(LOOKUP_KEYS[name])
+        elif name in FIXED_ROWS:
+            rows[name] = FIXED_ROWS[name]
+        else:
+            rows[name] = max(1, int(BASE_ROWS.get(name, DEFAULT_ROWS) * scale))
+    for name, table in TABLES_BY_NAME.items():
+        extended = _extended_table(table)
+        if extended is not None:
+            rows[name] = min(rows[name], rows[extended])
+    rows["CHEMBL_ID_LOOKUP"] = sum(rows[name] for name in _chembl_id_tables())
+    return rows
+
+
+class KeySpace:
+    """The primary keys of every table, and Zipf-like samplers over them for the foreign keys."""
+
+    def __init__(self, rows: dict[str, int], seed: int):
+        self.rows = rows
+        self.seed = seed
+        self._samplers = {}
+
+    def keys(self, table: str) -> np.ndarray | list:
+        table_def = TABLES_BY_NAME[table]
+        if table in LOOKUP_KEYS:
+            return list(LOOKUP_KEYS[table])
+        if table == "CHEMBL_ID_LOOKUP":
+            return [chembl_id for name in _chembl_id_tables() for chembl_id in self.chembl_ids(name, np.arange(1, self.rows[name] + 1))]
+        if _extended_table(table_def) is not None:
+            return self.keys(_extended_table(table_def))[:self.rows[table]]
+        column = _column(table_def, table_def.primary_key[0])
+        if _is_text(column):
+            return _unique_strings(column, np.arange(1, self.rows[table] + 1))
+        return np.arange(1, self.rows[table] + 1)
+
+    def sample(self, rng: np.random.Generator, table: str, skew: float, n: int) -> list:
+        """Draws n keys of a table, the key of rank k with a probability proportional to 1 / k^skew."""
+        sampler = self._samplers.get((table, skew))
+        if sampler is None:
+            keys = self.keys(table)
+            if table in LOOKUP_KEYS:
+                # Lookup keys have known shares, which stay with their keys.
+                weights = [LOOKUP_KEYS[table][key] for key in keys]
+                order = np.arange(len(keys))
+            else:
+                # The popularity order is fixed per table, so the same compounds are popular in every table.
+                weights = 1.0 / np.arange(1, len(keys) + 1) ** skew
+                order = np.random.default_rng([self.seed, _stable_hash(table)]).permutation(len(keys))
+            cdf = np.cumsum(weights)
+            sampler = self._samplers[(table, skew)] = (np.asarray(keys, dtype=object)[order], cdf / cdf[-1])
+        keys, cdf = sampler
+        return keys[np.minimum(np.searchsorted(cdf, rng.random(n)), len(keys) - 1)].tolist()
+
+    def chembl_ids(self, table: str, ids: np.ndarray) -> list[str]:
+        offset = 0
+        for name in _chembl_id_tables():
+            if name == table:
+                break
+            offset += self.rows[name]
+        return [f"CHEMBL{offset + int(i)}" for i in ids]
+
+
+def generate_rows(table: SchemaTable, keys: KeySpace, rng: np.random.Generator) -> Iterator[list[tuple]]:
+    """Yields the rows of a table in batches of BATCH_ROWS, as tuples in column order."""
+    primary_keys = keys.keys(table.name)
+    total = keys.rows[table.name]
+    for start in range(0, total, BATCH_ROWS):
+        n = min(BATCH_ROWS, total - start)
+        ids = np.arange(start + 1, start + n + 1)
+        columns = {}
+        for column in table.columns:
+            if "PK" in column.keys:
+                columns[column.name] = list(primary_keys[start:start + n].tolist() if isinstance(primary_keys, np.ndarray)
+                                            else primary_keys[start:start + n])
+            else:
+                columns[column.name] = _column_values(table, column, keys, rng, ids)
+        hook = ROW_HOOKS.get(table.name)
+        if hook is not None:
+            hook(columns, rng, keys, ids)
+        yield list(zip(*(columns[column.name] for column in table.columns)))
+
+
+def _column_values(table: SchemaTable, column: SchemaColumn, keys: KeySpace, rng: np.random.Generator, ids: np.ndarray) -> list:
+    n = len(ids)
+    generator = COLUMN_GENERATORS.get((table.name, column.name)) or COLUMN_GENERATORS.get((None, column.name))
+    if generator is not None:
+        values = generator(rng, n)
+    elif column.name == "CHEMBL_ID" and table.foreign_keys.get("CHEMBL_ID") == "CHEMBL_ID_LOOKUP":
+        return keys.chembl_ids(table.name, ids)
+    elif column.name in table.foreign_keys:
+        target = table.foreign_keys[column.name]
+        values = keys.sample(rng, target, FK_SKEW.get((table.name, column.name), DEFAULT_SKEW), n)
+        return _with_nulls(rng, values, FK_NULL_FRACTION if column.nullable else 0.0)
+    elif "UK" in column.keys:
+        return _unique_strings(column, ids) if _is_text(column) else ids.tolist()
+    else:
+        values = _generic_values(column, rng, n)
+    return _with_nulls(rng, values, NULL_FRACTION if column.nullable and generator is None else 0.0)
+
+
+def _generic_values(column: SchemaColumn, rng: np.random.Generator, n: int) -> list:
+    base_type = column.data_type.split("(")[0]
+    if base_type in ("NUMBER", "INTEGER"):
+        if column.name.endswith("_FLAG") or "1 = yes" in column.comment or re.search(r"\(1\s*=", column.comment):
+            return (rng.random(n) < 0.1).astype(int).tolist()
+        if column.name.endswith("ID"):
+            return rng.integers(1, 100_000, n).tolist()
+        return np.round(rng.gamma(2.0, 50.0, n), 2).tolist()
+    if base_type == "DATE":
+        days = rng.integers(0, 25 * 365, n)
+        return [time.strftime("%Y-%m-%d", time.gmtime(946_684_800 + int(day) * 86_400)) for day in days]
+    length = _length(column)
+    if base_type == "VARCHAR2" and length <= 50:
+        # Short text columns are categorical: a few values, some much more frequent than others.
+        values = [f"{column.name.lower()}_{k}"[:length] for k in range(1, 9)]
+        return [values[i] for i in np.minimum(rng.zipf(2.0, n) - 1, len(values) - 1)]
+    words = column.name.lower().replace("_", " ")
+    return [f"Synthetic {words} {int(i)}"[:length] for i in rng.integers(1, 1_000_000, n)]
+
+
+def _choice(weights: dict) -> Generator:
+    values, p = list(weights), np.array(list(weights.values()), dtype=float)
+    p = p / p.sum()
+    return lambda rng, n: [values[i] for i in rng.choice(len(values), n, p=p)]
+
+
+def _lognormal(median: float, sigma: float, digits: int = 2) -> Generator:
+    return lambda rng, n: np.round(rng.lognormal(math.log(median), sigma, n), digits).tolist()
+
+
+def _normal(mean: float, sd: float, low: float, high: float, digits: int = 2) -> Generator:
+    return lambda rng, n: np.round(np.clip(rng.normal(mean, sd, n), low, high), digits).tolist()
+
+
+def _poisson(mean: float) -> Generator:
+    return lambda rng, n: rng.poisson(mean, n).tolist()
+
+
+def _sometimes(fraction: float, generator: Generator) -> Generator:
+    """Values of `generator` for a `fraction` of the rows, NULL for the others."""
+    return lambda rng, n: _with_nulls(rng, generator(rng, n), 1.0 - fraction)
+
+
+def _target_names(rng: np.random.Generator, n: int) -> list[str]:
+    families = rng.integers(0, len(TARGET_FAMILIES), n)
+    members = rng.integers(1, 12, n)
+    return [TARGET_FAMILIES[family].format(member) if "{}" in TARGET_FAMILIES[family] else f"{TARGET_FAMILIES[family]} {member}"
+            for family, member in zip(families, members)]
+
+
+COLUMN_GENERATORS: dict[tuple[str | None, str], Generator] = {
+    ("ACTIVITIES", "STANDARD_TYPE"): _choice(STANDARD_TYPES),
+    ("ACTIVITIES", "STANDARD_RELATION"): _choice({"=": 0.85, ">": 0.08, "<": 0.04, ">=": 0.01, "<=": 0.01, "~": 0.01}),
+    ("ACTIVITIES", "STANDARD_VALUE"): _lognormal(800.0, 2.3),
+    ("ACTIVITIES", "STANDARD_FLAG"): _choice({1: 0.9, 0: 0.1}),
+    ("ACTIVITIES", "POTENTIAL_DUPLICATE"): _choice({0: 0.98, 1: 0.02}),
+    ("ACTIVITIES", "DATA_VALIDITY_COMMENT"): _sometimes(0.05, _choice(LOOKUP_KEYS["DATA_VALIDITY_LOOKUP"])),
+    ("ACTIVITIES", "ACTION_TYPE"): _sometimes(0.03, _choice(LOOKUP_KEYS["ACTION_TYPE"])),
+    ("ASSAYS", "ASSAY_TYPE"): _choice(LOOKUP_KEYS["ASSAY_TYPE"]),
+    ("ASSAYS", "RELATIONSHIP_TYPE"): _choice(LOOKUP_KEYS["RELATIONSHIP_TYPE"]),
+    ("ASSAYS", "CURATED_BY"): _choice(LOOKUP_KEYS["CURATION_LOOKUP"]),
+    ("ASSAYS", "CONFIDENCE_SCORE"): _choice({9: 0.35, 8: 0.10, 1: 0.25, 0: 0.05, 4: 0.05, 5: 0.05, 6: 0.05, 7: 0.05, 3: 0.03, 2: 0.02}),
+    ("ASSAYS", "ASSAY_TEST_TYPE"): _choice({"In vitro": 0.7, "In vivo": 0.1, "Ex vivo": 0.02, None: 0.18}),
+    ("TARGET_DICTIONARY", "TARGET_TYPE"): _choice(LOOKUP_KEYS["TARGET_TYPE"]),
+    ("TARGET_DICTIONARY", "PREF_NAME"): _target_names,
+    ("TARGET_DICTIONARY", "SPECIES_GROUP_FLAG"): _choice({0: 0.97, 1: 0.03}),
+    ("MOLECULE_DICTIONARY", "MAX_PHASE"): _choice({None: 0.93, -1: 0.005, 0.5: 0.005, 1: 0.012, 2: 0.015, 3: 0.008, 4: 0.025}),
+    ("MOLECULE_DICTIONARY", "MOLECULE_TYPE"): _choice({"Small molecule": 0.95, "Protein": 0.02, "Antibody": 0.01,
+                                                       "Oligonucleotide": 0.005, "Unknown": 0.01, "Enzyme": 0.005}),
+    ("MOLECULE_DICTIONARY", "STRUCTURE_TYPE"): _choice({"MOL": 0.97, "SEQ": 0.02, "NONE": 0.01}),
+    ("MOLECULE_DICTIONARY", "CHIRALITY"): _choice({-1: 0.6, 0: 0.15, 1: 0.1, 2: 0.15}),
+    ("MOLECULE_DICTIONARY", "AVAILABILITY_TYPE"): _choice({None: 0.97, -2: 0.005, -1: 0.005, 0: 0.01, 1: 0.005, 2: 0.005}),
+    ("COMPOUND_PROPERTIES", "MW_FREEBASE"): _normal(420.0, 130.0, 40.0, 1500.0),
+    ("COMPOUND_PROPERTIES", "ALOGP"): _normal(3.3, 1.7, -6.0, 12.0),
+    ("COMPOUND_PROPERTIES", "CX_LOGP"): _normal(3.1, 1.9, -8.0, 12.0),
+    ("COMPOUND_PROPERTIES", "PSA"): _lognormal(80.0, 0.45),
+    ("COMPOUND_PROPERTIES", "HBA"): _poisson(5.5),
+    ("COMPOUND_PROPERTIES", "HBD"): _poisson(1.8),
+    ("COMPOUND_PROPERTIES", "RTB"): _poisson(5.5),
+    ("COMPOUND_PROPERTIES", "AROMATIC_RINGS"): _poisson(2.3),
+    ("COMPOUND_PROPERTIES", "QED_WEIGHTED"): _normal(0.5, 0.2, 0.01, 0.95),
+    ("DOCS", "JOURNAL"): _choice({journal: 1 / (rank + 1) for rank, journal in enumerate(JOURNALS)}),
+    ("DOCS", "YEAR"): lambda rng, n: np.clip(2024 - np.round(rng.exponential(10.0, n)), 1975, 2024).astype(int).tolist(),
+    ("DOCS", "DOC_TYPE"): _choice({"PUBLICATION": 0.9, "DATASET": 0.08, "PATENT": 0.02}),
+}
+
+
+def _activities_hook(columns: dict, rng: np.random.Generator, keys: KeySpace, ids: np.ndarray) -> None:
+    types, values = columns["STANDARD_TYPE"], columns["STANDARD_VALUE"]
+    units = [("%" if standard_type in ("Inhibition", "Activity") else "hr" if standard_type == "T1/2" else
+              "mL.min-1.kg-1" if standard_type == "CL" else "ug.mL-1" if standard_type == "MIC" else "nM") for standard_type in types]
+    columns["STANDARD_UNITS"] = units
+    columns["PCHEMBL_VALUE"] = [
+        round(9 - math.log10(value), 2) if unit == "nM" and relation == "=" and value and 0.01 < value < 1e7 else None
+        for value, unit, relation in zip(values, units, columns["STANDARD_RELATION"])
+    ]
+    # The published columns usually match the standardized ones.
+    columns["TYPE"], columns["RELATION"], columns["VALUE"], columns["UNITS"] = types, columns["STANDARD_RELATION"], values, units
+
+
+def _organism_hook(organism_column: str, tax_column: str) -> Callable:
+    draw = _choice(ORGANISMS)
+
+    def hook(columns: dict, rng: np.random.Generator, keys: KeySpace, ids: np.ndarray) -> None:
+        organisms = draw(rng, len(ids))
+        columns[organism_column] = [organism for organism, _ in organisms]
+        columns[tax_column] = [tax_id for _, tax_id in organisms]
+    return hook
+
+
+def _molecules_hook(columns: dict, rng: np.random.Generator, keys: KeySpace, ids: np.ndarray) -> None:
+    phases = columns["MAX_PHASE"]
+    # Named compounds are mostly clinical candidates and drugs; approved drugs get an approval year.
+    columns["PREF_NAME"] = [f"SYNTHAMAB-{int(i)}" if phase is not None or rng_value < 0.02 else None
+                            for i, phase, rng_value in zip(ids, phases, rng.random(len(ids)))]
+    columns["FIRST_APPROVAL"] = [int(year) if phase == 4 else None for phase, year in zip(phases, rng.integers(1940, 2025, len(ids)))]
+    columns["THERAPEUTIC_FLAG"] = [int(phase == 4) for phase in phases]
+
+
+def _compound_properties_hook(columns: dict, rng: np.random.Generator, keys: KeySpace, ids: np.ndarray) -> None:
+    columns["NUM_RO5_VIOLATIONS"] = [
+        int(mw > 500) + int(logp > 5) + int(hba > 10) + int(hbd > 5)
+        for mw, logp, hba, hbd in zip(columns["MW_FREEBASE"], columns["ALOGP"], columns["HBA"], columns["HBD"])
+    ]
+    columns["FULL_MWT"] = columns["MW_FREEBASE"]
+    columns["HEAVY_ATOMS"] = [int(mw / 13.5) for mw in columns["MW_FREEBASE"]]
+
+
+def _chembl_id_lookup_hook(columns: dict, rng: np.random.Generator, keys: KeySpace, ids: np.ndarray) -> None:
+    # Lookup rows follow the order of `KeySpace.chembl_ids`: the ids of each table in turn.
+    tables = _chembl_id_tables()
+    offsets = np.cumsum([0] + [keys.rows[name] for name in tables])
+    owners = np.searchsorted(offsets, ids, side="left") - 1
+    columns["ENTITY_TYPE"] = [CHEMBL_ENTITY_TYPES.get(tables[owner], tables[owner]) for owner in owners]
+    columns["ENTITY_ID"] = (ids - offsets[owners]).tolist()
+    columns["STATUS"] = ["ACTIVE"] * len(ids)
+
+
+ROW_HOOKS = {
+    "ACTIVITIES": _activities_hook,
+    "ASSAYS": _organism_hook("ASSAY_ORGANISM", "ASSAY_TAX_ID"),
+    "TARGET_DICTIONARY": _organism_hook("ORGANISM", "TAX_ID"),
+    "MOLECULE_DICTIONARY": _molecules_hook,
+    "COMPOUND_PROPERTIES": _compound_properties_hook,
+    "CHEMBL_ID_LOOKUP": _chembl_id_lookup_hook,
+}
+
+
+def create_statements(table: SchemaTable, dialect: str) -> list[str]:
+    """Returns the CREATE TABLE statement of a table, with its primary key, and an index per foreign key.
+
+    Foreign key and unique constraints are not declared, like in the ChEMBL dumps, so tables load in any order.
+    """
+    columns = [f"{column.name.lower()} {_sql_type(column, dialect)}{'' if column.nullable else ' NOT NULL'}"
+               for column in table.columns]
+    columns.append(f"PRIMARY KEY ({', '.join(name.lower() for name in table.primary_key)})")
+    statements = [f"CREATE TABLE {table.name.lower()} (\n    " + ",\n    ".join(columns) + "\n)"]
+    for column_name in table.foreign_keys:
+        column = _column(table, column_name)
+        if "PK" not in column.keys:
+            prefix = "(20)" if dialect == "mysql" and _sql_type(column, dialect) == "TEXT" else ""
+            statements.append(f"CREATE INDEX idx_{table.name.lower()}_{column_name.lower()} ON {table.name.lower()} ({column_name.lower()}{prefix})")
+    return statements
+
+
+def populate(conn, dialect: str, scale: float, seed: int = 0, replace: bool = False) -> dict[str, int]:
+    """Creates every table of the schema and fills it at a scale factor.
+
+    Args:
+        conn: A SQLite or MySQL connection.
+        dialect (str): "sqlite" or "mysql".
+        scale (float): The size factor, see `plan_rows`.
+        seed (int): The seed of the generators.
+        replace (bool): Whether to drop the tables that already exist.
+
+    Returns:
+        dict[str, int]: The number of rows written per table.
+    """
+    rows = plan_rows(scale)
+    keys = KeySpace(rows, seed)
+    placeholder = "?" if dialect == "sqlite" else "%s"
+    cursor = conn.cursor()
+    for index, (name, table) in enumerate(TABLES_BY_NAME.items()):
+        start = time.perf_counter()
+        if replace:
+            cursor.execute(f"DROP TABLE IF EXISTS {name.lower()}")
+        for statement in create_statements(table, dialect):
+            cursor.execute(statement)
+        insert = (f"INSERT INTO {name.lower()} ({', '.join(column.name.lower() for column in table.columns)}) "
+                  f"VALUES ({', '.join([placeholder] * len(table.columns))})")
+        rng = np.random.default_rng([seed, index])
+        for batch in generate_rows(table, keys, rng):
+            cursor.executemany(insert, batch)
+            conn.commit()
+        print(f"{name.lower():<32} {rows[name]:>11,} rows  {time.perf_counter() - start:7.1f}s")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="Size factor: 1 is about 1%% of chembl_35, 100 its full size.")
+    parser.add_argument("--seed", type=int, default=0)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--sqlite", help="Write into this SQLite file.")
+    target.add_argument("--mysql", action="store_true", help="Write into a MySQL database of the local server.")
+    parser.add_argument("--mysql-database", help="The MySQL database to fill, required with --mysql.")
+    parser.add_argument("--mysql-host", default="127.0.0.1", help="localhost or a loopback address.")
+    parser.add_argument("--mysql-port", type=int, default=3306)
+    parser.add_argument("--mysql-socket", help="Connect through this unix socket instead of TCP.")
+    parser.add_argument("--replace", action="store_true", help="Drop the tables that already exist.")
+    parser.add_argument("--plan", action="store_true", help="Only print the number of rows per table.")
+    args = parser.parse_args()
+
+    if args.plan:
+        for name, count in plan_rows(args.scale).items():
+            print(f"{name.lower():<32} {count:>11,}")
+        return
+    if not args.sqlite and not args.mysql:
+        parser.error("one of --sqlite or --mysql is required")
+    if args.sqlite:
+        if os.path.exists(args.sqlite) and not args.replace:
+            parser.error(f"{args.sqlite} exists, pass --replace to overwrite its tables")
+        conn = sqlite3.connect(args.sqlite)
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        dialect = "sqlite"
+    else:
+        error = _check_mysql_target(args.mysql_database, args.mysql_host, args.mysql_socket)
+        if error:
+            parser.error(error)
+        conn = _connect_mysql(args.mysql_database, args.mysql_host, args.mysql_port, args.mysql_socket)
+        dialect = "mysql"
+    start = time.perf_counter()
+    rows = populate(conn, dialect, args.scale, args.seed, args.replace)
+    conn.close()
+    print(f"\n{sum(rows.values()):,} rows in {len(rows)} tables in {time.perf_counter() - start:.0f}s (scale {args.scale}, seed {args.seed})")
+
+
+def _check_mysql_target(database: str | None, host: str, unix_socket: str | None) -> str | None:
+    """Returns why a MySQL database may not be filled, or None. Only explicitly named, non-ChEMBL databases of the
+    local server are accepted, so a stray MYSQL_HOST or CHEMBL_VERSION can never point --replace at real data."""
+    from utils import CHEMBL_VERSION
+    if not database:
+        return "--mysql-database is required with --mysql"
+    if not re.fullmatch(r"\w+", database):
+        return f"invalid database name {database!r}"
+    if database.lower() == CHEMBL_VERSION.lower() or re.fullmatch(r"chembl_\d+", database, re.IGNORECASE):
+        return f"refusing to write into {database}, which looks like a ChEMBL release"
+    if unix_socket is None and host not in LOCAL_HOSTS:
+        return f"refusing to write to {host}, only a local server ({', '.join(LOCAL_HOSTS)} or --mysql-socket) is allowed"
+    return None
+
+
+def _connect_mysql(database: str, host: str, port: int, unix_socket: str | None):
+    """Connects to a database of the local MySQL server, creating it if missing."""
+    import mysql.connector
+    params = dict(user=os.getenv("MYSQL_USER", "root"), password=os.getenv("MYSQL_PASSWORD", "chembl"))
+    if unix_socket:
+        params.update(unix_socket=unix_socket)
+    else:
+        params.update(host=host, port=port)
+    conn = mysql.connector.connect(**params)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+    cursor.close()
+    conn.database = database
+    return conn
+
+
+def _chembl_id_tables() -> list[str]:
+    return [name for name, table in TABLES_BY_NAME.items() if table.foreign_keys.get("CHEMBL_ID") == "CHEMBL_ID_LOOKUP"]
+
+
+def _extended_table(table: SchemaTable) -> str | None:
+    """The table whose keys a one-to-one table reuses (its primary key is also a foreign key), if any."""
+    primary_key = table.primary_key[0]
+    return table.foreign_keys.get(primary_key) if "FK" in _column(table, primary_key).keys else None
+
+
+def _column(table: SchemaTable, name: str) -> SchemaColumn:
+    return next(column for column in table.columns if column.name == name)
+
+
+def _is_text(column: SchemaColumn) -> bool:
+    return column.data_type.startswith(("VARCHAR2", "CLOB"))
+
+
+def _length(column: SchemaColumn) -> int:
+    match = re.search(r"\((\d+)\)", column.data_type)
+    return int(match.group(1)) if match else 4000
+
+
+def _unique_strings(column: SchemaColumn, ids: np.ndarray) -> list[str]:
+    length = _length(column)
+    prefix = re.sub(r"[^A-Z]", "", column.name)[:max(0, length - 7)]
+    return [f"{prefix}{int(i):0{min(7, length - len(prefix))}d}" for i in ids]
+
+
+def _with_nulls(rng: np.random.Generator, values: list, fraction: float) -> list:
+    if fraction <= 0:
+        return values
+    return [None if null else value for value, null in zip(values, rng.random(len(values)) < fraction)]
+
+
+def _sql_type(column: SchemaColumn, dialect: str) -> str:
+    base_type = column.data_type.split("(")[0]
+    is_key = bool(column.keys) or column.name.endswith("_ID") or column.name == "MOLREGNO"
+    if base_type in ("NUMBER", "INTEGER"):
+        if dialect == "sqlite":
+            return "INTEGER" if is_key or base_type == "INTEGER" else "NUMERIC"
+        return "BIGINT" if is_key else "INT" if base_type == "INTEGER" else "DOUBLE"
+    if base_type == "DATE":
+        return "TEXT" if dialect == "sqlite" else "DATE"
+    if dialect == "sqlite":
+        return "TEXT"
+    if base_type == "CLOB":
+        return "LONGTEXT"
+    return f"VARCHAR({_length(column)})" if _length(column) <= 500 else "TEXT"
+
+
+def _stable_hash(text: str) -> int:
+    return sum(ord(char) * 31 ** i for i, char in enumerate(text)) % 2 ** 32
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import math
+import re
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset({
+    "a", "about", "all", "also", "an", "and", "any", "are", "as", "at", "be", "been", "but", "by", "can", "could",
+    "do", "does", "e", "eg", "for", "from", "g", "has", "have", "how", "i", "ie", "if", "in", "into", "is", "it",
+    "its", "may", "me", "more", "most", "no", "not", "of", "on", "one", "or", "other", "our", "should", "so",
+    "some", "such", "than", "that", "the", "their", "them", "then", "there", "these", "they", "this", "those",
+    "to", "use", "used", "was", "we", "were", "what", "when", "where", "which", "while", "who", "will", "with",
+    "would", "you", "your"
+})
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into lowercase alphanumeric tokens, without stop words and with plurals folded.
+
+    Underscores split tokens, so "target_dictionary" matches both "target" and "dictionary".
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        list[str]: The tokens, in order of appearance.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOP_WORDS or len(token) < 2:
+            continue
+        if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 ranking over a small, in-memory collection of tokenized documents."""
+
+    def __init__(self, documents: list[list[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_frequencies = [Counter(document) for document in documents]
+        self.lengths = [len(document) for document in documents]
+        self.average_length = sum(self.lengths) / len(documents) if documents else 0.0
+        document_frequencies = Counter(term for frequencies in self.term_frequencies for term in frequencies)
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in document_frequencies.items()}
+
+    def scores(self, query_tokens: list[str]) -> list[float]:
+        """Returns the BM25 score of every document for the query, in document order."""
+        query_terms = Counter(token for token in query_tokens if token in self.idf)
+        scores = []
+        for frequencies, length in zip(self.term_frequencies, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / self.average_length) if self.average_length else self.k1
+            score = 0.0
+            for term, query_count in query_terms.items():
+                tf = frequencies.get(term)
+                if tf:
+                    score += (1 + math.log(query_count)) * self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+    def top_k(self, query_tokens: list[str], k: int) -> list[tuple[int, float]]:
+        """Returns the (document index, score) pairs of the k best matching documents with a positive score."""
+        ranked = sorted(enumerate(self.scores(query_tokens)), key=lambda item: item[1], reverse=True)
+        return [(i, score) for i, score in ranked[:k] if score > 0]
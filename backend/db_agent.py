@@ -1,8 +1,17 @@
-from vertexai.preview.generative_models import GenerativeModel, Content, Tool, FunctionDeclaration, ToolConfig, Part, GenerationConfig
+from vertexai.preview.generative_models import Content, Tool, FunctionDeclaration, ToolConfig, Part
+from llm_client import generate_content, generate_content_async, FLASH_MODEL, DETERMINISTIC_CONFIG
 from task_description import WRITER_INSTRUCTION, CHECKER_INSTRUCTION, EXAMPLES
-from database_schema import DATABASE_SCHEMA, TABLES
-from utils import execute_query
-from typing import Any
+from protein_classification import select_classification
+from schema_index import select_schema
+from utils import execute_query, execute_query_async
+from metrics import STAGE_SECONDS, TRAFFIC_LIGHTS
+from usage import join_sections
+from typing import Any, AsyncIterator, Iterator
+import functools
+
+FUNCTION_CALLING_ANY = ToolConfig(
+    function_calling_config=ToolConfig.FunctionCallingConfig(mode=ToolConfig.FunctionCallingConfig.Mode.ANY)
+)
 
 
 def db_agent_loop(user_question: str, writer_input: str, sql_query: str, query_result: list[dict] | str, depth: int, max_depth: int):
@@ -22,26 +31,64 @@ def db_agent_loop(user_question: str, writer_input: str, sql_query: str, query_r
     Returns:
         If successful, the final SQL query and the results of the query.
     """
-    print(f"--- Depth: {depth} ---")
-    if depth >= max_depth:
-        return None, [{"error": "Max retries reached. Unable to generate a valid query."}]
-    
-    writer_response, sql_query = generate_sql_with_writer(user_question, writer_input, sql_query, query_result)
-    print(sql_query)
+    for event in iter_db_agent_loop(user_question, writer_input, sql_query, query_result, depth, max_depth):
+        if event["event"] == "db_result":
+            return event["sql"], event["result"]
 
-    query_result = execute_query(sql_query, limit=100)
-    print(query_result)
 
-    checker_response, traffic_light = evaluate_query_with_checker(user_question, writer_input, query_result)
-    print(f"Traffic light: {traffic_light}")
-    
-    if traffic_light == "green":
-        return sql_query, query_result
-    elif traffic_light == "red":
-        depth += 1
-        return db_agent_loop(user_question, writer_input, sql_query, query_result, depth, max_depth)
-    else:
-        return sql_query, [{"error": "Traffic light is neither green or red"}]
+def iter_db_agent_loop(user_question: str, writer_input: str, sql_query: str = "", query_result: list[dict] | str = "", depth: int = 0, max_depth: int = 5) -> Iterator[dict]:
+    """Runs the Writer-Checker loop like `db_agent_loop`, yielding an event after every step.
+
+    Events are dictionaries with an "event" key:
+        - "sql_attempt": the Writer produced a query and it was executed (depth, sql, row_count, error).
+        - "traffic_light": the Checker evaluated the attempt (depth, color).
+        - "db_result": the loop finished (sql, result). Always the last event.
+
+    Args:
+        user_question (str): The question provided by the user.
+        writer_input (str): The input provided to the Writer agent from the Orchestrator agent.
+        sql_query (str): SQL of the previous query executed (if any).
+        query_result (list[dict] | str): The results or error from the previous query (if any).
+        depth (int): The depth to start counting rounds from.
+        max_depth (int): The maximum depth allowed for the loop.
+
+    Yields:
+        dict: The loop events, in the order they happen.
+    """
+    while True:
+        print(f"--- Depth: {depth} ---")
+        if depth >= max_depth:
+            yield {"event": "db_result", "sql": None, "result": [{"error": "Max retries reached. Unable to generate a valid query."}]}
+            return
+
+        with STAGE_SECONDS.labels("writer").time():
+            writer_response, sql_query = generate_sql_with_writer(user_question, writer_input, sql_query, query_result)
+        print(sql_query)
+
+        query_result = execute_query(sql_query, limit=100)
+        print(query_result)
+        yield {
+            "event": "sql_attempt",
+            "depth": depth,
+            "sql": sql_query,
+            "row_count": len(query_result) if isinstance(query_result, list) else 0,
+            "error": query_result if isinstance(query_result, str) else None
+        }
+
+        with STAGE_SECONDS.labels("checker").time():
+            checker_response, traffic_light = evaluate_query_with_checker(user_question, writer_input, query_result)
+        print(f"Traffic light: {traffic_light}")
+        TRAFFIC_LIGHTS.labels(traffic_light).inc()
+        yield {"event": "traffic_light", "depth": depth, "color": traffic_light}
+
+        if traffic_light == "green":
+            yield {"event": "db_result", "sql": sql_query, "result": query_result}
+            return
+        elif traffic_light == "red":
+            depth += 1
+        else:
+            yield {"event": "db_result", "sql": sql_query, "result": [{"error": "Traffic light is neither green or red"}]}
+            return
 
 
 def generate_sql_with_writer(user_question: str, writer_input: str, previous_query: str, previous_query_result: list[dict] | str) -> str:
@@ -59,26 +106,28 @@ def generate_sql_with_writer(user_question: str, writer_input: str, previous_que
     References:
         https://cloud.google.com/vertex-ai/generative-ai/docs/model-reference/function-calling
     """
-    prompt: str = f"{WRITER_INSTRUCTION}\n\n{DATABASE_SCHEMA, TABLES}\n\nUser question:\n{user_question}\n\nOrchestrator input:\n{writer_input}\n\nExamples:\n{EXAMPLES}\n\nPrevious sql query:\n{previous_query}\n\nPrevious query result:{previous_query_result}"
-    model = GenerativeModel(model_name="gemini-2.0-flash-001")
-    exececute_query_tool = create_execute_query_tool()
-    response = model.generate_content(
+    sections: dict[str, str] = build_writer_prompt_sections(user_question, writer_input, previous_query, previous_query_result)
+    prompt: str = join_sections(sections)
+    response = generate_content(
+            FLASH_MODEL,
             contents=[
                 Content(role="user", parts=[Part.from_text(prompt)])
             ],
-            tools=[exececute_query_tool],
-            tool_config=ToolConfig(
-                function_calling_config=ToolConfig.FunctionCallingConfig(mode=ToolConfig.FunctionCallingConfig.Mode.ANY)
-            ),
-            generation_config=GenerationConfig(temperature=0, top_k=1, top_p=1)
+            tools=[create_execute_query_tool()],
+            tool_config=FUNCTION_CALLING_ANY,
+            generation_config=DETERMINISTIC_CONFIG,
+            agent="writer",
+            sections=sections
         )
     function_call = response.candidates[0].function_calls[0]
     sql_query: str = function_call.args["query"]
     return response, sql_query
 
 
+@functools.cache
 def create_execute_query_tool():
     """Creates a tool that allows the Writer agent to use function calling to generate the sql code.
+    The tool is created once and reused by every Writer call.
     
     Returns:
         Tool objcet that can be called by the Writer agent.
@@ -130,25 +179,27 @@ def evaluate_query_with_checker(user_question: str, writer_input: str, checker_i
     References:
         https://cloud.google.com/vertex-ai/generative-ai/docs/model-reference/function-calling
     """
-    prompt: str = f"{CHECKER_INSTRUCTION}\n\n{DATABASE_SCHEMA}\n\nQuery Result:\n{checker_input}\n\nOriginal user question:\n{user_question}\n\nWriter input:\n{writer_input}"
-    model = GenerativeModel(model_name="gemini-2.0-flash-001")
-    traffic_light_tool = create_traffic_light_tool()
-    response = model.generate_content(
+    sections: dict[str, str] = build_checker_prompt_sections(user_question, writer_input, checker_input)
+    prompt: str = join_sections(sections)
+    response = generate_content(
+            FLASH_MODEL,
             contents=[
                 Content(role="user", parts=[Part.from_text(prompt)])
             ],
-            tools=[traffic_light_tool],
-            tool_config=ToolConfig(
-                function_calling_config=ToolConfig.FunctionCallingConfig(mode=ToolConfig.FunctionCallingConfig.Mode.ANY)
-            ),
-            generation_config=GenerationConfig(temperature=0, top_k=1, top_p=1)
+            tools=[create_traffic_light_tool()],
+            tool_config=FUNCTION_CALLING_ANY,
+            generation_config=DETERMINISTIC_CONFIG,
+            agent="checker",
+            sections=sections
         )
     function_call = response.candidates[0].function_calls[0]
     color: str = function_call.args["color"]
     return response, color
 
+@functools.cache
 def create_traffic_light_tool():
    """Creates a tool that allows the Checker agent to use function calling to set the trafic light to green or red.
+    The tool is created once and reused by every Checker call.
     
     Returns:
         Tool objcet that can be called by the Checker agent.
@@ -169,4 +220,117 @@ def create_traffic_light_tool():
        }
    )
    traffic_light_tool = Tool(function_declarations=[traffic_light_func])
-   return traffic_light_tool
\ No newline at end of file
+   return traffic_light_tool
+
+
+async def iter_db_agent_loop_async(user_question: str, writer_input: str, sql_query: str = "", query_result: list[dict] | str = "", depth: int = 0, max_depth: int = 5) -> AsyncIterator[dict]:
+    """Runs the Writer-Checker loop like `iter_db_agent_loop`, awaiting the agents and the database instead of blocking.
+
+    Yields:
+        dict: The loop events, see `iter_db_agent_loop`.
+    """
+    while True:
+        if depth >= max_depth:
+            yield {"event": "db_result", "sql": None, "result": [{"error": "Max retries reached. Unable to generate a valid query."}]}
+            return
+
+        with STAGE_SECONDS.labels("writer").time():
+            writer_response, sql_query = await generate_sql_with_writer_async(user_question, writer_input, sql_query, query_result)
+        query_result = await execute_query_async(sql_query, limit=100)
+        yield {
+            "event": "sql_attempt",
+            "depth": depth,
+            "sql": sql_query,
+            "row_count": len(query_result) if isinstance(query_result, list) else 0,
+            "error": query_result if isinstance(query_result, str) else None
+        }
+
+        with STAGE_SECONDS.labels("checker").time():
+            checker_response, traffic_light = await evaluate_query_with_checker_async(user_question, writer_input, query_result)
+        TRAFFIC_LIGHTS.labels(traffic_light).inc()
+        yield {"event": "traffic_light", "depth": depth, "color": traffic_light}
+
+        if traffic_light == "green":
+            yield {"event": "db_result", "sql": sql_query, "result": query_result}
+            return
+        elif traffic_light == "red":
+            depth += 1
+        else:
+            yield {"event": "db_result", "sql": sql_query, "result": [{"error": "Traffic light is neither green or red"}]}
+            return
+
+
+async def generate_sql_with_writer_async(user_question: str, writer_input: str, previous_query: str, previous_query_result: list[dict] | str) -> tuple[Any, str]:
+    """Generates mysql code like `generate_sql_with_writer`, without blocking the event loop."""
+    sections: dict[str, str] = build_writer_prompt_sections(user_question, writer_input, previous_query, previous_query_result)
+    prompt: str = join_sections(sections)
+    response = await generate_content_async(
+        FLASH_MODEL,
+        contents=[
+            Content(role="user", parts=[Part.from_text(prompt)])
+        ],
+        tools=[create_execute_query_tool()],
+        tool_config=FUNCTION_CALLING_ANY,
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="writer",
+        sections=sections
+    )
+    function_call = response.candidates[0].function_calls[0]
+    sql_query: str = function_call.args["query"]
+    return response, sql_query
+
+
+async def evaluate_query_with_checker_async(user_question: str, writer_input: str, checker_input: str) -> tuple[Any, str]:
+    """Evaluates the results of the SQL query like `evaluate_query_with_checker`, without blocking the event loop."""
+    sections: dict[str, str] = build_checker_prompt_sections(user_question, writer_input, checker_input)
+    prompt: str = join_sections(sections)
+    response = await generate_content_async(
+        FLASH_MODEL,
+        contents=[
+            Content(role="user", parts=[Part.from_text(prompt)])
+        ],
+        tools=[create_traffic_light_tool()],
+        tool_config=FUNCTION_CALLING_ANY,
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="checker",
+        sections=sections
+    )
+    function_call = response.candidates[0].function_calls[0]
+    color: str = function_call.args["color"]
+    return response, color
+
+
+def build_writer_prompt(user_question: str, writer_input: str, previous_query: str, previous_query_result: list[dict] | str) -> str:
+    return join_sections(build_writer_prompt_sections(user_question, writer_input, previous_query, previous_query_result))
+
+
+def build_writer_prompt_sections(user_question: str, writer_input: str, previous_query: str, previous_query_result: list[dict] | str) -> dict[str, str]:
+    """Returns the named sections of the Writer prompt, in prompt order (see `usage`)."""
+    schema: str = select_schema(f"{user_question}\n{writer_input}")
+    protein_classes: str = select_classification(user_question, writer_input)
+    return {
+        "instruction": WRITER_INSTRUCTION,
+        "schema": schema,
+        "protein_classes": protein_classes,
+        "question": f"User question:\n{user_question}",
+        "orchestrator": f"Orchestrator input:\n{writer_input}",
+        "examples": f"Examples:\n{EXAMPLES}",
+        "previous_sql": f"Previous sql query:\n{previous_query}",
+        "previous_result": f"Previous query result:{previous_query_result}"
+    }
+
+
+def build_checker_prompt(user_question: str, writer_input: str, checker_input: str) -> str:
+    return join_sections(build_checker_prompt_sections(user_question, writer_input, checker_input))
+
+
+def build_checker_prompt_sections(user_question: str, writer_input: str, checker_input: str) -> dict[str, str]:
+    """Returns the named sections of the Checker prompt, in prompt order (see `usage`)."""
+    schema: str = select_schema(f"{user_question}\n{writer_input}")
+    return {
+        "instruction": CHECKER_INSTRUCTION,
+        "schema": schema,
+        "query_result": f"Query Result:\n{checker_input}",
+        "question": f"Original user question:\n{user_question}",
+        "orchestrator": f"Writer input:\n{writer_input}"
+    }
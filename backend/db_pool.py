@@ -0,0 +1,155 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class ConnectionPool:
+    """A thread-safe pool of long-lived database connections.
+
+    Connections are created by `connect` (any DB-API connection factory, so tests can point it at a local MySQL
+    or another stand-in), reused in LIFO order, and health-checked on checkout: a connection that fails its ping
+    is reconnected, or replaced when that fails too. A connection whose use raised an exception is discarded
+    instead of being returned to the pool, since it may hold unread results or a broken session, unless the
+    exception is one of `keep_on` (errors known to leave the session usable, such as SQL syntax errors).
+    """
+
+    def __init__(self, connect: Callable[[], Any], size: int, checkout_timeout: float, ping_idle_seconds: float = 0.0,
+                 keep_on: tuple[type[BaseException], ...] = ()):
+        self.connect = connect
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.ping_idle_seconds = ping_idle_seconds
+        self.keep_on = keep_on
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._counters = {"checkouts": 0, "created": 0, "reconnects": 0, "discarded": 0, "timeouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def warm_up(self, count: int | None = None) -> None:
+        """Opens connections ahead of the first query.
+
+        Args:
+            count (int | None): The number of connections to open, the pool size by default.
+        """
+        count = self.size if count is None else min(count, self.size)
+        connections = []
+        try:
+            for _ in range(count):
+                connections.append(self._checkout())
+        except Exception as e:
+            logger.warning(f"Could not pre-warm the connection pool: {e}")
+        finally:
+            for conn in connections:
+                self._release(conn, healthy=True)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Checks a healthy connection out of the pool for the duration of the block."""
+        conn = self._checkout()
+        healthy = False
+        try:
+            yield conn
+            healthy = True
+        except self.keep_on:
+            healthy = True
+            raise
+        finally:
+            self._release(conn, healthy)
+
+    def stats(self) -> dict:
+        """Returns the pool counters, the current utilization, and the total/max time spent waiting for a connection."""
+        with self._lock:
+            return {
+                **self._counters,
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "utilization": self._in_use / self.size if self.size else 0.0
+            }
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn)
+
+    def _checkout(self) -> Any:
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available within {self.checkout_timeout}s (pool size {self.size})")
+        waited = time.perf_counter() - start
+        try:
+            conn = self._healthy_idle_connection()
+            if conn is None:
+                conn = self.connect()
+                with self._lock:
+                    self._counters["created"] += 1
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._counters["checkouts"] += 1
+            self._counters["wait_seconds"] += waited
+            self._counters["max_wait_seconds"] = max(self._counters["max_wait_seconds"], waited)
+        return conn
+
+    def _healthy_idle_connection(self) -> Any | None:
+        while True:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if time.monotonic() - released_at < self.ping_idle_seconds:
+                return conn
+            try:
+                _ping(conn)
+                return conn
+            except Exception as e:
+                logger.info(f"Dropping dead pooled connection: {e}")
+                self._close(conn)
+                with self._lock:
+                    self._counters["reconnects"] += 1
+
+    def _release(self, conn: Any, healthy: bool) -> None:
+        with self._lock:
+            self._in_use -= 1
+            if not healthy:
+                self._counters["discarded"] += 1
+        if healthy:
+            self._idle.put((conn, time.monotonic()))
+        else:
+            self._close(conn)
+        self._slots.release()
+
+    @staticmethod
+    def _close(conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _ping(conn: Any) -> None:
+    """Checks that a connection is alive, letting mysql-connector reconnect it after a server-side timeout."""
+    if hasattr(conn, "ping"):
+        conn.ping(reconnect=True, attempts=1, delay=0)
+    else:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
@@ -0,0 +1,357 @@
+import csv
+import io
+import itertools
+import zlib
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Iterable, Iterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+from mysql.connector import FieldFlag, FieldType
+
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMN_WIDTH = 255
+WIDTH_SAMPLE_ROWS = 1000
+
+DECIMAL128_MAX_PRECISION = 38
+DECIMAL256_MAX_PRECISION = 76
+DECIMAL_DEFAULT_SCALE = 10
+BINARY_CHARSET = 63
+
+Batches = Iterable[tuple[list[str], list[tuple]]]
+
+_INTEGER_TYPES = {FieldType.TINY, FieldType.SHORT, FieldType.LONG, FieldType.INT24, FieldType.LONGLONG, FieldType.YEAR, FieldType.BIT}
+_FLOAT_TYPES = {FieldType.FLOAT, FieldType.DOUBLE}
+_DECIMAL_TYPES = {FieldType.DECIMAL, FieldType.NEWDECIMAL}
+_BLOB_TYPES = {FieldType.TINY_BLOB, FieldType.MEDIUM_BLOB, FieldType.LONG_BLOB, FieldType.BLOB, FieldType.VARCHAR,
+               FieldType.VAR_STRING, FieldType.STRING, FieldType.GEOMETRY}
+_TEMPORAL_TYPES = {
+    FieldType.DATE: pa.date32(), FieldType.NEWDATE: pa.date32(), FieldType.DATETIME: pa.timestamp("us"),
+    FieldType.TIMESTAMP: pa.timestamp("us"), FieldType.TIME: pa.duration("us"),
+}
+
+
+class ResultColumns(list):
+    """The column names of query results, carrying their Arrow schema when the source knows the column types
+    (see `arrow_schema_from_description`), so the exporters do not have to guess them from the values."""
+
+    def __init__(self, names: Iterable[str], schema: pa.Schema | None = None):
+        super().__init__(names)
+        self.schema = schema
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def write_excel(batches: Batches, output_path: str, sheet_name: str = "Search Results") -> int:
+    """Writes query results to an xlsx file in constant memory.
+
+    Rows are written through xlsxwriter's `constant_memory` mode as the batches arrive, so only the current row
+    is held in memory. Column widths are computed from the first `WIDTH_SAMPLE_ROWS` rows. When a sheet reaches
+    Excel's row limit, the remaining rows continue on a new sheet ("Search Results (2)", ...), each with a header.
+
+    Args:
+        batches (Batches): The column names and batches of rows, see `utils.iter_query_batches`.
+        output_path (str): The path of the xlsx file to create.
+        sheet_name (str): The name of the first sheet.
+
+    Returns:
+        int: The number of data rows written.
+    """
+    workbook = xlsxwriter.Workbook(output_path, {"constant_memory": True, "default_date_format": "yyyy-mm-dd hh:mm:ss"})
+    header_format = workbook.add_format({
+        'bold': True,
+        'bg_color': '#D3D3D3',
+        'border': 1,
+        'align': 'center',
+        'valign': 'vcenter'
+    })
+    batches = iter(batches)
+    columns, sample = [], []
+    for columns, rows in batches:
+        sample.extend(rows)
+        if len(sample) >= WIDTH_SAMPLE_ROWS:
+            break
+    widths = _column_widths(columns, sample[:WIDTH_SAMPLE_ROWS])
+
+    worksheet = _add_sheet(workbook, sheet_name, columns, widths, header_format)
+    row_index, sheets, total = 1, 1, 0
+    for rows in itertools.chain([sample], (rows for _, rows in batches)):
+        for row in rows:
+            if row_index == EXCEL_MAX_ROWS:
+                sheets += 1
+                worksheet = _add_sheet(workbook, f"{sheet_name} ({sheets})", columns, widths, header_format)
+                row_index = 1
+            worksheet.write_row(row_index, 0, [_excel_value(value) for value in row])
+            row_index += 1
+            total += 1
+    workbook.close()
+    return total
+
+
+def _add_sheet(workbook, name: str, columns: list[str], widths: list[int], header_format):
+    worksheet = workbook.add_worksheet(name)
+    for i, width in enumerate(widths):
+        worksheet.set_column(i, i, width)
+    worksheet.write_row(0, 0, columns, header_format)
+    return worksheet
+
+
+def _column_widths(columns: list[str], sample: list[tuple]) -> list[int]:
+    widths = [len(str(column)) for column in columns]
+    for row in sample:
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], len(str(value)))
+    return [min(width + 2, EXCEL_MAX_COLUMN_WIDTH) for width in widths]
+
+
+def _excel_value(value):
+    if value is None or isinstance(value, (int, float, str, bool, datetime, date, time, timedelta)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+def stream_csv_gzip(batches: Batches) -> Iterator[bytes]:
+    """Streams query results as gzip-compressed CSV, one compressed chunk per batch.
+
+    Args:
+        batches (Batches): The column names and batches of rows, see `utils.iter_query_batches`.
+
+    Yields:
+        bytes: Consecutive pieces of the .csv.gz file.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator="\n")
+    header_written = False
+    for columns, rows in batches:
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        chunk = compressor.compress(text.getvalue().encode("utf-8"))
+        text.seek(0)
+        text.truncate()
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def stream_parquet(batches: Batches) -> Iterator[bytes]:
+    """Streams query results as a Parquet file, writing one row group per fetched batch.
+
+    Args:
+        batches (Batches): The column names and batches of rows, see `utils.iter_query_batches`.
+
+    Yields:
+        bytes: Consecutive pieces of the .parquet file.
+    """
+    sink = _ChunkSink()
+    writer = None
+    try:
+        for columns, rows in batches:
+            if writer is None:
+                schema = arrow_schema(columns, rows)
+                writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="snappy")
+            if rows:
+                writer.write_batch(to_record_batch(schema, rows))
+            yield from sink.drain()
+    finally:
+        # Also closed on errors: a writer left open aborts the interpreter when it is garbage collected.
+        if writer is not None:
+            writer.close()
+    yield from sink.drain()
+
+
+def stream_arrow(batches: Batches) -> Iterator[bytes]:
+    """Streams query results in the Arrow IPC streaming format, one record batch per fetched batch.
+
+    Args:
+        batches (Batches): The column names and batches of rows, see `utils.iter_query_batches`.
+
+    Yields:
+        bytes: Consecutive pieces of the .arrows stream.
+    """
+    sink = _ChunkSink()
+    writer = None
+    try:
+        for columns, rows in batches:
+            if writer is None:
+                schema = arrow_schema(columns, rows)
+                writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+            if rows:
+                writer.write_batch(to_record_batch(schema, rows))
+            yield from sink.drain()
+    finally:
+        # Also closed on errors: a writer left open aborts the interpreter when it is garbage collected.
+        if writer is not None:
+            writer.close()
+    yield from sink.drain()
+
+
+def arrow_schema(columns: list[str], rows: list[tuple]) -> pa.Schema:
+    """Returns the Arrow schema of query results: the one carried by `ResultColumns`, or else one inferred from
+    the first batch of rows."""
+    schema = getattr(columns, "schema", None)
+    return schema if schema is not None else infer_arrow_schema(columns, rows)
+
+
+def arrow_schema_from_description(description: list[tuple], rows: list[tuple]) -> pa.Schema:
+    """Maps the column types of a MySQL cursor (`cursor.description`) to an Arrow schema.
+
+    DECIMAL columns become Arrow decimals, so their values stay exact. mysql-connector does not report their
+    precision and scale, but MySQL sends every value of a DECIMAL column with the column's scale, so the scale is
+    read from the first value of the first batch (DECIMAL_DEFAULT_SCALE when the batch has none). The precision is
+    then unknown and MySQL allows up to 65 digits, so these columns get the widest Arrow decimal, see
+    `_decimal_type`.
+
+    Args:
+        description (list[tuple]): The cursor description: name, type code, display size, internal size,
+            precision, scale, nullable, flags and, on recent connectors, the character set.
+        rows (list[tuple]): The first batch of rows.
+
+    Returns:
+        pa.Schema: The schema of the results.
+    """
+    fields = []
+    for i, column in enumerate(description):
+        name, type_code = column[0], column[1]
+        flags = column[7] if len(column) > 7 and column[7] else 0
+        if type_code in _INTEGER_TYPES:
+            unsigned = type_code == FieldType.LONGLONG and flags & FieldFlag.UNSIGNED
+            data_type = pa.uint64() if unsigned else pa.int64()
+        elif type_code in _FLOAT_TYPES:
+            data_type = pa.float64()
+        elif type_code in _DECIMAL_TYPES:
+            data_type = _decimal_type(column, [row[i] for row in rows])
+        elif type_code in _TEMPORAL_TYPES:
+            data_type = _TEMPORAL_TYPES[type_code]
+        elif type_code in _BLOB_TYPES:
+            charset = column[8] if len(column) > 8 else None
+            binary = charset == BINARY_CHARSET if charset is not None else bool(flags & FieldFlag.BINARY)
+            data_type = pa.binary() if binary else pa.string()
+        else:
+            data_type = pa.string()
+        fields.append(pa.field(name, data_type))
+    return pa.schema(fields)
+
+
+def _decimal_type(column: tuple, values: list) -> pa.DataType:
+    """Returns the Arrow decimal type of a DECIMAL column: decimal128 when its precision is known and fits, and
+    decimal256(76, scale) otherwise, which holds any MySQL DECIMAL (at most 65 digits, 30 after the point).
+
+    ChEMBL's DECIMAL(64,30) columns, e.g. activities.standard_value, hold values far beyond decimal128(38,30):
+
+    >>> column = ("standard_value", FieldType.NEWDECIMAL, None, None, None, None, True, 0)
+    >>> large = Decimal("123456789012.345678901234567890123456789012")
+    >>> schema = arrow_schema_from_description([column], [(large,)])
+    >>> schema.field(0).type
+    Decimal256Type(decimal256(76, 30))
+    >>> to_record_batch(schema, [(large,), (None,)]).column(0)[0].as_py() == large
+    True
+    """
+    precision = column[4] if len(column) > 4 else None
+    scale = column[5] if len(column) > 5 else None
+    if scale is None:
+        first = next((value for value in values if isinstance(value, Decimal)), None)
+        scale = max(0, -first.as_tuple().exponent) if first is not None else DECIMAL_DEFAULT_SCALE
+    precision = max(precision or DECIMAL256_MAX_PRECISION, scale + 1)
+    return pa.decimal128(precision, scale) if precision <= DECIMAL128_MAX_PRECISION else pa.decimal256(precision, scale)
+
+
+def infer_arrow_schema(columns: list[str], rows: list[tuple]) -> pa.Schema:
+    """Infers the Arrow schema of results without column types from a batch of rows. Columns without values
+    become strings."""
+    fields = []
+    for i, column in enumerate(columns):
+        data_type = pa.array([row[i] for row in rows]).type if rows else pa.null()
+        fields.append(pa.field(column, pa.string() if pa.types.is_null(data_type) else data_type))
+    return pa.schema(fields)
+
+
+def to_record_batch(schema: pa.Schema, rows: list[tuple]) -> pa.RecordBatch:
+    """Converts a batch of rows to an Arrow record batch of the given schema.
+
+    Raises:
+        ValueError: If a value does not fit its column type (e.g. 3.7 in an integer column). Values are never
+            coerced, since that would silently corrupt the export.
+    """
+    arrays = []
+    for i, field in enumerate(schema):
+        try:
+            arrays.append(_strict_array([row[i] for row in rows], field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Column {field.name} does not fit its type {field.type}: {e}") from e
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _strict_array(values: list, data_type: pa.DataType) -> pa.Array:
+    # pa.array(values, type=...) truncates floats into integer types, so the values are converted by their own type
+    # and only widened: integers to wider integers, floats or decimals, decimals to another scale. Safe casts fail
+    # on overflow or lost digits.
+    array = pa.array(values)
+    if array.type.equals(data_type) or pa.types.is_null(array.type):
+        return array.cast(data_type)
+    widens = (pa.types.is_integer(array.type) and (pa.types.is_integer(data_type) or pa.types.is_floating(data_type)
+                                                   or pa.types.is_decimal(data_type))
+              or pa.types.is_decimal(array.type) and pa.types.is_decimal(data_type))
+    if not widens:
+        raise pa.ArrowTypeError(f"got {array.type} values")
+    return array.cast(data_type, safe=True)
+
+
+STREAM_FORMATS = {
+    "csv": (stream_csv_gzip, "application/gzip", "csv.gz"),
+    "parquet": (stream_parquet, "application/vnd.apache.parquet", "parquet"),
+    "arrow": (stream_arrow, "application/vnd.apache.arrow.stream", "arrows"),
+}
+EXPORT_FORMATS = {"xlsx": (XLSX_MIMETYPE, "xlsx"), **{name: (mimetype, extension) for name, (_, mimetype, extension) in STREAM_FORMATS.items()}}
+
+
+def write_export(batches: Batches, output_path: str, export_format: str) -> None:
+    """Writes query results to a file in one of `EXPORT_FORMATS`.
+
+    Args:
+        batches (Batches): The column names and batches of rows, see `utils.iter_query_batches`.
+        output_path (str): The path of the file to create.
+        export_format (str): "xlsx", "csv" (gzip-compressed), "parquet" or "arrow".
+    """
+    if export_format == "xlsx":
+        write_excel(batches, output_path)
+        return
+    stream = STREAM_FORMATS[export_format][0]
+    with open(output_path, "wb") as f:
+        for chunk in stream(batches):
+            f.write(chunk)
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only file that collects what is written to it until the next `drain`."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> Iterator[bytes]:
+        if self._chunks:
+            data = b"".join(self._chunks)
+            self._chunks.clear()
+            yield data
@@ -0,0 +1,25 @@
+"""Gunicorn settings for the Flask app (see app.yaml).
+
+Prometheus metrics are aggregated across workers through files in PROMETHEUS_MULTIPROC_DIR, see metrics.py. The
+directory is emptied when gunicorn starts, so counters do not carry over from a previous run, and the files of a
+worker are marked dead when it exits.
+"""
+import os
+import shutil
+
+# Must be set before prometheus_client is imported: it picks its multiprocess value class at import time, and the
+# workers forked from this process inherit the imported module.
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/typetwo/prometheus")
+
+from prometheus_client import multiprocess  # noqa: E402
+
+timeout = 120
+
+
+def on_starting(server):
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,338 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from exporters import EXPORT_FORMATS, write_export
+from pipeline import iter_query_pipeline
+from request_store import request_store
+from snapshots import SNAPSHOT_WAIT_SECONDS, iter_request_batches
+from sqlite_store import SQLiteStore
+from utils import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+JOBS_PATH = os.getenv("JOBS_PATH", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+JOBS_EXPORT_DIR = os.getenv("JOBS_EXPORT_DIR", os.path.join(CACHE_DIR, "exports", "jobs"))
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_TTL_SECONDS = int(os.getenv("JOBS_TTL_SECONDS", str(24 * 3600)))
+JOBS_MAX_ENTRIES = int(os.getenv("JOBS_MAX_ENTRIES", "2000"))
+JOBS_STALE_SECONDS = int(os.getenv("JOBS_STALE_SECONDS", "300"))
+JOBS_HEARTBEAT_SECONDS = float(os.getenv("JOBS_HEARTBEAT_SECONDS", "30"))
+JOBS_PROGRESS_INTERVAL_SECONDS = float(os.getenv("JOBS_PROGRESS_INTERVAL_SECONDS", "1"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+JOBS_PRUNE_EVERY = int(os.getenv("JOBS_PRUNE_EVERY", "100"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+HOST = socket.gethostname()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    result TEXT NOT NULL DEFAULT '{}',
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner_pid INTEGER,
+    owner_host TEXT,
+    heartbeat_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at);
+"""
+
+
+class JobStore(SQLiteStore):
+    """Persists background jobs and their progress, so any worker can report on them and restarts do not lose them.
+
+    A job is owned by the process that queued or runs it, identified by its host and pid, and that process beats
+    the heartbeat of its unfinished jobs (see `heartbeat`), however long they run. A queued or running job whose
+    owner has died (on this host) or whose heartbeat is older than `stale_seconds` is handed over to the next
+    process that calls `claim_orphans`, unless it has already been started `max_attempts` times, in which case it
+    is marked as failed. A job in a live process is never claimed, so two runs never write the same output.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int, stale_seconds: int, max_attempts: int,
+                 prune_every: int = 100, busy_timeout: float = 10.0):
+        super().__init__(path, _SCHEMA, busy_timeout)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self.prune_every = prune_every
+        self._creates = 0
+        self._migrate()
+
+    def create(self, kind: str, params: dict) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, kind, params, status, owner_pid, owner_host, heartbeat_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), QUEUED, os.getpid(), HOST, now, now, now)
+            )
+        self._creates += 1
+        if self._creates % self.prune_every == 0:
+            self.prune()
+        return job_id
+
+    def get(self, job_id: str) -> dict | None:
+        """Returns a job (job_id, kind, params, status, stage, result, error, attempts, owner_pid, owner_host,
+        heartbeat_at, created_at, updated_at), or None."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"], job["result"] = json.loads(job["params"]), json.loads(job["result"])
+        return job
+
+    def start(self, job_id: str) -> None:
+        """Marks a job as running in this process and counts the attempt."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, error = NULL, attempts = attempts + 1, owner_pid = ?, owner_host = ?, "
+                "heartbeat_at = ?, updated_at = ? WHERE job_id = ?",
+                (RUNNING, "started", os.getpid(), HOST, now, now, job_id)
+            )
+
+    def heartbeat(self) -> None:
+        """Marks the unfinished jobs of this process as alive."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner_pid = ? AND owner_host = ? AND status IN (?, ?)",
+                (time.time(), os.getpid(), HOST, QUEUED, RUNNING)
+            )
+
+    def update(self, job_id: str, **fields) -> None:
+        """Updates the status, stage, result or error of a job, and marks it as alive."""
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], default=str)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._transaction() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def claim_orphans(self) -> list[dict]:
+        """Takes over the unfinished jobs whose owner is dead or has stopped beating their heartbeat, and returns them."""
+        now = time.time()
+        claimed = []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT job_id, owner_pid, owner_host, attempts, COALESCE(heartbeat_at, updated_at) AS heartbeat_at "
+                "FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+            for row in rows:
+                local = row["owner_host"] in (HOST, None)
+                if local and row["owner_pid"] == os.getpid():
+                    continue
+                owner_dead = local and not _is_alive(row["owner_pid"])
+                if not owner_dead and row["heartbeat_at"] >= now - self.stale_seconds:
+                    continue
+                if row["attempts"] >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                        (FAILED, f"Abandoned after {row['attempts']} attempts", now, row["job_id"])
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET owner_pid = ?, owner_host = ?, status = ?, heartbeat_at = ?, updated_at = ? WHERE job_id = ?",
+                        (os.getpid(), HOST, QUEUED, now, now, row["job_id"])
+                    )
+                    claimed.append(row["job_id"])
+        return [self.get(job_id) for job_id in claimed]
+
+    def prune(self) -> None:
+        """Deletes the jobs finished more than `ttl_seconds` ago and the oldest ones beyond `max_entries`, with their files."""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT job_id, result FROM jobs WHERE status IN (?, ?) AND updated_at < ? "
+                "UNION SELECT job_id, result FROM jobs WHERE job_id NOT IN (SELECT job_id FROM jobs ORDER BY created_at DESC LIMIT ?)",
+                (DONE, FAILED, time.time() - self.ttl_seconds, self.max_entries)
+            ).fetchall()
+            conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(row["job_id"],) for row in rows])
+        for row in rows:
+            path = json.loads(row["result"]).get("path")
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _migrate(self) -> None:
+        # Files created before the owner_host and heartbeat_at columns existed keep their rows.
+        with self._transaction() as conn:
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, data_type in (("owner_host", "TEXT"), ("heartbeat_at", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {data_type}")
+
+    def stats(self) -> dict:
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+
+def _is_alive(pid: int | None) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+job_store = JobStore(
+    JOBS_PATH,
+    ttl_seconds=JOBS_TTL_SECONDS,
+    max_entries=JOBS_MAX_ENTRIES,
+    stale_seconds=JOBS_STALE_SECONDS,
+    max_attempts=JOBS_MAX_ATTEMPTS,
+    prune_every=JOBS_PRUNE_EVERY
+)
+_executor = ThreadPoolExecutor(max_workers=JOBS_WORKERS, thread_name_prefix="job")
+_heartbeat_pid = None
+_heartbeat_lock = threading.Lock()
+
+
+def _start_heartbeat() -> None:
+    """Starts the thread beating the heartbeat of this process's jobs, once per process (threads do not survive forks)."""
+    global _heartbeat_pid
+    with _heartbeat_lock:
+        if _heartbeat_pid == os.getpid():
+            return
+        _heartbeat_pid = os.getpid()
+    threading.Thread(target=_beat, name="job-heartbeat", daemon=True).start()
+
+
+def _beat() -> None:
+    while True:
+        time.sleep(JOBS_HEARTBEAT_SECONDS)
+        try:
+            job_store.heartbeat()
+        except Exception:
+            logger.exception("Could not update the job heartbeats")
+
+
+def submit_query(user_question: str) -> str:
+    """Queues a question for the full Orchestrator -> Writer/Checker -> Reporter pipeline.
+
+    Args:
+        user_question (str): The question provided by the user.
+
+    Returns:
+        str: The job id, to poll with `job_store.get`.
+    """
+    _start_heartbeat()
+    job_id = job_store.create("query", {"query": user_question})
+    _executor.submit(_run, job_id, "query", {"query": user_question})
+    return job_id
+
+
+def submit_export(request_id: str, export_format: str) -> str:
+    """Queues the export of the full results of a request to a file.
+
+    Args:
+        request_id (str): The id of the request, see `request_store`.
+        export_format (str): One of `exporters.EXPORT_FORMATS`.
+
+    Returns:
+        str: The job id, to poll with `job_store.get`.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format}, expected one of {', '.join(EXPORT_FORMATS)}")
+    params = {"request_id": request_id, "format": export_format}
+    _start_heartbeat()
+    job_id = job_store.create("export", params)
+    _executor.submit(_run, job_id, "export", params)
+    return job_id
+
+
+def resume_jobs() -> int:
+    """Re-queues the jobs left unfinished by a dead or stuck worker. Jobs restart from their first stage.
+
+    Returns:
+        int: The number of resumed jobs.
+    """
+    _start_heartbeat()
+    job_store.prune()
+    jobs = job_store.claim_orphans()
+    for job in jobs:
+        logger.info(f"Resuming {job['kind']} job {job['job_id']} (stage {job['stage']})")
+        _executor.submit(_run, job["job_id"], job["kind"], job["params"])
+    return len(jobs)
+
+
+def _run(job_id: str, kind: str, params: dict) -> None:
+    try:
+        job_store.start(job_id)
+        if kind == "query":
+            result = _run_query(job_id, params["query"])
+        else:
+            result = _run_export(job_id, params["request_id"], params["format"])
+        job_store.update(job_id, status=DONE, stage="done", result=result)
+    except Exception as e:
+        logger.exception(f"{kind} job {job_id} failed")
+        job_store.update(job_id, status=FAILED, error=str(e))
+
+
+def _run_query(job_id: str, user_question: str) -> dict:
+    """Runs the pipeline and records every stage, so pollers see the SQL attempts and result rows before the summary."""
+    result = {"attempts": [], "summary": ""}
+    last_update = 0.0
+    for event in iter_query_pipeline(user_question):
+        name = event["event"]
+        if name == "orchestrator":
+            result["instructions"] = event["instructions"]
+        elif name in ("sql_attempt", "traffic_light"):
+            result["attempts"].append({key: value for key, value in event.items() if key != "event"})
+        elif name == "cache_hit":
+            result["cacheHit"] = {"question": event["question"], "similarity": event["similarity"]}
+        elif name == "results":
+            result.update(requestId=event["requestId"], sql=event["sql"], searchResults=event["searchResults"])
+        elif name == "summary_chunk":
+            result["summary"] += event["text"]
+            if time.monotonic() - last_update < JOBS_PROGRESS_INTERVAL_SECONDS:
+                continue
+        elif name == "done":
+            result.update(summary=event["summary"], timings=event["timings"])
+            continue
+        job_store.update(job_id, stage=name, result=result)
+        last_update = time.monotonic()
+    return result
+
+
+def _run_export(job_id: str, request_id: str, export_format: str) -> dict:
+    request = request_store.get(request_id)
+    if request is None:
+        raise ValueError(f"Unknown or expired request id {request_id}")
+    if not request["sql"]:
+        raise ValueError(f"Request {request_id} has no SQL query, so it has no results")
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    os.makedirs(JOBS_EXPORT_DIR, exist_ok=True)
+    path = os.path.join(JOBS_EXPORT_DIR, f"{job_id}.{extension}")
+    tmp_path = f"{path}.{HOST}.{os.getpid()}.tmp"
+    job_store.update(job_id, stage="exporting")
+    try:
+        write_export(iter_request_batches(request, SNAPSHOT_WAIT_SECONDS), tmp_path, export_format)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return {"requestId": request_id, "path": path, "mimetype": mimetype, "extension": extension, "bytes": os.path.getsize(path)}
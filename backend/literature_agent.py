@@ -1,16 +1,27 @@
 from io import BytesIO
 import logging
 from google.cloud import storage
-from vertexai.preview.generative_models import GenerativeModel, Content, Part, GenerationConfig
+from vertexai.preview.generative_models import Content, Part, GenerationConfig
+from llm_client import generate_content, FLASH_MODEL, DETERMINISTIC_CONFIG
 from typing import Any
 import json
-from tqdm import tqdm
 import os
 
-from task_description import PDF_ANALYSIS_INSTRUCTION
+from literature_findings import answer_map_reduce
+from literature_index import literature_index, LITERATURE_INDEX_PATH
+from literature_indexer import index_documents
+import literature_passages
+from task_description import PDF_ANALYSIS_INSTRUCTION, PASSAGE_ANALYSIS_INSTRUCTION
 
 logger = logging.getLogger(__name__)
 
+LITERATURE_SHORTLIST_SIZE = int(os.getenv("LITERATURE_SHORTLIST_SIZE", "20"))
+LITERATURE_MAX_DOCUMENTS = int(os.getenv("LITERATURE_MAX_DOCUMENTS", "10"))
+LITERATURE_RERANK = os.getenv("LITERATURE_RERANK", "0") != "0"
+LITERATURE_PASSAGES = os.getenv("LITERATURE_PASSAGES", "1") != "0"
+LITERATURE_ANSWER_MODE = os.getenv("LITERATURE_ANSWER_MODE", "auto")  # "auto", "single" or "map_reduce"
+LITERATURE_MAP_REDUCE_MIN_DOCUMENTS = int(os.getenv("LITERATURE_MAP_REDUCE_MIN_DOCUMENTS", "4"))
+
 RESPONSE_SCHEMA = {
     "type": "object",
     "properties": {
@@ -44,13 +55,39 @@ def generate_answer(prompt: str) -> str:
     _, documents = retrieve_relevant_documents(prompt)
     documents: list = json.loads(documents)["documents"]
     print(documents)
-    _, answer = ask_gemini(prompt, documents)
+    if use_map_reduce(documents):
+        _, answer = answer_map_reduce(prompt, documents)
+    else:
+        try:
+            _, answer = ask_gemini(prompt, documents)
+        except Exception:
+            if LITERATURE_ANSWER_MODE != "auto" or len(documents) < 2:
+                raise
+            logger.warning("Single call over the documents failed, falling back to map-reduce")
+            _, answer = answer_map_reduce(prompt, documents)
     print(answer)
     return answer
 
+
+def use_map_reduce(documents: list) -> bool:
+    """
+    Decides how `generate_answer` reads the documents, see LITERATURE_ANSWER_MODE.
+    
+    In "auto" mode, map-reduce (see `literature_findings`) is used when at least LITERATURE_MAP_REDUCE_MIN_DOCUMENTS
+    documents would otherwise be attached as whole PDFs to a single call, i.e. when some have no cached passages.
+    """
+    if LITERATURE_ANSWER_MODE != "auto":
+        return LITERATURE_ANSWER_MODE == "map_reduce"
+    whole_pdfs = not LITERATURE_PASSAGES or any(literature_passages.load_document(document) is None for document in documents)
+    return whole_pdfs and len(documents) >= LITERATURE_MAP_REDUCE_MIN_DOCUMENTS
+
 def ask_gemini(prompt: str, documents: list) -> tuple[Any, str]:
     """
     Ask Gemini model with a prompt and PDF documents to analyze.
+
+    When the passages of every document have been extracted (see `literature_passages`), only the passages most
+    relevant to the prompt are sent, with the front matter and page of each. Otherwise, or with
+    LITERATURE_PASSAGES=0, the whole PDFs are attached.
     
     Args:
         prompt: User's input string
@@ -65,14 +102,17 @@ def ask_gemini(prompt: str, documents: list) -> tuple[Any, str]:
         Exception: If Gemini API call fails
     """
     try:
-        data_part = [Part.from_uri(uri=document, mime_type="application/pdf") for document in documents]
-        prompt = f"Instructions: {PDF_ANALYSIS_INSTRUCTION}\n\nUser input: {prompt}"
-        model = GenerativeModel(model_name="gemini-2.0-flash-001")
-        response = model.generate_content(
+        parts = build_passage_parts(prompt, documents) if LITERATURE_PASSAGES else None
+        if parts is None:
+            data_part = [Part.from_uri(uri=document, mime_type="application/pdf") for document in documents]
+            parts = [*data_part, Part.from_text(f"Instructions: {PDF_ANALYSIS_INSTRUCTION}\n\nUser input: {prompt}")]
+        response = generate_content(
+            FLASH_MODEL,
             contents=[
-                Content(role="user", parts=[*data_part, Part.from_text(prompt)])
+                Content(role="user", parts=parts)
             ],
-            generation_config=GenerationConfig(temperature=0, top_k=1, top_p=1)
+            generation_config=DETERMINISTIC_CONFIG,
+            agent="literature_answer"
         )
         
         text_response: str = response.candidates[0].content.parts[0].text
@@ -82,29 +122,59 @@ def ask_gemini(prompt: str, documents: list) -> tuple[Any, str]:
         logger.exception(f"Error querying Gemini with documents: {str(e)}")
         raise Exception(f"Failed to get response from Gemini: {str(e)}")
 
+
+def build_passage_parts(prompt: str, documents: list) -> list | None:
+    """
+    Builds the request parts of the passage mode of `ask_gemini`.
+    
+    Returns:
+        list | None: The parts, or None if a document has no cached passages or no passage matches the prompt,
+            in which case the whole PDFs should be sent.
+    """
+    extracted = [literature_passages.load_document(document) for document in documents]
+    if not extracted or any(document is None for document in extracted):
+        return None
+    passages = literature_passages.select_passages(prompt, extracted)
+    if not passages:
+        return None
+    logger.info(f"Sending {len(passages)} passages from {len({passage.uri for passage in passages})} documents")
+    excerpts = literature_passages.format_passages(extracted, passages)
+    return [Part.from_text(f"Instructions: {PASSAGE_ANALYSIS_INSTRUCTION}\n\nDocument excerpts:\n{excerpts}\n\nUser input: {prompt}")]
+
 def retrieve_relevant_documents(prompt: str) -> tuple[Any, json]:
     """
     Retrieve the most relevant documents for a given user prompt.
+
+    The documents are ranked locally by their titles and keywords, with BM25 and TF-IDF vectors, see
+    `literature_index`, and the best LITERATURE_MAX_DOCUMENTS are returned. Documents scoring well below the best
+    match are dropped first (LITERATURE_MIN_SCORE_SHARE, LITERATURE_MIN_SIMILARITY), so a narrow question gets a few
+    documents rather than a full list, and only the questions with many relevant documents go through map-reduce.
+    With LITERATURE_RERANK=1, the shortlist
+    of the best LITERATURE_SHORTLIST_SIZE documents is sent to Gemini instead, which picks the 5 to 10 most relevant.
     
     Args:
         prompt: User's input string
         
     Returns:
         tuple: (raw_response, documents_json)
-            - raw_response: Complete response object from Gemini
+            - raw_response: Complete response object from Gemini, or None if Gemini was not called
             - documents_json: JSON string containing the list of relevant document URIs
     """
-    with open("index.json", "r", encoding="utf-8") as file:
-        json_content = json.load(file)
-    json_text = json.dumps(json_content)
+    shortlist = literature_index.get().top_k(prompt, LITERATURE_SHORTLIST_SIZE)
+    logger.info(f"Literature shortlist: {[(document.title, round(score, 2)) for document, score in shortlist]}")
+    if not LITERATURE_RERANK or len(shortlist) <= LITERATURE_MAX_DOCUMENTS:
+        return None, json.dumps({"documents": [document.uri for document, _ in shortlist[:LITERATURE_MAX_DOCUMENTS]]})
+
+    json_text = json.dumps({document.uri: {"title": document.title, "keywords": document.keywords} for document, _ in shortlist})
     
     prompt = f"Go throgh the keywords and select the 5 to 10 most relevant documents based on the user input. User input:\n{prompt}\n\n{json_text}"
-    model = GenerativeModel(model_name="gemini-2.0-flash-001")
-    response = model.generate_content(
+    response = generate_content(
+        FLASH_MODEL,
         contents=[
             Content(role="user", parts=[Part.from_text(prompt)])
         ],
-        generation_config=GenerationConfig(temperature=0, top_k=1, top_p=1, response_mime_type="application/json", response_schema=RESPONSE_SCHEMA_2)
+        generation_config=GenerationConfig(temperature=0, top_k=1, top_p=1, response_mime_type="application/json", response_schema=RESPONSE_SCHEMA_2),
+        agent="literature_rerank"
     )
     documents = response.candidates[0].content.parts[0].text
     return response, documents
@@ -122,13 +192,14 @@ def generate_keywords(file_path: str):
             - raw_response: Complete response object from Gemini
             - keywords_json: JSON string containing title and keywords
     """
-    model = GenerativeModel(model_name="gemini-2.0-flash-001")
     prompt = "Generate a list of 100 high value and specific keywords for the following document. The output should be a json with title and keywords. For abbreviations, use the abbreviaion and the full form as a single keyword. Make sure that the keywords are compatible with json parsing. Again, make sure you don't use any symbols incompatible with json. Use only standard characters. Don't use weird characters."
-    response = model.generate_content(
+    response = generate_content(
+        FLASH_MODEL,
         contents=[
             Content(role="user", parts=[Part.from_uri(uri=file_path, mime_type="application/pdf"), Part.from_text(prompt)])
         ],
-        generation_config=GenerationConfig(response_mime_type="application/json", response_schema=RESPONSE_SCHEMA)
+        generation_config=GenerationConfig(response_mime_type="application/json", response_schema=RESPONSE_SCHEMA),
+        agent="literature_keywords"
     )
     keywords = response.candidates[0].content.parts[0].text
     return response, keywords
@@ -137,8 +208,8 @@ def build_index(documents: list):
     """
     Used only for buildling the index, not used in the app.
     
-    Incrementally builds the index to avoid reprocessing documents and losing progress.
-    Saves to index.jsonafter each document.
+    Generates the keywords of the documents missing from the index in parallel and journals each result as it
+    arrives, so an interrupted run resumes where it stopped. See `literature_indexer`.
     
     Args:
         documents: List of GCS URIs pointing to PDF documents
@@ -146,26 +217,12 @@ def build_index(documents: list):
     Returns:
         dict: The complete index with document URIs as keys and their metadata as values
     """
-    index = {}
-    if os.path.exists("index.json"):
-        with open("index.json", "r") as f:
-            index = json.load(f)
-    
-    for document in tqdm(documents, desc="Processing Documents"):
-        if document not in index:
-            print(f"Adding new document: {document}")
-            _, keywords = generate_keywords(document)
-            keywords = json.loads(keywords)
-            index[document] = {
-                "title": keywords["title"],
-                "keywords": keywords["keywords"]
-            }
-            json.dump(index, open("index.json", "w"), indent=4)
-        else:
-            print(f"Skipping already processed document: {document}")
-    
-    print(f"Index built and saved to index.json")
-    return index
+    def generate(document: str) -> dict:
+        _, keywords = generate_keywords(document)
+        keywords = json.loads(keywords)
+        return {"title": keywords["title"], "keywords": keywords["keywords"]}
+
+    return index_documents(documents, generate, LITERATURE_INDEX_PATH)
 
 def get_document_paths(prefix="Journal of Medicinal Chemistry"):
     """
@@ -0,0 +1,167 @@
+"""Map-reduce answering over many literature documents.
+
+Each document is read on its own by a per-document extraction call (map), run concurrently on a thread pool, and
+the compact findings are merged into one answer by a final call (reduce). No call ever holds more than one
+document, so the number of documents is not bounded by the context window. Findings are cached by document and
+normalized question, so overlapping questions only read the documents they have not seen yet.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from vertexai.preview.generative_models import Content, Part
+
+import literature_passages
+from llm_client import generate_content, FLASH_MODEL, DETERMINISTIC_CONFIG
+from question_cache import normalize_question
+from sqlite_store import SQLiteStore
+from task_description import DOCUMENT_FINDINGS_INSTRUCTION, FINDINGS_MERGE_INSTRUCTION
+from utils import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+FINDINGS_CACHE_PATH = os.getenv("LITERATURE_FINDINGS_PATH", os.path.join(CACHE_DIR, "literature_findings.sqlite3"))
+FINDINGS_CACHE_MAX_ENTRIES = int(os.getenv("LITERATURE_FINDINGS_MAX_ENTRIES", "20000"))
+FINDINGS_CACHE_TTL_SECONDS = int(os.getenv("LITERATURE_FINDINGS_TTL_SECONDS", str(30 * 24 * 3600)))
+MAP_WORKERS = int(os.getenv("LITERATURE_MAP_WORKERS", "8"))
+
+NOT_RELEVANT = "NOT RELEVANT"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS findings (
+    document TEXT NOT NULL,
+    question TEXT NOT NULL,
+    findings TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (document, question)
+);
+CREATE INDEX IF NOT EXISTS findings_created_at ON findings (created_at);
+"""
+
+
+class FindingsCache(SQLiteStore):
+    """Caches the findings of a document for a normalized question (see `question_cache.normalize_question`).
+
+    Entries expire `ttl_seconds` after they were written, and the oldest are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: int, prune_every: int = 100, busy_timeout: float = 10.0):
+        super().__init__(path, _SCHEMA, busy_timeout)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0}
+
+    def get(self, document: str, question: str) -> str | None:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT findings FROM findings WHERE document = ? AND question = ? AND created_at >= ?",
+                (document, normalize_question(question), time.time() - self.ttl_seconds)
+            ).fetchone()
+        with self._lock:
+            self._counters["hits" if row else "misses"] += 1
+        return row["findings"] if row else None
+
+    def put(self, document: str, question: str, findings: str) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO findings (document, question, findings, created_at) VALUES (?, ?, ?, ?)",
+                (document, normalize_question(question), findings, time.time())
+            )
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def prune(self) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM findings WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM findings WHERE rowid NOT IN (SELECT rowid FROM findings ORDER BY created_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self) -> dict:
+        with self._transaction() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM findings").fetchone()[0]
+        with self._lock:
+            return {"entries": entries, **self._counters}
+
+
+findings_cache = FindingsCache(FINDINGS_CACHE_PATH, FINDINGS_CACHE_MAX_ENTRIES, FINDINGS_CACHE_TTL_SECONDS)
+_executor = ThreadPoolExecutor(max_workers=MAP_WORKERS, thread_name_prefix="literature-map")
+
+
+def extract_findings(prompt: str, document: str) -> str:
+    """Returns what a single document says about the user input, or NOT_RELEVANT. Cached, see `findings_cache`.
+
+    The document is read from its cached passages when it has been extracted (see `literature_passages`), and
+    attached as a whole PDF otherwise.
+    """
+    cached = findings_cache.get(document, prompt)
+    if cached is not None:
+        return cached
+
+    instruction = f"Instructions: {DOCUMENT_FINDINGS_INSTRUCTION}\n\nUser input: {prompt}"
+    extracted = literature_passages.load_document(document)
+    passages = literature_passages.select_passages(prompt, [extracted]) if extracted else []
+    if passages:
+        excerpts = literature_passages.format_passages([extracted], passages)
+        parts = [Part.from_text(f"{instruction}\n\nDocument excerpts:\n{excerpts}")]
+    else:
+        parts = [Part.from_uri(uri=document, mime_type="application/pdf"), Part.from_text(instruction)]
+    response = generate_content(
+        FLASH_MODEL,
+        contents=[Content(role="user", parts=parts)],
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="literature_map"
+    )
+    findings = response.candidates[0].content.parts[0].text.strip()
+    findings_cache.put(document, prompt, findings)
+    return findings
+
+
+def answer_map_reduce(prompt: str, documents: list) -> tuple[object, str]:
+    """Answers the user input from many documents: concurrent per-document findings, merged by a final call.
+
+    Relevant documents are numbered in the order of `documents`, and the merge keeps that numbering for the
+    in-text citations and the reference list.
+
+    Args:
+        prompt: User's input string
+        documents: List of GCS URIs pointing to PDF documents
+
+    Returns:
+        tuple: (raw_response, text_response) of the merge call, like `literature_agent.ask_gemini`.
+    """
+    # Each call runs in a copy of the caller's context, so its usage is attributed to the caller's request.
+    futures = [_executor.submit(contextvars.copy_context().run, extract_findings, prompt, document) for document in documents]
+    findings = []
+    for document, future in zip(documents, futures):
+        try:
+            text = future.result()
+        except Exception as e:
+            logger.warning(f"Could not extract findings from {document}: {e}")
+            continue
+        if text.strip().upper().rstrip(".") != NOT_RELEVANT:
+            findings.append(text)
+    if futures and not findings and all(future.exception() for future in futures):
+        raise Exception("Failed to extract findings from every document")
+    logger.info(f"Merging the findings of {len(findings)} of {len(documents)} documents")
+
+    numbered = "\n\n".join(f"[{number}]\n{text}" for number, text in enumerate(findings, 1)) or "No document is relevant."
+    response = generate_content(
+        FLASH_MODEL,
+        contents=[Content(role="user", parts=[Part.from_text(
+            f"Instructions: {FINDINGS_MERGE_INSTRUCTION}\n\nFindings per document:\n{numbered}\n\nUser input: {prompt}"
+        )])],
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="literature_reduce"
+    )
+    return response, response.candidates[0].content.parts[0].text
@@ -0,0 +1,264 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from bm25 import tokenize
+from literature_vectors import VectorIndex
+from utils import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+LITERATURE_INDEX_PATH = os.getenv("LITERATURE_INDEX_PATH", "index.json")
+LITERATURE_INDEX_DIR = os.getenv("LITERATURE_INDEX_DIR", os.path.join(CACHE_DIR, "literature_index"))
+LITERATURE_INDEX_CHECK_SECONDS = float(os.getenv("LITERATURE_INDEX_CHECK_SECONDS", "5"))
+# Relevance cutoffs: a document is kept by a ranking only if its score is at least this share of the best score of
+# that ranking, and, for the vector ranking, at least this cosine similarity. Character n-gram vectors give almost
+# every document a small positive similarity, so without them every question would get a full shortlist.
+LITERATURE_MIN_SCORE_SHARE = float(os.getenv("LITERATURE_MIN_SCORE_SHARE", "0.5"))
+LITERATURE_MIN_SIMILARITY = float(os.getenv("LITERATURE_MIN_SIMILARITY", "0.1"))
+
+TITLE_WEIGHT = 2
+RRF_K = 60
+_ARRAYS = ("offsets", "doc_ids", "term_frequencies", "lengths")
+
+
+@dataclass(frozen=True)
+class LiteratureDocument:
+    uri: str
+    title: str
+    keywords: list[str]
+
+
+class InvertedIndex:
+    """A BM25-ranked inverted index over the title and keywords of the literature documents.
+
+    The vocabulary is interned: each term maps to an integer id, and the postings of all terms are stored back to
+    back in flat integer arrays (CSR layout), with `offsets[t]:offsets[t + 1]` delimiting the postings of term t.
+    The arrays are saved as .npy files and memory-mapped, so every worker of a host shares the same pages.
+    """
+
+    def __init__(self, directory: str, vocabulary: list[str], document_count: int, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.document_count = document_count
+        self.term_ids = {term: i for i, term in enumerate(vocabulary)}
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in _ARRAYS}
+        self.offsets, self.doc_ids = arrays["offsets"], arrays["doc_ids"]
+        self.term_frequencies, lengths = arrays["term_frequencies"], arrays["lengths"]
+        n = document_count
+        document_frequencies = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log(1 + (n - document_frequencies + 0.5) / (document_frequencies + 0.5)).astype(np.float32)
+        average_length = float(lengths.mean()) if n else 0.0
+        self.norms = (k1 * (1 - b + b * lengths / average_length) if average_length else np.full(n, k1)).astype(np.float32)
+
+    @staticmethod
+    def build(texts: list[str], directory: str) -> list[str]:
+        """Builds the postings of the documents in `directory`, and returns the vocabulary."""
+        postings = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[doc_id] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+
+        vocabulary = sorted(postings)
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in vocabulary])
+        doc_ids = np.fromiter((doc_id for term in vocabulary for doc_id in postings[term]), dtype=np.int32, count=offsets[-1])
+        term_frequencies = np.fromiter((tf for term in vocabulary for tf in postings[term].values()), dtype=np.float32, count=offsets[-1])
+
+        os.makedirs(directory, exist_ok=True)
+        for name, array in zip(_ARRAYS, (offsets, doc_ids, term_frequencies, lengths)):
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        return vocabulary
+
+    def scores(self, query_tokens: list[str]) -> np.ndarray:
+        """Returns the BM25 score of every document for the query, in document order."""
+        scores = np.zeros(self.document_count, dtype=np.float32)
+        counts = {}
+        for token in query_tokens:
+            if token in self.term_ids:
+                counts[token] = counts.get(token, 0) + 1
+        for token, query_count in counts.items():
+            term_id = self.term_ids[token]
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            doc_ids, tf = self.doc_ids[start:end], self.term_frequencies[start:end]
+            scores[doc_ids] += (1 + np.log(query_count)) * self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.norms[doc_ids])
+        return scores
+
+    def top_k(self, query: str, k: int) -> list[tuple[int, float]]:
+        """Returns the (document index, score) pairs of the k best matching documents with a positive score."""
+        scores = self.scores(tokenize(query))
+        k = min(k, int(np.count_nonzero(scores > 0)))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(i), float(scores[i])) for i in best]
+
+
+class CompiledIndex:
+    """The documents of a version of the keyword file, searchable by keywords (BM25) and by TF-IDF vectors."""
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.documents = [LiteratureDocument(**document) for document in meta["documents"]]
+        self.keywords = InvertedIndex(directory, meta["vocabulary"], len(self.documents))
+        self.vectors = VectorIndex(directory, len(self.documents))
+
+    @staticmethod
+    def build(entries: dict, directory: str) -> None:
+        """Compiles the entries of index.json ({uri: {"title", "keywords"}}) into an index directory."""
+        documents = [{"uri": uri, "title": entry.get("title", ""), "keywords": entry.get("keywords", [])} for uri, entry in entries.items()]
+        texts = [" ".join([document["title"]] * TITLE_WEIGHT + document["keywords"]) for document in documents]
+        vocabulary = InvertedIndex.build(texts, directory)
+        VectorIndex.build(texts, directory)
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"vocabulary": vocabulary, "documents": documents}, f)
+
+    def top_k(self, query: str, k: int, min_share: float = LITERATURE_MIN_SCORE_SHARE,
+              min_similarity: float = LITERATURE_MIN_SIMILARITY) -> list[tuple[LiteratureDocument, float]]:
+        """Returns up to k relevant documents for the query, best first.
+
+        The BM25 and vector rankings are merged with reciprocal rank fusion (the score of a document is the sum of
+        1 / (60 + rank) over the rankings that contain it), so exact keyword hits and paraphrases both surface
+        without calibrating one score against the other. Fused scores only reflect ranks, so the relevance cutoffs
+        are applied to the raw scores first: each ranking drops the documents scoring below `min_share` of its best
+        score, and the vector ranking also those below a cosine similarity of `min_similarity`.
+        """
+        keyword_ranking = self.keywords.top_k(query, k)
+        vector_ranking = [(doc_id, score) for doc_id, score in self.vectors.top_k(query, k) if score >= min_similarity]
+        fused = {}
+        for ranking in (keyword_ranking, vector_ranking):
+            if ranking:
+                cutoff = min_share * ranking[0][1]
+                ranking = [(doc_id, score) for doc_id, score in ranking if score >= cutoff]
+                for rank, (doc_id, _) in enumerate(ranking):
+                    fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (RRF_K + rank + 1)
+        best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[doc_id], score) for doc_id, score in best]
+
+
+class LiteratureIndex:
+    """Keeps the compiled index of a keyword file loaded, and reloads it when the file changes.
+
+    Compiled indexes are stored in `index_dir` under the SHA-256 of the keyword file, so an index built offline
+    (see `main`) and shipped with the app is picked up as is, and otherwise each version of the file is compiled
+    once per host, by whichever worker gets there first. The file is hashed again only when its modification time
+    or size changes.
+    """
+
+    def __init__(self, path: str, index_dir: str, check_seconds: float = 5.0):
+        self.path = path
+        self.index_dir = index_dir
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._index: CompiledIndex | None = None
+        self._stat: tuple[int, int] | None = None
+        self._version: str | None = None
+        self._checked_at = 0.0
+
+    def get(self) -> CompiledIndex:
+        """Returns the index of the current version of the keyword file."""
+        if self._index is not None and time.monotonic() - self._checked_at < self.check_seconds:
+            return self._index
+        with self._lock:
+            stat = os.stat(self.path)
+            if (stat.st_mtime_ns, stat.st_size) != self._stat:
+                version = file_version(self.path)
+                if version != self._version:
+                    self._index = self._load(version)
+                    self._version = version
+                self._stat = (stat.st_mtime_ns, stat.st_size)
+            self._checked_at = time.monotonic()
+            return self._index
+
+    def _load(self, version: str) -> CompiledIndex:
+        directory = os.path.join(self.index_dir, version)
+        if not os.path.exists(os.path.join(directory, "meta.json")):
+            compile_index(self.path, self.index_dir, version)
+            self._remove_old_versions(version)
+        return CompiledIndex(directory)
+
+    def _remove_old_versions(self, version: str) -> None:
+        for name in os.listdir(self.index_dir):
+            if name != version and not name.startswith(".tmp-"):
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+    def stats(self) -> dict:
+        index = self._index
+        if index is None:
+            return {"loaded": False}
+        return {
+            "loaded": True,
+            "version": self._version,
+            "documents": len(index.documents),
+            "terms": len(index.keywords.term_ids),
+            "postings": int(index.keywords.offsets[-1]),
+            "vectorFeatures": len(index.vectors.features),
+            "vectorEntries": len(index.vectors.weights)
+        }
+
+
+def file_version(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def compile_index(path: str, index_dir: str, version: str | None = None) -> str:
+    """Compiles a keyword file into `index_dir`/<version>, atomically, and returns the directory."""
+    version = version or file_version(path)
+    directory = os.path.join(index_dir, version)
+    start = time.perf_counter()
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=index_dir, prefix=".tmp-")
+    os.chmod(tmp_dir, 0o755)
+    CompiledIndex.build(entries, tmp_dir)
+    try:
+        os.rename(tmp_dir, directory)
+    except OSError:  # Another worker compiled the same version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(f"Compiled the literature index of {len(entries)} documents in {time.perf_counter() - start:.2f}s")
+    return directory
+
+
+literature_index = LiteratureIndex(LITERATURE_INDEX_PATH, LITERATURE_INDEX_DIR, LITERATURE_INDEX_CHECK_SECONDS)
+
+
+def main():
+    """Compiles the literature index ahead of time, e.g. before a deploy that sets LITERATURE_INDEX_DIR to the
+    output directory, so no worker compiles it on its first request.
+
+    Run from the backend directory:
+        python -m literature_index [--index index.json] [--output literature_index]
+    """
+    parser = argparse.ArgumentParser(description="Compiles the literature keyword file into a search index.")
+    parser.add_argument("--index", default=LITERATURE_INDEX_PATH, help="The keyword file written by build_index.")
+    parser.add_argument("--output", default=LITERATURE_INDEX_DIR, help="The directory of the compiled indexes.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    directory = compile_index(args.index, args.output)
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    print(f"Wrote {directory} ({size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
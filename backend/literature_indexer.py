@@ -0,0 +1,136 @@
+"""Builds the literature keyword file (index.json) from many PDFs at once, resumably.
+
+Keywords are generated on a bounded thread pool, throttled to a request rate, and each result is appended to a
+JSONL journal as soon as it arrives, so a crash loses at most the documents in flight and a rerun only processes
+the documents found neither in the journal nor in index.json. When every document is done, the journal is
+compacted into index.json, which is replaced atomically.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
+from tqdm import tqdm
+
+from literature_index import LITERATURE_INDEX_PATH
+
+logger = logging.getLogger(__name__)
+
+INDEXER_WORKERS = int(os.getenv("LITERATURE_INDEXER_WORKERS", "8"))
+INDEXER_REQUESTS_PER_MINUTE = float(os.getenv("LITERATURE_INDEXER_REQUESTS_PER_MINUTE", "60"))
+
+
+class RateLimiter:
+    """Spaces calls evenly so that at most `per_minute` start in any minute, whatever the number of threads."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class IndexJournal:
+    """An append-only JSONL file of indexed documents, one {"uri", "title", "keywords"} object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """Returns the journaled entries by URI. A line cut short by a crash is ignored."""
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping the unreadable line {line_number} of {self.path}")
+                    continue
+                entries[record["uri"]] = {"title": record["title"], "keywords": record["keywords"]}
+        return entries
+
+    def append(self, uri: str, entry: dict) -> None:
+        line = json.dumps({"uri": uri, "title": entry["title"], "keywords": entry["keywords"]}) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def index_documents(documents: list[str], generate: Callable[[str], dict], index_path: str = LITERATURE_INDEX_PATH,
+                    workers: int = INDEXER_WORKERS, requests_per_minute: float = INDEXER_REQUESTS_PER_MINUTE) -> dict:
+    """Adds the documents missing from the keyword file, and returns the complete index.
+
+    Args:
+        documents (list[str]): The GCS URIs of the PDF documents.
+        generate (Callable[[str], dict]): Returns the {"title", "keywords"} of a document URI.
+        index_path (str): The keyword file, journaled to `index_path` + ".journal.jsonl" while building.
+        workers (int): The number of documents processed at once.
+        requests_per_minute (float): The maximum rate of calls to `generate`. 0 disables the limit.
+
+    Returns:
+        dict: The complete index with document URIs as keys and their title and keywords as values.
+    """
+    journal = IndexJournal(f"{index_path}.journal.jsonl")
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    index.update(journal.load())
+    pending = list(dict.fromkeys(document for document in documents if document not in index))
+    logger.info(f"{len(documents) - len(pending)} documents already indexed, {len(pending)} to process")
+
+    limiter = RateLimiter(requests_per_minute)
+    failed = []
+
+    def process(document: str) -> dict:
+        limiter.wait()
+        entry = generate(document)
+        journal.append(document, entry)
+        return entry
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="indexer") as executor:
+        futures = {executor.submit(process, document): document for document in pending}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing Documents"):
+            document = futures[future]
+            try:
+                index[document] = future.result()
+            except Exception as e:
+                logger.warning(f"Could not index {document}: {e}")
+                failed.append(document)
+
+    _write_atomically(index_path, index)
+    journal.remove()
+    if failed:
+        logger.warning(f"{len(failed)} documents failed and will be retried on the next run: {failed}")
+    logger.info(f"Index of {len(index)} documents saved to {index_path}")
+    return index
+
+
+def _write_atomically(path: str, index: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
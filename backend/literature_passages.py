@@ -0,0 +1,220 @@
+"""Passages of the literature PDFs, extracted offline and selected per question, so that the model reads a few
+relevant pages instead of whole documents.
+
+The text of each PDF is extracted page by page and split into overlapping passages, cached on local disk as one
+JSON file per document. At query time, the passages of the retrieved documents are ranked with BM25 against the
+question, and only the best ones are sent, labelled with their document and page.
+
+App Engine instances only have a temporary, per-instance disk, so the cache is built offline and deployed with the
+app, like the compiled literature index (see `literature_index.main`). Build it from the backend directory with:
+    python -m literature_passages [--index index.json] [--workers 8] [--output literature_passages]
+By default the output is the `literature_passages` directory next to this module, which is then uploaded by
+`gcloud app deploy` and read as is. For a corpus too large to bundle, sync the directory to GCS instead:
+    gsutil -m rsync -r literature_passages gs://<bucket>/literature_passages
+and set LITERATURE_PASSAGE_GCS_URI to that prefix: the passages of a document missing locally are then downloaded
+to the instance's disk on first use.
+"""
+import argparse
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from google.cloud import storage
+from pypdf import PdfReader
+from tqdm import tqdm
+
+from bm25 import BM25Index, tokenize
+from literature_index import LITERATURE_INDEX_PATH
+from utils import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_PASSAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "literature_passages")
+PASSAGE_DIR = os.getenv("LITERATURE_PASSAGE_DIR", BUNDLED_PASSAGE_DIR)
+PASSAGE_DOWNLOAD_DIR = os.path.join(CACHE_DIR, "literature_passages")
+PASSAGE_GCS_URI = os.getenv("LITERATURE_PASSAGE_GCS_URI", "").rstrip("/")  # e.g. gs://bucket/literature_passages
+PASSAGE_WORDS = int(os.getenv("LITERATURE_PASSAGE_WORDS", "200"))
+PASSAGE_OVERLAP_WORDS = int(os.getenv("LITERATURE_PASSAGE_OVERLAP_WORDS", "40"))
+PASSAGE_TOP_K = int(os.getenv("LITERATURE_PASSAGE_TOP_K", "24"))
+FRONT_MATTER_WORDS = 150
+
+
+@dataclass(frozen=True)
+class Passage:
+    uri: str
+    page: int
+    text: str
+
+
+@dataclass(frozen=True)
+class DocumentPassages:
+    uri: str
+    title: str
+    front_matter: str
+    passages: list[Passage]
+    tokens: list[list[str]]
+
+
+def passage_file_name(uri: str) -> str:
+    return f"{hashlib.sha1(uri.encode('utf-8')).hexdigest()}.json"
+
+
+def passage_path(uri: str, directory: str = PASSAGE_DIR) -> str:
+    return os.path.join(directory, passage_file_name(uri))
+
+
+def split_passages(pages: list[str], words: int = PASSAGE_WORDS, overlap: int = PASSAGE_OVERLAP_WORDS) -> list[dict]:
+    """Splits the text of each page into passages of about `words` words, overlapping by `overlap` words.
+
+    Passages never span pages, so each keeps an exact page reference.
+    """
+    passages = []
+    step = max(1, words - overlap)
+    for page_number, text in enumerate(pages, 1):
+        page_words = re.sub(r"-\n(?=[a-z])", "", text).split()
+        for start in range(0, max(1, len(page_words) - overlap), step):
+            chunk = page_words[start:start + words]
+            if chunk:
+                passages.append({"page": page_number, "text": " ".join(chunk)})
+    return passages
+
+
+def extract_document(uri: str, title: str, client: storage.Client, directory: str = PASSAGE_DIR) -> None:
+    """Downloads a PDF from GCS, extracts its passages and writes them to the passage cache."""
+    bucket_name, blob_name = uri.removeprefix("gs://").split("/", 1)
+    data = client.bucket(bucket_name).blob(blob_name).download_as_bytes()
+    pages = [page.extract_text() or "" for page in PdfReader(io.BytesIO(data)).pages]
+    document = {"uri": uri, "title": title, "pages": len(pages), "passages": split_passages(pages)}
+    path = passage_path(uri, directory)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(document, f)
+    os.replace(tmp_path, path)
+
+
+def extract_corpus(index_path: str = LITERATURE_INDEX_PATH, workers: int = 8, directory: str = PASSAGE_DIR) -> int:
+    """Extracts the passages of every document of the keyword file that is not cached yet.
+
+    Returns:
+        int: The number of documents that could not be extracted.
+    """
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    os.makedirs(directory, exist_ok=True)
+    pending = [uri for uri in index if not os.path.exists(passage_path(uri, directory))]
+    logger.info(f"{len(index) - len(pending)} documents already extracted, {len(pending)} to process")
+    client = storage.Client()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as executor:
+        futures = {executor.submit(extract_document, uri, index[uri].get("title", ""), client, directory): uri for uri in pending}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Extracting Documents"):
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f"Could not extract {futures[future]}: {e}")
+                failed += 1
+    return failed
+
+
+def load_document(uri: str) -> DocumentPassages | None:
+    """Returns the cached passages of a document, tokenized, or None if it has not been extracted.
+
+    A document missing from LITERATURE_PASSAGE_DIR is downloaded from LITERATURE_PASSAGE_GCS_URI, when it is set,
+    into a writable directory of the instance's disk (the deployed app directory is read-only).
+    """
+    for path in (passage_path(uri), passage_path(uri, PASSAGE_DOWNLOAD_DIR)):
+        try:
+            return _load_document(uri, path, os.path.getmtime(path))
+        except FileNotFoundError:
+            continue
+    if PASSAGE_GCS_URI and _download_document(uri):
+        path = passage_path(uri, PASSAGE_DOWNLOAD_DIR)
+        return _load_document(uri, path, os.path.getmtime(path))
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def _download_document(uri: str) -> bool:
+    """Copies the passages of a document from GCS into PASSAGE_DOWNLOAD_DIR. Misses are remembered for the life of
+    the worker, so a document that was never extracted costs one GCS request, not one per question."""
+    bucket_name, prefix = PASSAGE_GCS_URI.removeprefix("gs://").partition("/")[::2]
+    blob_name = f"{prefix}/{passage_file_name(uri)}" if prefix else passage_file_name(uri)
+    path = passage_path(uri, PASSAGE_DOWNLOAD_DIR)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(PASSAGE_DOWNLOAD_DIR, exist_ok=True)
+        _storage_client().bucket(bucket_name).blob(blob_name).download_to_filename(tmp_path)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        logger.warning(f"No passages for {uri} in {PASSAGE_GCS_URI}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+@functools.cache
+def _storage_client() -> storage.Client:
+    return storage.Client()
+
+
+@functools.lru_cache(maxsize=256)
+def _load_document(uri: str, path: str, mtime: float) -> DocumentPassages:
+    with open(path, "r", encoding="utf-8") as f:
+        document = json.load(f)
+    passages = [Passage(uri, passage["page"], passage["text"]) for passage in document["passages"]]
+    front_words = " ".join(passage.text for passage in passages if passage.page == 1).split()[:FRONT_MATTER_WORDS]
+    return DocumentPassages(
+        uri=uri,
+        title=document["title"],
+        front_matter=" ".join(front_words),
+        passages=passages,
+        tokens=[tokenize(passage.text) for passage in passages]
+    )
+
+
+def select_passages(question: str, documents: list[DocumentPassages], top_k: int = PASSAGE_TOP_K) -> list[Passage]:
+    """Ranks the passages of the documents against the question with BM25, and returns the best in reading order."""
+    passages = [passage for document in documents for passage in document.passages]
+    if not passages:
+        return []
+    index = BM25Index([tokens for document in documents for tokens in document.tokens])
+    best = sorted(i for i, _ in index.top_k(tokenize(question), top_k))
+    return [passages[i] for i in best]
+
+
+def format_passages(documents: list[DocumentPassages], passages: list[Passage]) -> str:
+    """Lays out the selected passages by document, with the document's front matter (authors, journal, DOI...) for
+    the references and a page label on each passage."""
+    sections = []
+    for document in documents:
+        selected = [passage for passage in passages if passage.uri == document.uri]
+        if not selected:
+            continue
+        lines = [f"[Document {len(sections) + 1}] {document.title} ({document.uri})", f"Front matter: {document.front_matter}"]
+        lines += [f"(p. {passage.page}) {passage.text}" for passage in selected]
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extracts the literature PDFs into cached passages.")
+    parser.add_argument("--index", default=LITERATURE_INDEX_PATH, help="The keyword file listing the documents.")
+    parser.add_argument("--workers", type=int, default=8, help="Documents downloaded and extracted at once.")
+    parser.add_argument("--output", default=BUNDLED_PASSAGE_DIR,
+                        help="The passage directory, deployed with the app or synced to LITERATURE_PASSAGE_GCS_URI.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    failed = extract_corpus(args.index, args.workers, args.output)
+    print(f"Passages cached in {args.output}, {failed} documents failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+import zlib
+
+import numpy as np
+
+from bm25 import tokenize
+
+VECTOR_FEATURE_BITS = int(os.getenv("LITERATURE_VECTOR_FEATURE_BITS", "20"))
+VECTOR_MAX_DF = float(os.getenv("LITERATURE_VECTOR_MAX_DF", "0.5"))
+VECTOR_BUILD_CHUNK = 2000
+NGRAM_SIZE = 4
+
+_ARRAYS = ("vector_features", "vector_offsets", "vector_doc_ids", "vector_weights", "vector_idf")
+
+
+def text_features(text: str, feature_bits: int = VECTOR_FEATURE_BITS) -> dict[int, int]:
+    """Returns the hashed features of a text and their counts: its tokens and the character 4-grams of each token.
+
+    The 4-grams ("<deg", "degr", "egra"... for "degradation") let paraphrases and inflections ("degrader",
+    "PROTACs") match. Features are hashed with CRC32, which is stable across processes, unlike `hash`.
+    """
+    counts = {}
+    for token in tokenize(text):
+        for feature in token_features(token, feature_bits):
+            counts[feature] = counts.get(feature, 0) + 1
+    return counts
+
+
+def token_features(token: str, feature_bits: int = VECTOR_FEATURE_BITS) -> list[int]:
+    mask = (1 << feature_bits) - 1
+    padded = f"<{token}>"
+    grams = [f"w:{token}"] + [padded[i:i + NGRAM_SIZE] for i in range(max(1, len(padded) - NGRAM_SIZE + 1))]
+    return [zlib.crc32(gram.encode("utf-8")) & mask for gram in grams]
+
+
+class VectorIndex:
+    """Cosine similarity search over hashed TF-IDF vectors of the literature documents.
+
+    Document vectors use sublinear term frequencies and smoothed IDF, and are L2-normalized. They are stored by
+    feature (CSC layout: `vector_offsets[i]:vector_offsets[i + 1]` delimits the documents containing feature
+    `vector_features[i]`), so scoring a query only touches the postings of its own features. Features found in
+    more than `max_df` of the documents carry little signal and are dropped, which keeps the postings short.
+    """
+
+    def __init__(self, directory: str, document_count: int, feature_bits: int = VECTOR_FEATURE_BITS):
+        self.document_count = document_count
+        self.feature_bits = feature_bits
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in _ARRAYS}
+        self.features, self.offsets = arrays["vector_features"], arrays["vector_offsets"]
+        self.doc_ids, self.weights, self.idf = arrays["vector_doc_ids"], arrays["vector_weights"], arrays["vector_idf"]
+
+    @staticmethod
+    def build(texts: list[str], directory: str, feature_bits: int = VECTOR_FEATURE_BITS, max_df: float = VECTOR_MAX_DF) -> None:
+        """Computes the TF-IDF vectors of the documents and saves them in `directory`.
+
+        Tokens are hashed once for the whole corpus; documents are then expanded from token counts to feature
+        counts with array operations, a chunk of documents at a time to bound memory.
+        """
+        token_ids, token_counts = {}, []
+        for text in texts:
+            counts = {}
+            for token in tokenize(text):
+                token_id = token_ids.setdefault(token, len(token_ids))
+                counts[token_id] = counts.get(token_id, 0) + 1
+            token_counts.append(counts)
+        token_feature_lists = [token_features(token, feature_bits) for token in token_ids]
+        token_offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+        token_offsets[1:] = np.cumsum([len(features) for features in token_feature_lists])
+        token_feature_ids = np.fromiter((f for features in token_feature_lists for f in features), dtype=np.int64, count=token_offsets[-1])
+
+        doc_parts, feature_parts, count_parts = [], [], []
+        for start in range(0, len(texts), VECTOR_BUILD_CHUNK):
+            chunk = token_counts[start:start + VECTOR_BUILD_CHUNK]
+            docs = np.repeat(np.arange(start, start + len(chunk), dtype=np.int64), [len(counts) for counts in chunk])
+            tokens = np.fromiter((t for counts in chunk for t in counts), dtype=np.int64, count=len(docs))
+            counts = np.fromiter((c for counts in chunk for c in counts.values()), dtype=np.float64, count=len(docs))
+            lengths = token_offsets[tokens + 1] - token_offsets[tokens]
+            positions = np.repeat(token_offsets[tokens] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            keys = (np.repeat(docs, lengths) << feature_bits) | token_feature_ids[positions]
+            keys, inverse = np.unique(keys, return_inverse=True)
+            doc_parts.append(keys >> feature_bits)
+            feature_parts.append(keys & ((1 << feature_bits) - 1))
+            count_parts.append(np.bincount(inverse, weights=np.repeat(counts, lengths)))
+        docs = np.concatenate(doc_parts) if doc_parts else np.zeros(0, dtype=np.int64)
+        features = np.concatenate(feature_parts) if feature_parts else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate(count_parts) if count_parts else np.zeros(0)
+
+        n = len(texts)
+        document_frequencies = np.bincount(features, minlength=1 << feature_bits)
+        idf = (np.log((1 + n) / (1 + document_frequencies)) + 1).astype(np.float32)
+        keep = document_frequencies[features] <= max(1, max_df * n)
+        docs, features, counts = docs[keep], features[keep], counts[keep]
+        weights = (1 + np.log(counts)) * idf[features]
+        norms = np.sqrt(np.bincount(docs, weights=weights ** 2, minlength=n))
+        weights = weights / np.where(norms > 0, norms, 1)[docs]
+
+        order = np.argsort(features, kind="stable")
+        features, docs, weights = features[order], docs[order], weights[order]
+        vector_features, starts = np.unique(features, return_index=True)
+        offsets = np.append(starts, len(features)).astype(np.int64)
+        os.makedirs(directory, exist_ok=True)
+        arrays = (vector_features.astype(np.int32), offsets, docs.astype(np.int32), weights.astype(np.float32), idf)
+        for name, array in zip(_ARRAYS, arrays):
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+
+    def scores(self, query: str) -> np.ndarray:
+        """Returns the cosine similarity of every document with the query, in document order."""
+        scores = np.zeros(self.document_count, dtype=np.float32)
+        counts = text_features(query, self.feature_bits)
+        if not counts:
+            return scores
+        query_features = np.fromiter(counts, dtype=np.int64, count=len(counts))
+        query_weights = (1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))) * self.idf[query_features]
+        query_weights /= np.linalg.norm(query_weights)
+        positions = np.searchsorted(self.features, query_features)
+        for position, feature, weight in zip(positions, query_features, query_weights):
+            if position < len(self.features) and self.features[position] == feature:
+                start, end = self.offsets[position], self.offsets[position + 1]
+                scores[self.doc_ids[start:end]] += weight * self.weights[start:end]
+        return scores
+
+    def top_k(self, query: str, k: int) -> list[tuple[int, float]]:
+        """Returns the (document index, cosine similarity) pairs of the k most similar documents, best first."""
+        scores = self.scores(query)
+        k = min(k, int(np.count_nonzero(scores > 0)))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(i), float(scores[i])) for i in best]
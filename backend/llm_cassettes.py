@@ -0,0 +1,241 @@
+"""Record/replay of the model calls, for fast, offline and reproducible runs of the agents.
+
+With LLM_CASSETTE_MODE set, every `generate_content` call of the models returned by `llm_client.get_model` goes
+through a `CassetteModel`, which stores and replays responses by a hash of the whole request (model, contents,
+tools, tool config, generation config). The agents run with temperature 0 and top_k 1, so a recorded response
+stands for any later call with the same request.
+    - "record": calls Vertex AI and stores every response, overwriting older recordings.
+    - "replay": serves recorded responses only; a request that was never recorded raises `CassetteMiss`.
+    - "auto": serves recorded responses, and calls Vertex AI and records the others.
+
+Recordings are JSON files under LLM_CASSETTE_DIR, one per request, holding the response (text, function calls,
+usage metadata) or, for streamed calls, every chunk with its time offset. A streamed recording replays as one
+response for non-streamed calls and the other way round. Replayed calls wait LLM_REPLAY_LATENCY: "0" (default),
+a number of seconds, or "recorded" for the recorded latency times LLM_REPLAY_LATENCY_SCALE, chunk by chunk.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Iterator
+
+import proto
+from vertexai.preview.generative_models import GenerationResponse
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off")
+CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "cassettes")
+REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0")
+REPLAY_LATENCY_SCALE = float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "1.0"))
+
+MODES = ("off", "record", "replay", "auto")
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+class Cassette:
+    """The recorded responses of a directory, keyed by request hash, see `request_key`."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "recorded": 0}
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def load(self, key: str) -> dict | None:
+        try:
+            with open(self.path(key), "r", encoding="utf-8") as f:
+                recording = json.load(f)
+        except FileNotFoundError:
+            recording = None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable recording {self.path(key)}: {e}")
+            recording = None
+        self._count("hits" if recording else "misses")
+        return recording
+
+    def save(self, key: str, model_name: str, request: dict, chunks: list[dict], offsets: list[float]) -> None:
+        """Writes a recording atomically, so concurrent workers never read half a file."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        recording = {"model": model_name, "recorded_at": time.time(), "request": request, "chunks": chunks, "offsets": offsets}
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(recording, f, indent=1)
+        os.replace(tmp_path, path)
+        self._count("recorded")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"mode": CASSETTE_MODE, "directory": self.directory, **self._counters}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+
+class CassetteModel:
+    """Stands in for a `GenerativeModel`, recording or replaying its `generate_content` calls.
+
+    The real model is only created on the first call that needs it, so replay runs need no credentials.
+    """
+
+    def __init__(self, model_name: str, create_model: Callable[[], Any], cassette: Cassette, mode: str):
+        if mode not in MODES[1:]:
+            raise ValueError(f"Invalid cassette mode {mode}, expected one of {MODES[1:]}")
+        self.model_name = model_name
+        self.cassette = cassette
+        self.mode = mode
+        self._create_model = create_model
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    def generate_content(self, contents, stream: bool = False, **kwargs) -> Any:
+        request = canonical_request(self.model_name, contents, kwargs)
+        key = request_key(request)
+        recording = self._lookup(key)
+        if recording is not None:
+            return _replay_stream(recording) if stream else _replay(recording)
+        if not stream:
+            start = time.perf_counter()
+            response = self._get_model().generate_content(contents=contents, **kwargs)
+            self.cassette.save(key, self.model_name, request, [response.to_dict()], [time.perf_counter() - start])
+            return response
+        return self._record_stream(key, request, self._get_model().generate_content(contents=contents, stream=True, **kwargs))
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs) -> Any:
+        request = canonical_request(self.model_name, contents, kwargs)
+        key = request_key(request)
+        recording = self._lookup(key)
+        if recording is not None:
+            return _replay_stream_async(recording) if stream else await _replay_async(recording)
+        if not stream:
+            start = time.perf_counter()
+            response = await self._get_model().generate_content_async(contents=contents, **kwargs)
+            self.cassette.save(key, self.model_name, request, [response.to_dict()], [time.perf_counter() - start])
+            return response
+        chunks = await self._get_model().generate_content_async(contents=contents, stream=True, **kwargs)
+        return self._record_stream_async(key, request, chunks)
+
+    def _lookup(self, key: str) -> dict | None:
+        if self.mode == "record":
+            return None
+        recording = self.cassette.load(key)
+        if recording is None and self.mode == "replay":
+            raise CassetteMiss(f"No recording of this {self.model_name} request in {self.cassette.directory} (key {key})")
+        return recording
+
+    def _get_model(self) -> Any:
+        with self._model_lock:
+            if self._model is None:
+                self._model = self._create_model()
+            return self._model
+
+    def _record_stream(self, key: str, request: dict, responses: Iterator[Any]) -> Iterator[Any]:
+        # Only complete streams are saved: a stream abandoned by its consumer would replay truncated.
+        start, chunks, offsets = time.perf_counter(), [], []
+        for chunk in responses:
+            chunks.append(chunk.to_dict())
+            offsets.append(time.perf_counter() - start)
+            yield chunk
+        self.cassette.save(key, self.model_name, request, chunks, offsets)
+
+    async def _record_stream_async(self, key: str, request: dict, responses: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        start, chunks, offsets = time.perf_counter(), [], []
+        async for chunk in responses:
+            chunks.append(chunk.to_dict())
+            offsets.append(time.perf_counter() - start)
+            yield chunk
+        await asyncio.to_thread(self.cassette.save, key, self.model_name, request, chunks, offsets)
+
+
+def canonical_request(model_name: str, contents: list, kwargs: dict) -> dict:
+    """Returns the request as plain JSON values, in a stable form: the model, the contents and every keyword
+    argument of the call (tools, tool_config, generation_config...), streaming excluded."""
+    return {"model": model_name, "contents": _canonical(contents), **{name: _canonical(value) for name, value in sorted(kwargs.items())}}
+
+
+def request_key(request: dict) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def replay_delays(recording: dict) -> list[float]:
+    """Returns the seconds to wait before each chunk of a replayed recording, see LLM_REPLAY_LATENCY."""
+    count = len(recording["chunks"])
+    if REPLAY_LATENCY == "recorded":
+        offsets = [0.0] + [offset * REPLAY_LATENCY_SCALE for offset in recording.get("offsets", [])]
+        return [max(0.0, offsets[i + 1] - offsets[i]) if i + 1 < len(offsets) else 0.0 for i in range(count)]
+    return [float(REPLAY_LATENCY)] + [0.0] * (count - 1)
+
+
+def merge_chunks(chunks: list[dict]) -> dict:
+    """Merges the chunks of a streamed recording into one response: the text of the first parts is concatenated, the
+    rest (finish reason, usage metadata) comes from the last chunk."""
+    merged = copy.deepcopy(chunks[-1])
+    if len(chunks) > 1 and merged.get("candidates"):
+        text = "".join(_first_part(chunk).get("text", "") for chunk in chunks)
+        merged["candidates"][0].setdefault("content", {})["parts"] = [{"text": text}]
+    return merged
+
+
+def stats() -> dict:
+    """Returns the hits, misses and recordings of this process, or only the mode when recording is off."""
+    return cassette.stats() if CASSETTE_MODE != "off" else {"mode": CASSETTE_MODE}
+
+
+def _replay(recording: dict) -> Any:
+    time.sleep(sum(replay_delays(recording)))
+    return GenerationResponse.from_dict(merge_chunks(recording["chunks"]))
+
+
+async def _replay_async(recording: dict) -> Any:
+    await asyncio.sleep(sum(replay_delays(recording)))
+    return GenerationResponse.from_dict(merge_chunks(recording["chunks"]))
+
+
+def _replay_stream(recording: dict) -> Iterator[Any]:
+    for chunk, delay in zip(recording["chunks"], replay_delays(recording)):
+        time.sleep(delay)
+        yield GenerationResponse.from_dict(chunk)
+
+
+async def _replay_stream_async(recording: dict) -> AsyncIterator[Any]:
+    for chunk, delay in zip(recording["chunks"], replay_delays(recording)):
+        await asyncio.sleep(delay)
+        yield GenerationResponse.from_dict(chunk)
+
+
+def _first_part(chunk: dict) -> dict:
+    candidates = chunk.get("candidates") or [{}]
+    parts = candidates[0].get("content", {}).get("parts") or [{}]
+    return parts[0]
+
+
+def _canonical(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, dict):
+        return {str(name): _canonical(item) for name, item in sorted(value.items())}
+    if hasattr(value, "to_dict"):
+        return _canonical(value.to_dict())
+    if isinstance(value, proto.Message):
+        return _canonical(type(value).to_dict(value))
+    # SDK wrappers without to_dict (ToolConfig) hold their proto message in a private attribute.
+    for name, attribute in vars(value).items():
+        if isinstance(attribute, proto.Message):
+            return {"type": type(value).__name__, name.lstrip("_"): _canonical(type(attribute).to_dict(attribute))}
+    return repr(value)
+
+
+cassette = Cassette(CASSETTE_DIR)
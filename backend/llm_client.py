@@ -0,0 +1,258 @@
+import asyncio
+import functools
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Any, AsyncIterator, Iterator
+
+from google.api_core import exceptions as api_exceptions
+from vertexai.preview.generative_models import GenerativeModel, GenerationConfig
+
+import llm_cassettes
+import usage
+from metrics import LLM_CALL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PRO_MODEL = "gemini-2.0-pro-exp-02-05"
+FLASH_MODEL = "gemini-2.0-flash-001"
+
+MAX_CONCURRENT_CALLS = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+MAX_CONCURRENT_ASYNC_CALLS = int(os.getenv("LLM_MAX_ASYNC_CONCURRENCY", "64"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1.0"))
+BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20.0"))
+WARM_UP = os.getenv("LLM_WARM_UP", "1") == "1"
+
+DETERMINISTIC_CONFIG = GenerationConfig(temperature=0, top_k=1, top_p=1)
+
+RETRYABLE_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServerError,
+)
+
+_call_slots = threading.BoundedSemaphore(MAX_CONCURRENT_CALLS)
+_async_call_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+_stats_lock = threading.Lock()
+_latency_stats: dict[str, dict[str, float]] = {}
+
+
+@functools.cache
+def get_model(model_name: str) -> GenerativeModel:
+    """Returns the long-lived model instance for a model name, creating it on first use.
+
+    Args:
+        model_name (str): The Vertex AI model name, e.g. "gemini-2.0-flash-001".
+
+    With LLM_CASSETTE_MODE set, the model records or replays its calls, see `llm_cassettes`.
+
+    Returns:
+        GenerativeModel: The model instance shared by every agent in this process.
+    """
+    if llm_cassettes.CASSETTE_MODE != "off":
+        return llm_cassettes.CassetteModel(
+            model_name, lambda: GenerativeModel(model_name=model_name), llm_cassettes.cassette, llm_cassettes.CASSETTE_MODE
+        )
+    return GenerativeModel(model_name=model_name)
+
+
+def warm_up(model_names: tuple[str, ...] = (PRO_MODEL, FLASH_MODEL)) -> None:
+    """Creates the model instances and makes one `count_tokens` call per model ahead of the first request.
+
+    The call fetches the credentials and opens the connection to Vertex AI without generating anything, so the
+    first question does not pay for them. Failures are only logged. LLM_WARM_UP=0 skips the calls, and they are
+    skipped when the models record or replay (see `llm_cassettes`).
+
+    Args:
+        model_names (tuple[str, ...]): The models to warm up.
+    """
+    for model_name in model_names:
+        model = get_model(model_name)
+        if not WARM_UP or llm_cassettes.CASSETTE_MODE != "off":
+            continue
+        start = time.perf_counter()
+        try:
+            model.count_tokens("warm-up")
+        except Exception as e:
+            logger.warning(f"Warm-up call to {model_name} failed: {e}")
+            continue
+        logger.info(f"Warmed up {model_name} in {time.perf_counter() - start:.2f}s")
+
+
+def generate_content(model_name: str, contents: list, agent: str | None = None, sections: dict[str, str] | None = None, **kwargs) -> Any:
+    """Calls `generate_content` on the shared model, within the process concurrency limit and with retries.
+
+    Rate limit (429) and server (5xx) errors are retried with exponential backoff and full jitter. The concurrency
+    slot is only held during each attempt, so a call waiting for its retry does not block the others.
+
+    Args:
+        model_name (str): The Vertex AI model name.
+        contents (list): The contents of the request.
+        agent (str | None): The agent making the call, for token accounting (see `usage`).
+        sections (dict[str, str] | None): The named sections the prompt was built from, see `usage.join_sections`.
+        **kwargs: Passed through to `GenerativeModel.generate_content` (tools, tool_config, generation_config...).
+
+    Returns:
+        GenerationResponse: The response of the model.
+    """
+    model = get_model(model_name)
+    for attempt in range(MAX_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            with _call_slots:
+                response = model.generate_content(contents=contents, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            _record_latency(model_name, time.perf_counter() - start, failed=True)
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(model_name, attempt, e))
+            continue
+        seconds = time.perf_counter() - start
+        _record_latency(model_name, seconds)
+        usage.record(agent, model_name, response, seconds, usage.prompt_sizes(contents, sections))
+        return response
+
+
+def stream_content(model_name: str, contents: list, agent: str | None = None, sections: dict[str, str] | None = None, **kwargs) -> Iterator[Any]:
+    """Streams `generate_content` chunks from the shared model, within the process concurrency limit.
+
+    Only failures before the first chunk are retried, since a partially consumed stream cannot be replayed.
+
+    Args:
+        model_name (str): The Vertex AI model name.
+        contents (list): The contents of the request.
+        agent (str | None): The agent making the call, see `generate_content`.
+        sections (dict[str, str] | None): The named sections of the prompt, see `generate_content`.
+        **kwargs: Passed through to `GenerativeModel.generate_content`.
+
+    Yields:
+        GenerationResponse: The response chunks, as the model produces them.
+    """
+    model = get_model(model_name)
+    for attempt in range(MAX_RETRIES + 1):
+        start = time.perf_counter()
+        received = None
+        try:
+            with _call_slots:
+                for chunk in model.generate_content(contents=contents, stream=True, **kwargs):
+                    received = chunk
+                    yield chunk
+        except RETRYABLE_ERRORS as e:
+            _record_latency(model_name, time.perf_counter() - start, failed=True)
+            if received is not None or attempt == MAX_RETRIES:
+                raise
+            time.sleep(_retry_delay(model_name, attempt, e))
+            continue
+        seconds = time.perf_counter() - start
+        _record_latency(model_name, seconds)
+        usage.record(agent, model_name, received, seconds, usage.prompt_sizes(contents, sections))
+        return
+
+
+async def generate_content_async(model_name: str, contents: list, agent: str | None = None, sections: dict[str, str] | None = None,
+                                 **kwargs) -> Any:
+    """Awaits `generate_content_async` on the shared model, like `generate_content`.
+
+    Calls are limited to `LLM_MAX_ASYNC_CONCURRENCY` in flight per event loop. Since a waiting call holds no
+    thread, the limit can be much higher than for blocking calls.
+
+    Args:
+        model_name (str): The Vertex AI model name.
+        contents (list): The contents of the request.
+        agent (str | None): The agent making the call, see `generate_content`.
+        sections (dict[str, str] | None): The named sections of the prompt, see `generate_content`.
+        **kwargs: Passed through to `GenerativeModel.generate_content_async`.
+
+    Returns:
+        GenerationResponse: The response of the model.
+    """
+    model = get_model(model_name)
+    for attempt in range(MAX_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            async with _async_slots():
+                response = await model.generate_content_async(contents=contents, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            _record_latency(model_name, time.perf_counter() - start, failed=True)
+            if attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(_retry_delay(model_name, attempt, e))
+            continue
+        seconds = time.perf_counter() - start
+        _record_latency(model_name, seconds)
+        usage.record(agent, model_name, response, seconds, usage.prompt_sizes(contents, sections))
+        return response
+
+
+async def stream_content_async(model_name: str, contents: list, agent: str | None = None, sections: dict[str, str] | None = None,
+                               **kwargs) -> AsyncIterator[Any]:
+    """Streams response chunks from the shared model without blocking the event loop, like `stream_content`.
+
+    Args:
+        model_name (str): The Vertex AI model name.
+        contents (list): The contents of the request.
+        agent (str | None): The agent making the call, see `generate_content`.
+        sections (dict[str, str] | None): The named sections of the prompt, see `generate_content`.
+        **kwargs: Passed through to `GenerativeModel.generate_content_async`.
+
+    Yields:
+        GenerationResponse: The response chunks, as the model produces them.
+    """
+    model = get_model(model_name)
+    for attempt in range(MAX_RETRIES + 1):
+        start = time.perf_counter()
+        received = None
+        try:
+            async with _async_slots():
+                async for chunk in await model.generate_content_async(contents=contents, stream=True, **kwargs):
+                    received = chunk
+                    yield chunk
+        except RETRYABLE_ERRORS as e:
+            _record_latency(model_name, time.perf_counter() - start, failed=True)
+            if received is not None or attempt == MAX_RETRIES:
+                raise
+            await asyncio.sleep(_retry_delay(model_name, attempt, e))
+            continue
+        seconds = time.perf_counter() - start
+        _record_latency(model_name, seconds)
+        usage.record(agent, model_name, received, seconds, usage.prompt_sizes(contents, sections))
+        return
+
+
+def _async_slots() -> asyncio.Semaphore:
+    # Semaphores are bound to the loop they are first used in, so each loop gets its own.
+    loop = asyncio.get_running_loop()
+    slots = _async_call_slots.get(loop)
+    if slots is None:
+        slots = _async_call_slots[loop] = asyncio.Semaphore(MAX_CONCURRENT_ASYNC_CALLS)
+    return slots
+
+
+def get_latency_stats() -> dict[str, dict[str, float]]:
+    """Returns the per-model call statistics of this process.
+
+    Returns:
+        dict: For every model name, the number of calls, failed calls, and total/max latency in seconds.
+    """
+    with _stats_lock:
+        return {model_name: dict(stats) for model_name, stats in _latency_stats.items()}
+
+
+def _retry_delay(model_name: str, attempt: int, error: Exception) -> float:
+    delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+    logger.warning(f"{model_name} call failed ({error}), retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s")
+    return delay
+
+
+def _record_latency(model_name: str, seconds: float, failed: bool = False) -> None:
+    LLM_CALL_SECONDS.labels(model_name, "error" if failed else "ok").observe(seconds)
+    with _stats_lock:
+        stats = _latency_stats.setdefault(model_name, {"calls": 0, "failed": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["calls"] += 1
+        stats["failed"] += int(failed)
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
@@ -0,0 +1,80 @@
+"""Prometheus metrics of the query pipeline, the agents, the model calls and the database.
+
+Under gunicorn, each worker is a separate process with its own counters. When PROMETHEUS_MULTIPROC_DIR is set
+(gunicorn.conf.py sets it), every process writes its samples to files in that directory and `render` aggregates
+them, so /metrics reports the same totals whichever worker serves the scrape.
+"""
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, float("inf"))
+ROUND_BUCKETS = (1, 2, 3, 4, 5, float("inf"))
+ROW_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 1000, 10000, 100000, 1000000, float("inf"))
+
+STAGE_SECONDS = Histogram(
+    "typetwo_stage_seconds",
+    "Seconds spent per pipeline stage (cache, orchestrator, db_agent, writer, checker, reporter, total).",
+    ["stage"],
+    buckets=SECONDS_BUCKETS
+)
+LLM_CALL_SECONDS = Histogram(
+    "typetwo_llm_call_seconds",
+    "Seconds per model call attempt, retries included as separate attempts.",
+    ["model", "outcome"],
+    buckets=SECONDS_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram(
+    "typetwo_db_query_seconds",
+    "Seconds per SQL query, from connection checkout to the last row (interactive) or to the first batch (export).",
+    ["kind", "outcome"],
+    buckets=SECONDS_BUCKETS
+)
+DB_AGENT_ROUNDS = Histogram(
+    "typetwo_db_agent_rounds",
+    "Writer/Checker rounds per answered question (0 for question cache hits).",
+    buckets=(0,) + ROUND_BUCKETS
+)
+QUERY_ROWS = Histogram("typetwo_query_rows", "Result rows shown per answered question.", buckets=ROW_BUCKETS)
+TRAFFIC_LIGHTS = Counter("typetwo_traffic_lights_total", "Checker verdicts per round.", ["color"])
+PIPELINE_OUTCOMES = Counter(
+    "typetwo_pipeline_outcomes_total",
+    "Answered questions by outcome: green, red (out of rounds), cache_hit or other (no verdict).",
+    ["outcome"]
+)
+LLM_TOKENS = Counter("typetwo_llm_tokens_total", "Tokens per agent, model and kind (prompt or output).", ["agent", "model", "kind"])
+ABORTED_QUERIES = Counter(
+    "typetwo_db_aborted_queries_total",
+    "Queries stopped by MAX_EXECUTION_TIME or KILL QUERY, see query_control.",
+    ["reason"]
+)
+DB_CANCEL_EVENTS = Counter(
+    "typetwo_db_cancel_events_total",
+    "KILL QUERY statements sent (killed) or failed (kill_failures), and exports abandoned by their client.",
+    ["event"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "typetwo_http_request_seconds",
+    "Seconds per HTTP request, until the response (streamed bodies excluded).",
+    ["endpoint", "method", "status"],
+    buckets=SECONDS_BUCKETS
+)
+
+
+def observe_pipeline(timings: dict, rounds: int, rows: int, outcome: str) -> None:
+    """Records a finished question: its stage timings, Writer/Checker rounds, result rows and outcome."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+    DB_AGENT_ROUNDS.observe(rounds)
+    QUERY_ROWS.observe(rows)
+    PIPELINE_OUTCOMES.labels(outcome).inc()
+
+
+def render() -> tuple[bytes, str]:
+    """Returns the metrics of every worker in the Prometheus text format, and its content type."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,7 +1,9 @@
-from vertexai.preview.generative_models import GenerativeModel, Content, Part, GenerationConfig
+from vertexai.preview.generative_models import Content, Part
+from llm_client import generate_content, generate_content_async, PRO_MODEL, DETERMINISTIC_CONFIG
 from task_description import ORCHESTRATOR_INSTRUCTION
-from database_schema import DATABASE_SCHEMA
+from schema_index import select_schema, SCHEMA_ORCHESTRATOR_TOP_K
 from typing import Any
+from usage import join_sections
 
 def generate_instructions_with_orchestrator(user_question: str) -> tuple[Any, str]:
     """Generates text instructions for other agents using the Orchestrator agent.
@@ -15,13 +17,50 @@ def generate_instructions_with_orchestrator(user_question: str) -> tuple[Any, st
     References:
         https://cloud.google.com/vertex-ai/generative-ai/docs/model-reference/inference#non-stream-multi-modality
     """
-    prompt: str = f"User question:\n{user_question}\n\n{ORCHESTRATOR_INSTRUCTION}\n\n{DATABASE_SCHEMA}"
-    model = GenerativeModel(model_name="gemini-2.0-pro-exp-02-05")
-    response = model.generate_content(
+    sections: dict[str, str] = build_orchestrator_prompt_sections(user_question)
+    prompt: str = join_sections(sections)
+    response = generate_content(
+        PRO_MODEL,
         contents=[
             Content(role="user", parts=[Part.from_text(prompt)])
         ],
-        generation_config=GenerationConfig(temperature=0, top_k=1, top_p=1)
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="orchestrator",
+        sections=sections
     )
     text_response: str = response.candidates[0].content.parts[0].text
-    return response, text_response
\ No newline at end of file
+    return response, text_response
+
+
+async def generate_instructions_with_orchestrator_async(user_question: str) -> tuple[Any, str]:
+    """Generates text instructions for other agents like `generate_instructions_with_orchestrator`, without blocking the event loop.
+
+    Args:
+        user_question (str): The question provided by the user.
+
+    Returns:
+        tuple[GenerateContentResponse, str]: The full response object and the extracted text response.
+    """
+    sections: dict[str, str] = build_orchestrator_prompt_sections(user_question)
+    prompt: str = join_sections(sections)
+    response = await generate_content_async(
+        PRO_MODEL,
+        contents=[
+            Content(role="user", parts=[Part.from_text(prompt)])
+        ],
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="orchestrator",
+        sections=sections
+    )
+    text_response: str = response.candidates[0].content.parts[0].text
+    return response, text_response
+
+
+def build_orchestrator_prompt(user_question: str) -> str:
+    return join_sections(build_orchestrator_prompt_sections(user_question))
+
+
+def build_orchestrator_prompt_sections(user_question: str) -> dict[str, str]:
+    """Returns the named sections of the Orchestrator prompt, in prompt order (see `usage`)."""
+    schema: str = select_schema(user_question, SCHEMA_ORCHESTRATOR_TOP_K)
+    return {"question": f"User question:\n{user_question}", "instruction": ORCHESTRATOR_INSTRUCTION, "schema": schema}
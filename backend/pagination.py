@@ -0,0 +1,326 @@
+import base64
+import functools
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Any
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from snapshots import SNAPSHOT_WAIT_SECONDS, find_snapshot
+from utils import execute_query, iter_query_batches, remove_limit_clause
+
+PAGINATION_DEFAULT_LIMIT = int(os.getenv("PAGINATION_DEFAULT_LIMIT", "100"))
+PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT", "1000"))
+PAGINATION_MAX_SQL_OFFSET = int(os.getenv("PAGINATION_MAX_SQL_OFFSET", "10000"))
+PAGINATION_VIEW_CACHE_BYTES = int(os.getenv("PAGINATION_VIEW_CACHE_BYTES", str(256 * 1024 * 1024)))
+PAGINATION_SNAPSHOT_WAIT_SECONDS = float(os.getenv("PAGINATION_SNAPSHOT_WAIT_SECONDS", str(min(5.0, SNAPSHOT_WAIT_SECONDS))))
+
+FILTER_OPERATORS = {
+    "eq": ("=", pc.equal),
+    "ne": ("<>", pc.not_equal),
+    "lt": ("<", pc.less),
+    "lte": ("<=", pc.less_equal),
+    "gt": (">", pc.greater),
+    "gte": (">=", pc.greater_equal),
+}
+FILTER_OPERATORS_WITHOUT_VALUE = ("isnull", "notnull")
+
+
+class PaginationError(ValueError):
+    """Raised for invalid paging parameters: unknown columns or operators, a bad cursor, an out-of-range limit..."""
+
+
+@dataclass(frozen=True)
+class PageRequest:
+    limit: int = PAGINATION_DEFAULT_LIMIT
+    offset: int = 0
+    cursor: str | None = None
+    sort: str | None = None
+    descending: bool = False
+    filters: tuple[tuple[str, str, Any], ...] = ()
+
+    @property
+    def signature(self) -> str:
+        """Identifies the ordering and filtering, so a cursor cannot be replayed against another view."""
+        return hashlib.sha256(json.dumps([self.sort, self.descending, self.filters], default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def parse_page_request(params: dict) -> PageRequest:
+    """Builds a page request from query-string arguments or a JSON body.
+
+    Recognized parameters are `limit`, `offset`, `cursor`, `sort`, `order` ("asc" or "desc") and filters, given
+    either as `filter.<column>[.<operator>]=<value>` arguments or as a `filters` list of
+    {"column", "op", "value"} objects. Operators are eq (the default), ne, lt, lte, gt, gte, contains (case-
+    insensitive substring), isnull and notnull.
+
+    Args:
+        params (dict): The request arguments.
+
+    Returns:
+        PageRequest: The validated request. Column names are checked later, against the actual results.
+    """
+    try:
+        limit = int(params.get("limit", PAGINATION_DEFAULT_LIMIT))
+        offset = int(params.get("offset", 0))
+    except (TypeError, ValueError):
+        raise PaginationError("limit and offset must be integers")
+    if not 1 <= limit <= PAGINATION_MAX_LIMIT:
+        raise PaginationError(f"limit must be between 1 and {PAGINATION_MAX_LIMIT}")
+    if offset < 0:
+        raise PaginationError("offset must not be negative")
+    order = str(params.get("order", "asc")).lower()
+    if order not in ("asc", "desc"):
+        raise PaginationError("order must be asc or desc")
+
+    filters = []
+    for key, value in params.items():
+        if key.startswith("filter."):
+            column, _, op = key[len("filter."):].partition(".")
+            filters.append((column, op or "eq", value))
+    for item in params.get("filters") or []:
+        filters.append((item.get("column"), item.get("op", "eq"), item.get("value")))
+    for column, op, value in filters:
+        if not column or op not in (*FILTER_OPERATORS, "contains", *FILTER_OPERATORS_WITHOUT_VALUE):
+            raise PaginationError(f"Invalid filter {column!r} {op!r}")
+        if op not in FILTER_OPERATORS_WITHOUT_VALUE and value is None:
+            raise PaginationError(f"Filter {column!r} {op!r} needs a value")
+
+    return PageRequest(
+        limit=limit,
+        offset=offset,
+        cursor=params.get("cursor") or None,
+        sort=params.get("sort") or None,
+        descending=order == "desc",
+        filters=tuple(sorted(filters, key=lambda item: (item[0], item[1], str(item[2]))))
+    )
+
+
+def fetch_page(request: dict, page: PageRequest) -> dict:
+    """Returns one page of the full results of a request, sorted and filtered on the server.
+
+    Pages come from the request's snapshot, where the sorted and filtered view is cached in memory and any offset
+    is cheap. The first page of a listing schedules the snapshot if needed and waits up to
+    PAGINATION_SNAPSHOT_WAIT_SECONDS for it, which covers most results.
+
+    Results that take longer to snapshot (or cannot be snapshotted) are paged on the database until the listing
+    ends: the stored SQL is wrapped in a subquery and paged with keyset pagination, the cursor holding the
+    ordering key of the last row, so MySQL never skips over rows with a large OFFSET. Rows are ordered by the sort
+    column, then by every other column to make the order total; exact duplicate rows that straddle a page boundary
+    are returned once. Since that order has no index, MySQL sorts the whole result for every such page: the
+    database path is a fallback, not the way listings are meant to be served. Keys are kept exact (DECIMAL values
+    included), and database pages go through `execute_query`, so repeated pages are served from the result cache.
+
+    Args:
+        request (dict): The request, as returned by `request_store.get`.
+        page (PageRequest): The page to return.
+
+    Returns:
+        dict: columns, rows (a list of dictionaries), nextCursor (None on the last page), total (the number of
+            matching rows, only known for snapshots) and source ("snapshot" or "database").
+    """
+    state = _decode_cursor(page) if page.cursor else {"offset": page.offset}
+    if "after" not in state:
+        snapshot = find_snapshot(request, PAGINATION_SNAPSHOT_WAIT_SECONDS)
+        if snapshot is not None:
+            return _snapshot_page(snapshot, page, state.get("offset", 0))
+    return _database_page(request["sql"], page, state)
+
+
+def _snapshot_page(path: str, page: PageRequest, offset: int) -> dict:
+    view = _snapshot_view(path, os.path.getmtime(path), page.sort, page.descending, page.filters)
+    rows = [_json_row(row) for row in view.slice(offset, page.limit).to_pylist()]
+    end = offset + len(rows)
+    return {
+        "columns": view.schema.names,
+        "rows": rows,
+        "nextCursor": _encode_cursor(page, {"offset": end}) if end < view.num_rows else None,
+        "total": view.num_rows,
+        "source": "snapshot"
+    }
+
+
+_views: OrderedDict[tuple, pa.Table] = OrderedDict()
+_views_lock = threading.Lock()
+
+
+def _snapshot_view(path: str, mtime: float, sort: str | None, descending: bool, filters: tuple) -> pa.Table:
+    key = (path, mtime, sort, descending, filters)
+    with _views_lock:
+        if key in _views:
+            _views.move_to_end(key)
+            return _views[key]
+    if sort is None and not filters:
+        view = pq.read_table(path, memory_map=True)
+    else:
+        view = _snapshot_view(path, mtime, None, False, ())
+        _check_columns(view.schema.names, sort, filters)
+        for column, op, value in filters:
+            view = view.filter(_arrow_condition(view, column, op, value))
+        if sort is not None:
+            indices = pc.sort_indices(
+                view,
+                sort_keys=[(sort, "descending" if descending else "ascending")],
+                null_placement="at_end" if descending else "at_start"  # Same as MySQL
+            )
+            view = view.take(indices)
+    with _views_lock:
+        _views[key] = view
+        while len(_views) > 1 and sum(table.nbytes for table in _views.values()) > PAGINATION_VIEW_CACHE_BYTES:
+            _views.popitem(last=False)
+    return view
+
+
+def _arrow_condition(table: pa.Table, column: str, op: str, value: Any) -> pa.ChunkedArray:
+    values = table[column]
+    if op == "isnull":
+        return pc.is_null(values)
+    if op == "notnull":
+        return pc.is_valid(values)
+    if op == "contains":
+        return pc.match_substring(pc.cast(values, pa.string()), str(value), ignore_case=True)
+    try:
+        scalar = pa.scalar(value).cast(values.type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        raise PaginationError(f"Invalid value {value!r} for column {column!r} of type {values.type}")
+    return FILTER_OPERATORS[op][1](values, scalar)
+
+
+def _database_page(sql_query: str, page: PageRequest, state: dict) -> dict:
+    columns = query_columns(sql_query)
+    if len(set(columns)) != len(columns):
+        raise PaginationError("The results have duplicate column names and can only be paged once snapshotted")
+    _check_columns(columns, page.sort, page.filters)
+    offset = state.get("offset", 0)
+    if offset > PAGINATION_MAX_SQL_OFFSET:
+        raise PaginationError(f"offset is limited to {PAGINATION_MAX_SQL_OFFSET} until the results are snapshotted, use the cursor instead")
+
+    order_columns = ([page.sort] if page.sort else []) + [column for column in columns if column != page.sort]
+    conditions = [_sql_condition(column, op, value) for column, op, value in page.filters]
+    if "after" in state:
+        conditions.append(_keyset_condition(order_columns, state["after"], page.descending))
+    direction = "DESC" if page.descending else "ASC"
+    query = (
+        f"SELECT * FROM ({remove_limit_clause(sql_query)}) AS results"
+        + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+        + f" ORDER BY {', '.join(f'{_quote(column)} {direction}' for column in order_columns)}"
+    )
+    rows = execute_query(query, limit=page.limit + 1, offset=0 if "after" in state else offset, exact_decimals=True)
+    if isinstance(rows, str):
+        raise RuntimeError(rows)
+
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_cursor = _encode_cursor(page, {"after": [_cursor_value(rows[-1][column]) for column in order_columns]})
+    rows = [_json_row(row) for row in rows]
+    return {"columns": columns, "rows": rows, "nextCursor": next_cursor, "total": None, "source": "database"}
+
+
+@functools.lru_cache(maxsize=256)
+def query_columns(sql_query: str) -> list[str]:
+    """Returns the column names of a query's results, without fetching any row."""
+    columns, _ = list(iter_query_batches(sql_query, limit=0))[0]
+    return columns
+
+
+def _keyset_condition(columns: list[str], values: list, descending: bool) -> str:
+    """Builds the condition selecting the rows ordered strictly after `values`, NULL-safe.
+
+    MySQL sorts NULLs first in ascending order and last in descending order, and comparisons with NULL are never
+    true, so the condition is spelled out column by column: (c1 after v1) OR (c1 <=> v1 AND c2 after v2) OR ...
+    """
+    terms = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        if descending:
+            if value is None:
+                continue  # Nothing sorts after NULL
+            after = f"({_quote(column)} < {_sql_literal(value)} OR {_quote(column)} IS NULL)"
+        else:
+            after = f"{_quote(column)} IS NOT NULL" if value is None else f"{_quote(column)} > {_sql_literal(value)}"
+        equal = [f"{_quote(previous)} <=> {_sql_literal(previous_value)}" for previous, previous_value in zip(columns[:i], values[:i])]
+        terms.append(f"({' AND '.join(equal + [after])})")
+    return f"({' OR '.join(terms)})" if terms else "FALSE"
+
+
+def _sql_condition(column: str, op: str, value: Any) -> str:
+    if op == "isnull":
+        return f"{_quote(column)} IS NULL"
+    if op == "notnull":
+        return f"{_quote(column)} IS NOT NULL"
+    if op == "contains":
+        pattern = str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return f"LOWER({_quote(column)}) LIKE LOWER({_sql_literal(f'%{pattern}%')})"
+    return f"{_quote(column)} {FILTER_OPERATORS[op][0]} {_sql_literal(value)}"
+
+
+def _check_columns(columns: list[str], sort: str | None, filters: tuple) -> None:
+    for column in [sort, *(column for column, _, _ in filters)]:
+        if column is not None and column not in columns:
+            raise PaginationError(f"Unknown column {column!r}")
+
+
+def _quote(identifier: str) -> str:
+    return "`" + identifier.replace("`", "``") + "`"
+
+
+def _sql_literal(value: Any) -> str:
+    """Renders a value as an SQL literal. Values are inlined rather than bound, so the whole page query is the
+    result cache key, and the stored SQL does not need its % signs escaped for the driver."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, Decimal):
+        return str(value)  # An exact DECIMAL literal: a quoted one would be compared as a double
+    text = str(value).replace("\\", "\\\\").replace("'", "\\'").replace("\0", "\\0")
+    return f"'{text}'"
+
+
+def _json_row(row: dict) -> dict:
+    """Converts a row of either source to the same JSON types, so a page does not change shape depending on whether
+    the request has a snapshot: decimals become floats, and dates, times and binary values strings."""
+    return {column: _json_value(value) for column, value in row.items()}
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time, timedelta, bytes, bytearray)):
+        return value.decode("utf-8", errors="replace") if isinstance(value, (bytes, bytearray)) else str(value)
+    return value
+
+
+def _cursor_value(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return {"decimal": str(value)}
+    return _json_value(value)
+
+
+def _encode_cursor(page: PageRequest, state: dict) -> str:
+    payload = json.dumps({**state, "view": page.signature}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(page: PageRequest) -> dict:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(page.cursor + "=" * (-len(page.cursor) % 4)))
+    except ValueError:
+        raise PaginationError("Invalid cursor")
+    if not isinstance(state, dict) or state.pop("view", None) != page.signature:
+        raise PaginationError("The cursor belongs to another sort order or filter")
+    if "after" in state:
+        try:
+            state["after"] = [Decimal(value["decimal"]) if isinstance(value, dict) else value for value in state["after"]]
+        except (KeyError, TypeError, ArithmeticError):
+            raise PaginationError("Invalid cursor")
+    return state
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Iterator
+
+from db_agent import iter_db_agent_loop, iter_db_agent_loop_async
+from metrics import observe_pipeline
+from orch_agent import generate_instructions_with_orchestrator, generate_instructions_with_orchestrator_async
+from question_cache import question_cache, QUESTION_CACHE_ENABLED
+from reporter_agent import (generate_summary_with_reporter, generate_summary_with_reporter_async, stream_summary_with_reporter,
+                            stream_summary_with_reporter_async)
+from request_store import request_store
+from snapshots import SNAPSHOT_EAGER, schedule_snapshot
+import usage
+from utils import execute_query, execute_query_async
+
+logger = logging.getLogger(__name__)
+
+
+class _PipelineRun:
+    """The state and bookkeeping of one pass through the pipeline, shared by `iter_query_pipeline` and
+    `iter_query_pipeline_async`: each variant only makes the blocking or awaited calls, and builds its events and
+    records its timings, metrics and usage here."""
+
+    def __init__(self):
+        self.sql_query, self.query_result, self.writer_input, self.green = None, [], None, False
+        self.traffic_light, self.rounds = None, 0
+        self.tracker = usage.track_request()
+        self.start = time.perf_counter()
+        self.timings = {}
+        self.request_id = None
+        self.finished = False
+
+    def cache_hit(self, cached: dict, query_result: list[dict] | str) -> dict | None:
+        """Takes the result of the cached SQL, and returns the "cache_hit" event, or None if the SQL failed and
+        the entry must be invalidated."""
+        self.query_result = query_result
+        if isinstance(query_result, str):
+            logger.warning(f"Cached SQL for '{cached['question']}' failed, running the agents: {query_result}")
+            return None
+        self.sql_query, self.writer_input, self.green = cached["sql"], cached["writer_input"], True
+        return {"event": "cache_hit", "question": cached["question"], "similarity": cached["similarity"], "sql": self.sql_query}
+
+    def orchestrator_done(self, writer_input: str, stage_start: float) -> dict:
+        self.writer_input = writer_input
+        logger.info(writer_input)
+        self.timings["orchestrator"] = time.perf_counter() - stage_start
+        return {"event": "orchestrator", "instructions": writer_input}
+
+    def db_agent_event(self, event: dict) -> dict | None:
+        """Records an event of the Writer/Checker loop, and returns it unless it is the internal "db_result"."""
+        if event["event"] == "db_result":
+            self.sql_query, self.query_result = event["sql"], event["result"]
+            return None
+        if event["event"] == "traffic_light":
+            self.traffic_light, self.rounds = event["color"], self.rounds + 1
+        return event
+
+    def db_agent_done(self, stage_start: float) -> bool:
+        """Closes the Writer/Checker stage, and returns whether its SQL should be stored in the question cache."""
+        self.timings["db_agent"] = time.perf_counter() - stage_start
+        self.green = self.traffic_light == "green"
+        return QUESTION_CACHE_ENABLED and self.green
+
+    def results(self) -> dict:
+        """Returns the "results" event of the stored request, and schedules its snapshot when enabled."""
+        if self.green and SNAPSHOT_EAGER:
+            schedule_snapshot(self.request_id, self.sql_query)
+        return {"event": "results", "requestId": self.request_id, "sql": self.sql_query,
+                "searchResults": self.query_result if self.query_result else [], "timings": self.timings}
+
+    def finish(self, answer_summary: str, stage_start: float) -> dict:
+        """Records the Reporter and total timings, the pipeline metrics and the usage, and returns the usage."""
+        logger.info(answer_summary)
+        self.timings.update(reporter=time.perf_counter() - stage_start, total=time.perf_counter() - self.start)
+        rows = len(self.query_result) if isinstance(self.query_result, list) else 0
+        observe_pipeline(self.timings, self.rounds, rows, _outcome(self.green, self.traffic_light))
+        self.finished = True
+        return usage.finish_request(self.tracker, self.request_id)
+
+    def close(self) -> None:
+        """Stops tracking the usage of a run that failed or was abandoned before `finish`, so the model calls made
+        later on this thread are not charged to it."""
+        if not self.finished:
+            self.finished = True
+            usage.finish_request(self.tracker, self.request_id)
+
+    def done(self, answer_summary: str, request_usage: dict) -> dict:
+        return {"event": "done", "requestId": self.request_id, "summary": answer_summary, "timings": self.timings, "usage": request_usage}
+
+
+def iter_query_pipeline(user_question: str, stream_summary: bool = True, max_depth: int = 5) -> Iterator[dict]:
+    """Runs the Orchestrator -> Writer/Checker loop -> Reporter pipeline, yielding an event after every stage.
+
+    Events are dictionaries with an "event" key:
+        - "cache_hit": a similar question was answered before, its SQL is reused (question, similarity, sql).
+          The Orchestrator and the Writer/Checker loop are skipped.
+        - "orchestrator": the Orchestrator finished (instructions).
+        - "sql_attempt" / "traffic_light": one Writer/Checker round, see `iter_db_agent_loop`.
+        - "results": the final SQL was accepted (requestId, sql, searchResults, timings). The request is saved in
+          `request_store`, so its results can be downloaded from any worker. When the Checker gave the green light,
+          the full results are materialized in the background, see `snapshots`.
+        - "summary_chunk": a piece of the Reporter summary (text). Only emitted when `stream_summary` is True.
+        - "done": the pipeline finished (requestId, summary, timings, usage). Always the last event. Usage is the
+          token and prompt-size accounting of the request's model calls, see `usage`.
+
+    Timings are the seconds spent in each stage ("cache", "orchestrator", "db_agent", "reporter", "total").
+
+    Args:
+        user_question (str): The question provided by the user.
+        stream_summary (bool): Whether to stream the Reporter summary chunk by chunk.
+        max_depth (int): The maximum number of Writer/Checker rounds.
+
+    Yields:
+        dict: The pipeline events, in the order they happen.
+    """
+    run = _PipelineRun()
+    try:
+        cached = question_cache.lookup(user_question) if QUESTION_CACHE_ENABLED else None
+        if cached is not None:
+            event = run.cache_hit(cached, execute_query(cached["sql"], limit=100))
+            if event is None:
+                question_cache.invalidate(cached["question"])
+            else:
+                yield event
+        run.timings["cache"] = time.perf_counter() - run.start
+
+        if run.sql_query is None:
+            stage_start = time.perf_counter()
+            orchestrator_response, writer_input = generate_instructions_with_orchestrator(user_question)
+            yield run.orchestrator_done(writer_input, stage_start)
+
+            stage_start = time.perf_counter()
+            for event in iter_db_agent_loop(user_question, run.writer_input, max_depth=max_depth):
+                event = run.db_agent_event(event)
+                if event is not None:
+                    yield event
+            if run.db_agent_done(stage_start):
+                question_cache.put(user_question, run.sql_query, run.writer_input)
+
+        run.request_id = str(uuid.uuid4())
+        request_store.put(run.request_id, run.sql_query, user_question, run.timings)
+        yield run.results()
+
+        stage_start = time.perf_counter()
+        if stream_summary:
+            chunks = []
+            for text in stream_summary_with_reporter(user_question, run.writer_input, run.sql_query, run.query_result):
+                chunks.append(text)
+                yield {"event": "summary_chunk", "text": text}
+            answer_summary = "".join(chunks)
+        else:
+            reporter_response, answer_summary = generate_summary_with_reporter(user_question, run.writer_input, run.sql_query, run.query_result)
+        request_usage = run.finish(answer_summary, stage_start)
+        request_store.update_timings(run.request_id, run.timings)
+        request_store.set_usage(run.request_id, request_usage)
+
+        yield run.done(answer_summary, request_usage)
+    finally:
+        run.close()
+
+
+def run_query_pipeline(user_question: str, max_depth: int = 5) -> dict:
+    """Runs the whole pipeline without streaming and returns the final results.
+
+    Args:
+        user_question (str): The question provided by the user.
+        max_depth (int): The maximum number of Writer/Checker rounds.
+
+    Returns:
+        dict: requestId, sql, summary and searchResults of the answered question.
+    """
+    output = {}
+    for event in iter_query_pipeline(user_question, stream_summary=False, max_depth=max_depth):
+        _collect_output(output, event)
+    return output
+
+
+async def iter_query_pipeline_async(user_question: str, stream_summary: bool = True, max_depth: int = 5) -> AsyncIterator[dict]:
+    """Runs the pipeline like `iter_query_pipeline`, awaiting the agents and the database instead of blocking.
+
+    Many questions can be in flight in one process: a question waiting on the model or on MySQL only holds its
+    coroutine. Local file stores (question cache, request store) are read and written from worker threads, since
+    their locks may be held by another process.
+
+    Args:
+        user_question (str): The question provided by the user.
+        stream_summary (bool): Whether to stream the Reporter summary chunk by chunk.
+        max_depth (int): The maximum number of Writer/Checker rounds.
+
+    Yields:
+        dict: The pipeline events, see `iter_query_pipeline`.
+    """
+    run = _PipelineRun()
+    try:
+        cached = await asyncio.to_thread(question_cache.lookup, user_question) if QUESTION_CACHE_ENABLED else None
+        if cached is not None:
+            event = run.cache_hit(cached, await execute_query_async(cached["sql"], limit=100))
+            if event is None:
+                await asyncio.to_thread(question_cache.invalidate, cached["question"])
+            else:
+                yield event
+        run.timings["cache"] = time.perf_counter() - run.start
+
+        if run.sql_query is None:
+            stage_start = time.perf_counter()
+            orchestrator_response, writer_input = await generate_instructions_with_orchestrator_async(user_question)
+            yield run.orchestrator_done(writer_input, stage_start)
+
+            stage_start = time.perf_counter()
+            async for event in iter_db_agent_loop_async(user_question, run.writer_input, max_depth=max_depth):
+                event = run.db_agent_event(event)
+                if event is not None:
+                    yield event
+            if run.db_agent_done(stage_start):
+                await asyncio.to_thread(question_cache.put, user_question, run.sql_query, run.writer_input)
+
+        run.request_id = str(uuid.uuid4())
+        await asyncio.to_thread(request_store.put, run.request_id, run.sql_query, user_question, run.timings)
+        yield run.results()
+
+        stage_start = time.perf_counter()
+        if stream_summary:
+            chunks = []
+            async for text in stream_summary_with_reporter_async(user_question, run.writer_input, run.sql_query, run.query_result):
+                chunks.append(text)
+                yield {"event": "summary_chunk", "text": text}
+            answer_summary = "".join(chunks)
+        else:
+            reporter_response, answer_summary = await generate_summary_with_reporter_async(user_question, run.writer_input, run.sql_query, run.query_result)
+        request_usage = run.finish(answer_summary, stage_start)
+        await asyncio.to_thread(request_store.update_timings, run.request_id, run.timings)
+        await asyncio.to_thread(request_store.set_usage, run.request_id, request_usage)
+
+        yield run.done(answer_summary, request_usage)
+    finally:
+        run.close()
+
+
+async def run_query_pipeline_async(user_question: str, max_depth: int = 5) -> dict:
+    """Runs the whole pipeline like `run_query_pipeline`, without blocking the event loop."""
+    output = {}
+    async for event in iter_query_pipeline_async(user_question, stream_summary=False, max_depth=max_depth):
+        _collect_output(output, event)
+    return output
+
+
+def _collect_output(output: dict, event: dict) -> None:
+    if event["event"] == "results":
+        output.update(requestId=event["requestId"], sql=event["sql"], searchResults=event["searchResults"])
+    elif event["event"] == "done":
+        output["summary"] = event["summary"]
+
+
+def _outcome(green: bool, traffic_light: str | None) -> str:
+    if green and traffic_light is None:
+        return "cache_hit"
+    return traffic_light if traffic_light in ("green", "red") else "other"
+
+
+def format_sse(event: dict) -> str:
+    """Formats a pipeline event as a Server-Sent Events message.
+
+    Args:
+        event (dict): The pipeline event, its "event" key is used as the SSE event name.
+
+    Returns:
+        str: The SSE message, terminated by a blank line.
+    """
+    payload = {key: value for key, value in event.items() if key != "event"}
+    return f"event: {event['event']}\ndata: {json.dumps(payload, default=str)}\n\n"
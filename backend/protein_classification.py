@@ -0,0 +1,192 @@
+import csv
+import io
+import math
+import os
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from bm25 import tokenize
+from database_schema import TABLES
+
+PROTEIN_CLASS_MAX_ROWS = int(os.getenv("PROTEIN_CLASS_MAX_ROWS", "250"))
+PROTEIN_CLASS_OVERVIEW_LEVEL = int(os.getenv("PROTEIN_CLASS_OVERVIEW_LEVEL", "2"))
+
+CSV_COLUMNS = ("pref_name", "short_name", "protein_class_desc", "definition", "class_level")
+
+
+@dataclass(eq=False)
+class ProteinClass:
+    pref_name: str
+    short_name: str
+    protein_class_desc: str
+    definition: str | None
+    class_level: int
+    parent: "ProteinClass | None" = None
+    children: list["ProteinClass"] = field(default_factory=list)
+
+    @property
+    def labels(self) -> tuple[str, ...]:
+        """The names the class can be referred to by: its preferred name, short name, and the last level of its path."""
+        return (self.pref_name, self.short_name, self.protein_class_desc.split("  ")[-1])
+
+
+def parse_protein_classification(tables: str = TABLES) -> list[ProteinClass]:
+    """Parses the protein_classification CSV dump into a tree.
+
+    The parent of a class is the class whose `protein_class_desc` is the same path without its last level
+    (levels are separated by two spaces); level 1 classes hang from the level 0 root.
+
+    Args:
+        tables (str): The dump, in the format of `TABLES`.
+
+    Returns:
+        list[ProteinClass]: Every class, in depth-first tree order starting with the root.
+    """
+    lines = tables.strip().splitlines()
+    header = next(i for i, line in enumerate(lines) if line.startswith("pref_name,"))
+    classes = []
+    for row in csv.DictReader(io.StringIO("\n".join(lines[header:]))):
+        classes.append(ProteinClass(
+            pref_name=row["pref_name"],
+            short_name=row["short_name"],
+            protein_class_desc=row["protein_class_desc"],
+            definition=None if row["definition"] == "NULL" else row["definition"],
+            class_level=int(row["class_level"])
+        ))
+    by_desc = {protein_class.protein_class_desc: protein_class for protein_class in classes}
+    roots = [protein_class for protein_class in classes if protein_class.class_level == 0]
+    for protein_class in classes:
+        if protein_class.class_level == 0:
+            continue
+        parent_desc = "  ".join(protein_class.protein_class_desc.split("  ")[:-1])
+        protein_class.parent = by_desc.get(parent_desc) or (roots[0] if roots else None)
+        if protein_class.parent is not None:
+            protein_class.parent.children.append(protein_class)
+    return [descendant for root in roots for descendant in expand(root)]
+
+
+def expand(protein_class: ProteinClass, max_depth: int | None = None) -> list[ProteinClass]:
+    """Returns a class and all its descendants, in depth-first order.
+
+    Args:
+        protein_class (ProteinClass): The class to expand.
+        max_depth (int | None): How many levels below the class to include. None includes the whole subtree.
+
+    Returns:
+        list[ProteinClass]: The class followed by its descendants.
+    """
+    subtree, stack = [], [(protein_class, 0)]
+    while stack:
+        node, depth = stack.pop()
+        subtree.append(node)
+        if max_depth is None or depth < max_depth:
+            stack.extend((child, depth + 1) for child in reversed(node.children))
+    return subtree
+
+
+def ancestors(protein_class: ProteinClass) -> list[ProteinClass]:
+    """Returns the ancestors of a class, from the root down to its parent."""
+    path = []
+    node = protein_class.parent
+    while node is not None:
+        path.append(node)
+        node = node.parent
+    return path[::-1]
+
+
+PROTEIN_CLASSES = parse_protein_classification()
+
+_label_tokens: list[list[frozenset[str]]] = [
+    [frozenset(tokenize(label)) for label in protein_class.labels if tokenize(label)] for protein_class in PROTEIN_CLASSES
+]
+_inverted_index: dict[str, set[int]] = defaultdict(set)
+for _i, _protein_class in enumerate(PROTEIN_CLASSES):
+    for _token in tokenize(" ".join([*_protein_class.labels, _protein_class.definition or ""])):
+        _inverted_index[_token].add(_i)
+_idf = {token: math.log(len(PROTEIN_CLASSES) / len(postings)) for token, postings in _inverted_index.items()}
+
+
+def lookup(text: str) -> list[ProteinClass]:
+    """Finds the classes mentioned in a text, most specific first.
+
+    A class is mentioned when every token of one of its labels occurs in the text ("kinases" matches "Kinase",
+    "protein kinases" also matches "Protein Kinase"). Specificity is the summed IDF of the matched label.
+
+    Args:
+        text (str): The text to search, e.g. the user question.
+
+    Returns:
+        list[ProteinClass]: The mentioned classes, most specific first.
+    """
+    tokens = set(tokenize(text))
+    candidates = set().union(*(_inverted_index.get(token, set()) for token in tokens))
+    scored = []
+    for i in candidates:
+        matched = [label for label in _label_tokens[i] if label <= tokens]
+        if matched:
+            scored.append((max(sum(_idf[token] for token in label) for label in matched), i))
+    return [PROTEIN_CLASSES[i] for _, i in sorted(scored, key=lambda item: (-item[0], item[1]))]
+
+
+def search(text: str) -> list[ProteinClass]:
+    """Finds the classes whose names or definitions share any token with a text, for interactive lookups.
+
+    Args:
+        text (str): The search terms.
+
+    Returns:
+        list[ProteinClass]: The matching classes, best match first.
+    """
+    scores = defaultdict(float)
+    for token in set(tokenize(text)):
+        for i in _inverted_index.get(token, ()):
+            scores[i] += _idf[token]
+    return [PROTEIN_CLASSES[i] for i in sorted(scores, key=lambda i: (-scores[i], i))]
+
+
+def select_classification(question: str, context: str = "", max_rows: int = PROTEIN_CLASS_MAX_ROWS) -> str:
+    """Returns the part of the protein classification relevant to a question, as CSV for the Writer prompt.
+
+    Classes mentioned in the question come first, then those only mentioned in the context. Each mentioned class
+    is included with its ancestors and its whole subtree, as long as the row budget allows. When nothing is
+    mentioned, the top levels of the tree are returned instead.
+
+    Args:
+        question (str): The question provided by the user.
+        context (str): Additional text to search, e.g. the Orchestrator instructions.
+        max_rows (int): The maximum number of classes to include. With 0 or less, the whole table is returned.
+
+    Returns:
+        str: The selected rows of the protein_classification table, in the format of `TABLES`.
+    """
+    if max_rows <= 0:
+        return TABLES
+    mentioned = list(dict.fromkeys(lookup(question) + lookup(f"{question}\n{context}")))
+    selected: set[ProteinClass] = set()
+    for protein_class in mentioned:
+        rows = set(ancestors(protein_class) + expand(protein_class)) - selected
+        if len(selected) + len(rows) > max_rows:
+            continue
+        selected |= rows
+    if selected:
+        title = "protein_classification table (classes matching the question, with their ancestors and descendants):"
+        nodes = [protein_class for protein_class in PROTEIN_CLASSES if protein_class in selected]
+    else:
+        title = f"protein_classification table (levels 0 to {PROTEIN_CLASS_OVERVIEW_LEVEL}, no class matched the question):"
+        nodes = [protein_class for protein_class in PROTEIN_CLASSES if protein_class.class_level <= PROTEIN_CLASS_OVERVIEW_LEVEL]
+    return f"{title}\n{to_csv(nodes)}"
+
+
+def to_csv(protein_classes: list[ProteinClass]) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(CSV_COLUMNS)
+    for protein_class in protein_classes:
+        writer.writerow([
+            protein_class.pref_name,
+            protein_class.short_name,
+            protein_class.protein_class_desc,
+            "NULL" if protein_class.definition is None else protein_class.definition,
+            protein_class.class_level
+        ])
+    return output.getvalue()
@@ -0,0 +1,200 @@
+import contextvars
+import logging
+import os
+import select
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from metrics import ABORTED_QUERIES, DB_CANCEL_EVENTS
+
+logger = logging.getLogger(__name__)
+
+ER_QUERY_INTERRUPTED = 1317
+ER_QUERY_TIMEOUT = 3024
+
+DISCONNECT_POLL_SECONDS = float(os.getenv("DB_DISCONNECT_POLL_SECONDS", "1.0"))
+
+_current_token: contextvars.ContextVar["CancelToken | None"] = contextvars.ContextVar("cancel_token", default=None)
+_counters_lock = threading.Lock()
+_counters = {"timeouts": 0, "cancelled": 0, "killed": 0, "kill_failures": 0, "abandoned_streams": 0}
+
+
+class CancelToken:
+    """Signals that the work of a request is no longer wanted, e.g. because the client disconnected.
+
+    Running statements register a callback that kills them; a token created with a parent is cancelled along
+    with it.
+    """
+
+    def __init__(self, parent: "CancelToken | None" = None):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks: dict[int, Callable[[], None]] = {}
+        self._next_id = 0
+        if parent is not None:
+            parent.add_callback(self.cancel)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Cancellation callback failed")
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Runs `callback` on cancellation, at once if already cancelled. Returns a function removing it."""
+        with self._lock:
+            if not self._cancelled:
+                callback_id = self._next_id
+                self._next_id += 1
+                self._callbacks[callback_id] = callback
+                return lambda: self._callbacks.pop(callback_id, None)
+        callback()
+        return lambda: None
+
+
+def current_token() -> CancelToken | None:
+    return _current_token.get()
+
+
+@contextmanager
+def cancel_scope(token: CancelToken | None = None) -> Iterator[CancelToken]:
+    """Makes a token the current one for the block, so the queries run inside it can be cancelled together.
+
+    Args:
+        token (CancelToken | None): The token to use, a new child of the current token by default.
+    """
+    token = token or CancelToken(parent=current_token())
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+@contextmanager
+def watch_query(connect: Callable[[], Any], conn: Any, token: CancelToken | None) -> Iterator[None]:
+    """Kills the statement running on `conn` with KILL QUERY if `token` is cancelled while the block runs.
+
+    The kill is sent from a background thread over a new connection from `connect`, since the statement's own
+    connection is busy and the canceller may be an event loop, which must not block on it. It is only sent while
+    the block runs: leaving the block waits for a kill in progress, so the connection cannot go back to the pool,
+    and its id to another statement, before the kill is done.
+    """
+    connection_id = getattr(conn, "connection_id", None)
+    if token is None or connection_id is None:
+        yield
+        return
+    guard = threading.Lock()
+    running = True
+
+    def kill():
+        with guard:
+            if running:
+                kill_query(connect, connection_id)
+
+    remove = token.add_callback(lambda: threading.Thread(target=kill, name="kill-query", daemon=True).start())
+    try:
+        yield
+    finally:
+        remove()
+        with guard:
+            running = False
+
+
+@contextmanager
+def cancel_on_disconnect(client_socket: socket.socket | None, token: CancelToken, interval: float = DISCONNECT_POLL_SECONDS) -> Iterator[None]:
+    """Cancels `token` if the client closes its connection while the block runs.
+
+    Synchronous WSGI handlers only notice a disconnected client when they next write to it, so a background thread
+    polls the client socket (gunicorn's environ["gunicorn.socket"]) every `interval` seconds: a socket that is
+    readable but has no data left has been closed by the client.
+
+    Args:
+        client_socket (socket.socket | None): The client socket, or None when the server does not expose it.
+        token (CancelToken): The token of the request's queries, see `cancel_scope`.
+        interval (float): The seconds between two polls.
+    """
+    if client_socket is None:
+        yield
+        return
+    done = threading.Event()
+
+    def poll():
+        while not done.wait(interval):
+            try:
+                readable, _, _ = select.select([client_socket], [], [], 0)
+                if readable and client_socket.recv(1, socket.MSG_PEEK) == b"":
+                    logger.info("Client disconnected, cancelling its queries")
+                    token.cancel()
+                    return
+            except (OSError, ValueError):
+                return
+
+    threading.Thread(target=poll, name="disconnect-watch", daemon=True).start()
+    try:
+        yield
+    finally:
+        done.set()
+
+
+def kill_query(connect: Callable[[], Any], connection_id: int) -> bool:
+    """Stops the statement running on a server connection, leaving the connection itself open.
+
+    Returns:
+        bool: Whether the KILL QUERY statement succeeded.
+    """
+    try:
+        conn = connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"KILL QUERY {int(connection_id)}")
+            cursor.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"Could not kill the query of connection {connection_id}: {e}")
+        count("kill_failures")
+        return False
+    logger.info(f"Killed the query of connection {connection_id}")
+    count("killed")
+    return True
+
+
+def count_error(error: Exception) -> None:
+    """Counts a failed statement that was stopped by its time limit or by a kill."""
+    errno = getattr(error, "errno", None)
+    if errno == ER_QUERY_TIMEOUT:
+        count("timeouts")
+    elif errno == ER_QUERY_INTERRUPTED:
+        count("cancelled")
+
+
+def count(name: str) -> None:
+    """Counts an event of `stats`. Only timeouts and cancelled statements are aborted queries; kills sent or failed
+    and abandoned streams go to a separate metric, so they do not inflate the aborted total."""
+    with _counters_lock:
+        _counters[name] += 1
+    if name in ("timeouts", "cancelled"):
+        ABORTED_QUERIES.labels(name).inc()
+    else:
+        DB_CANCEL_EVENTS.labels(name).inc()
+
+
+def stats() -> dict:
+    """Returns the numbers of statements stopped by MAX_EXECUTION_TIME (timeouts), stopped after a KILL QUERY
+    (cancelled), kills sent and failed, and exports whose client went away before the last row (abandoned_streams)."""
+    with _counters_lock:
+        return dict(_counters)
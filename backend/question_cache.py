@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from utils import CHEMBL_VERSION, CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+QUESTION_CACHE_ENABLED = os.getenv("QUESTION_CACHE", "1") != "0"
+QUESTION_CACHE_PATH = os.getenv("QUESTION_CACHE_PATH", os.path.join(CACHE_DIR, "question_cache.json"))
+QUESTION_CACHE_THRESHOLD = float(os.getenv("QUESTION_CACHE_THRESHOLD", "0.8"))
+QUESTION_CACHE_MAX_ENTRIES = int(os.getenv("QUESTION_CACHE_MAX_ENTRIES", "2000"))
+QUESTION_CACHE_TTL_SECONDS = int(os.getenv("QUESTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+STOP_WORDS = frozenset({
+    "a", "about", "all", "an", "and", "any", "are", "can", "could", "do", "find", "for", "get", "give", "i", "im",
+    "in", "is", "list", "me", "of", "on", "or", "please", "pull", "show", "some", "the", "their", "there", "to",
+    "what", "which", "with", "would", "you"
+})
+
+
+def normalize_question(question: str) -> str:
+    """Normalizes a question so that trivially different phrasings map to the same key.
+
+    Lowercases, folds unicode, drops punctuation and filler words, and joins digits to the preceding
+    word ("CLN 2" and "cln2" both become "cln2"). Contractions keep their negation ("isn't" becomes "is not").
+
+    Args:
+        question (str): The question provided by the user.
+
+    Returns:
+        str: The normalized question.
+    """
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = re.sub(r"n['’]t\b", " not", text)
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    text = re.sub(r"\b([a-z]+) (\d+)\b", r"\1\2", text)
+    return " ".join(token for token in text.split() if token not in STOP_WORDS)
+
+
+def shingles(normalized_question: str) -> frozenset[str]:
+    """Returns the character 3-gram shingles of a normalized question, word boundaries included."""
+    text = f" {normalized_question} "
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def content_token(token: str) -> str:
+    """Folds the plural of a word ("compounds" -> "compound"); tokens with digits are identifiers and kept as is."""
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss") and not any(char.isdigit() for char in token):
+        return token[:-1]
+    return token
+
+
+def must_match_tokens(normalized_question: str) -> frozenset[str]:
+    """Returns the tokens two questions must share for one to reuse the SQL of the other: every word left after
+    normalization, plurals folded. Shingle similarity alone cannot tell apart questions about different entities
+    or with opposite meanings, since one differing word barely changes it:
+
+    >>> cftr = normalize_question("Which compounds were tested as CFTR modulators in cell assays?")
+    >>> gaba = normalize_question("Which compounds were tested as GABA modulators in cell assays?")
+    >>> jaccard(shingles(cftr), shingles(gaba)) > QUESTION_CACHE_THRESHOLD
+    True
+    >>> must_match_tokens(cftr) == must_match_tokens(gaba)
+    False
+    >>> approved = normalize_question("drugs approved for cystic fibrosis")
+    >>> not_approved = normalize_question("drugs not approved for cystic fibrosis")
+    >>> jaccard(shingles(approved), shingles(not_approved)) > QUESTION_CACHE_THRESHOLD
+    True
+    >>> must_match_tokens(approved) == must_match_tokens(not_approved)
+    False
+    >>> must_match_tokens(normalize_question("Show the drug approved for cystic fibrosis")) == must_match_tokens(approved)
+    True
+    """
+    return frozenset(content_token(token) for token in normalized_question.split())
+
+
+def jaccard(a: frozenset[str], b: frozenset[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class QuestionCache:
+    """Maps questions to the last SQL accepted by the Checker, so near-identical questions skip the agents.
+
+    Entries are kept in LRU order, expire after a TTL, and are persisted to a JSON file tagged with the ChEMBL
+    version; a file written for another version is discarded on load. The file is re-read when another worker
+    has updated it, so gunicorn workers share their entries.
+    """
+
+    def __init__(self, path: str, version: str, threshold: float, max_entries: int, ttl_seconds: int):
+        self.path = path
+        self.version = version
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._shingles: dict[str, frozenset[str]] = {}
+        self._loaded_mtime = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self._load()
+
+    def lookup(self, question: str) -> dict | None:
+        """Finds the cached entry for a question, either by normalized key or by shingle similarity.
+
+        Args:
+            question (str): The question provided by the user.
+
+        Returns:
+            dict | None: The entry (question, sql, writer_input, created_at, similarity), or None on a miss.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._load()
+            self._evict_expired()
+            match, similarity = (key, 1.0) if key in self._entries else self._most_similar(key)
+            if match is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(match)
+            return {**self._entries[match], "similarity": similarity}
+
+    def put(self, question: str, sql_query: str, writer_input: str) -> None:
+        """Stores the SQL accepted by the Checker for a question.
+
+        Args:
+            question (str): The question provided by the user.
+            sql_query (str): The SQL query that got the green light.
+            writer_input (str): The Orchestrator instructions, reused by the Reporter on a hit.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._load()
+            self._entries[key] = {"question": question, "sql": sql_query, "writer_input": writer_input, "created_at": time.time()}
+            self._entries.move_to_end(key)
+            self._shingles[key] = shingles(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._shingles.pop(evicted, None)
+            self._save()
+
+    def invalidate(self, question: str | None = None) -> None:
+        """Removes one question from the cache, or every question if none is given."""
+        with self._lock:
+            if question is None:
+                self._entries.clear()
+                self._shingles.clear()
+            else:
+                key = normalize_question(question)
+                self._entries.pop(key, None)
+                self._shingles.pop(key, None)
+            self._save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "version": self.version}
+
+    def _most_similar(self, key: str) -> tuple[str | None, float]:
+        key_shingles = shingles(key)
+        key_tokens = must_match_tokens(key)
+        best, best_similarity = None, 0.0
+        for candidate, candidate_shingles in self._shingles.items():
+            if must_match_tokens(candidate) != key_tokens:
+                continue
+            similarity = jaccard(key_shingles, candidate_shingles)
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+        if best_similarity < self.threshold:
+            return None, best_similarity
+        return best, best_similarity
+
+    def _evict_expired(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for key in [key for key, entry in self._entries.items() if entry["created_at"] < cutoff]:
+            del self._entries[key]
+            self._shingles.pop(key, None)
+
+    def _load(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable question cache {self.path}")
+            return
+        self._loaded_mtime = mtime
+        if data.get("version") != self.version:
+            logger.info(f"Discarding question cache built for {data.get('version')}, current version is {self.version}")
+            return
+        for key, entry in data.get("entries", []):
+            current = self._entries.get(key)
+            if current is None or current["created_at"] < entry["created_at"]:
+                self._entries[key] = entry
+                self._shingles[key] = shingles(key)
+        for key in sorted(self._entries, key=lambda key: self._entries[key]["created_at"])[:-self.max_entries or None]:
+            del self._entries[key]
+            self._shingles.pop(key, None)
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "entries": list(self._entries.items())}, f)
+        os.replace(tmp_path, self.path)
+        self._loaded_mtime = os.path.getmtime(self.path)
+
+
+question_cache = QuestionCache(
+    QUESTION_CACHE_PATH,
+    version=CHEMBL_VERSION,
+    threshold=QUESTION_CACHE_THRESHOLD,
+    max_entries=QUESTION_CACHE_MAX_ENTRIES,
+    ttl_seconds=QUESTION_CACHE_TTL_SECONDS
+)
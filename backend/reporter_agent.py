@@ -1,16 +1,126 @@
-from vertexai.preview.generative_models import GenerativeModel, Content, Part, GenerationConfig
+from vertexai.preview.generative_models import Content, Part
+from llm_client import generate_content, generate_content_async, stream_content, stream_content_async, PRO_MODEL, DETERMINISTIC_CONFIG
 from task_description import REPORTER_INSTRUCTION
-from typing import Any
+from typing import Any, AsyncIterator, Iterator
+from usage import join_sections
 
 def generate_summary_with_reporter(user_question: str, orchestrator_response: str, sql_query: str, query_result: list[dict]) -> tuple[Any, str]:
-    prompt: str = f"Instructions:\n{REPORTER_INSTRUCTION}\n\nUser question:\n{user_question}\n\nOrchestrator agent:\n{orchestrator_response}\n\nSql query:\n{sql_query}\n\nQuery result:\n{query_result}"
-    model = GenerativeModel(model_name="gemini-2.0-pro-exp-02-05")
-    response = model.generate_content(
+    sections: dict[str, str] = build_reporter_prompt_sections(user_question, orchestrator_response, sql_query, query_result)
+    prompt: str = join_sections(sections)
+    response = generate_content(
+        PRO_MODEL,
         contents=[
             Content(role="user", parts=[Part.from_text(prompt)])
         ],
-        generation_config=GenerationConfig(temperature=0, top_k=1, top_p=1)
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="reporter",
+        sections=sections
     )
     text_response: str = response.candidates[0].content.parts[0].text
 
-    return response, text_response
\ No newline at end of file
+    return response, text_response
+
+
+def stream_summary_with_reporter(user_question: str, orchestrator_response: str, sql_query: str, query_result: list[dict]) -> Iterator[str]:
+    """Streams the Reporter agent summary as text chunks, as soon as the model produces them.
+
+    Args:
+        user_question (str): The question provided by the user.
+        orchestrator_response (str): The text produced by the Orchestrator agent.
+        sql_query (str): The SQL query accepted by the Checker agent.
+        query_result (list[dict]): The results of the SQL query.
+
+    Yields:
+        str: Consecutive pieces of the summary text.
+
+    References:
+        https://cloud.google.com/vertex-ai/generative-ai/docs/model-reference/inference#stream
+    """
+    sections: dict[str, str] = build_reporter_prompt_sections(user_question, orchestrator_response, sql_query, query_result)
+    prompt: str = join_sections(sections)
+    responses = stream_content(
+        PRO_MODEL,
+        contents=[
+            Content(role="user", parts=[Part.from_text(prompt)])
+        ],
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="reporter",
+        sections=sections
+    )
+    for chunk in responses:
+        if chunk.candidates and chunk.candidates[0].content.parts:
+            text: str = chunk.candidates[0].content.parts[0].text
+            if text:
+                yield text
+
+
+async def generate_summary_with_reporter_async(user_question: str, orchestrator_response: str, sql_query: str, query_result: list[dict]) -> tuple[Any, str]:
+    """Generates the summary like `generate_summary_with_reporter`, without blocking the event loop.
+
+    Args:
+        user_question (str): The question provided by the user.
+        orchestrator_response (str): The text produced by the Orchestrator agent.
+        sql_query (str): The SQL query accepted by the Checker agent.
+        query_result (list[dict]): The results of the SQL query.
+
+    Returns:
+        tuple[GenerateContentResponse, str]: The full response object and the extracted text response.
+    """
+    sections: dict[str, str] = build_reporter_prompt_sections(user_question, orchestrator_response, sql_query, query_result)
+    prompt: str = join_sections(sections)
+    response = await generate_content_async(
+        PRO_MODEL,
+        contents=[
+            Content(role="user", parts=[Part.from_text(prompt)])
+        ],
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="reporter",
+        sections=sections
+    )
+    text_response: str = response.candidates[0].content.parts[0].text
+    return response, text_response
+
+
+async def stream_summary_with_reporter_async(user_question: str, orchestrator_response: str, sql_query: str, query_result: list[dict]) -> AsyncIterator[str]:
+    """Streams the summary like `stream_summary_with_reporter`, without blocking the event loop.
+
+    Args:
+        user_question (str): The question provided by the user.
+        orchestrator_response (str): The text produced by the Orchestrator agent.
+        sql_query (str): The SQL query accepted by the Checker agent.
+        query_result (list[dict]): The results of the SQL query.
+
+    Yields:
+        str: Consecutive pieces of the summary text.
+    """
+    sections: dict[str, str] = build_reporter_prompt_sections(user_question, orchestrator_response, sql_query, query_result)
+    prompt: str = join_sections(sections)
+    responses = stream_content_async(
+        PRO_MODEL,
+        contents=[
+            Content(role="user", parts=[Part.from_text(prompt)])
+        ],
+        generation_config=DETERMINISTIC_CONFIG,
+        agent="reporter",
+        sections=sections
+    )
+    async for chunk in responses:
+        if chunk.candidates and chunk.candidates[0].content.parts:
+            text: str = chunk.candidates[0].content.parts[0].text
+            if text:
+                yield text
+
+
+def build_reporter_prompt(user_question: str, orchestrator_response: str, sql_query: str, query_result: list[dict]) -> str:
+    return join_sections(build_reporter_prompt_sections(user_question, orchestrator_response, sql_query, query_result))
+
+
+def build_reporter_prompt_sections(user_question: str, orchestrator_response: str, sql_query: str, query_result: list[dict]) -> dict[str, str]:
+    """Returns the named sections of the Reporter prompt, in prompt order (see `usage`)."""
+    return {
+        "instruction": f"Instructions:\n{REPORTER_INSTRUCTION}",
+        "question": f"User question:\n{user_question}",
+        "orchestrator": f"Orchestrator agent:\n{orchestrator_response}",
+        "sql": f"Sql query:\n{sql_query}",
+        "query_result": f"Query result:\n{query_result}"
+    }
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlite_store import SQLiteStore
+from utils import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+REQUEST_STORE_PATH = os.getenv("REQUEST_STORE_PATH", os.path.join(CACHE_DIR, "requests.sqlite3"))
+REQUEST_STORE_MAX_ENTRIES = int(os.getenv("REQUEST_STORE_MAX_ENTRIES", "10000"))
+REQUEST_STORE_TTL_SECONDS = int(os.getenv("REQUEST_STORE_TTL_SECONDS", str(24 * 3600)))
+REQUEST_STORE_PRUNE_EVERY = int(os.getenv("REQUEST_STORE_PRUNE_EVERY", "100"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    request_id TEXT PRIMARY KEY,
+    question TEXT,
+    sql TEXT,
+    timings TEXT NOT NULL DEFAULT '{}',
+    snapshot_path TEXT,
+    usage TEXT,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_accessed_at ON requests (accessed_at);
+"""
+
+
+class RequestStore(SQLiteStore):
+    """Maps request ids to the SQL that answered them, so downloads work on any worker and after a restart.
+
+    Entries live in a SQLite file shared by every gunicorn worker of the host, see `SQLiteStore`. They expire
+    `ttl_seconds` after their last access, and the least recently accessed ones are evicted beyond `max_entries`;
+    the snapshot file of an evicted entry (see `set_snapshot`) is deleted with it.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: int, prune_every: int = 100, busy_timeout: float = 10.0):
+        super().__init__(path, _SCHEMA, busy_timeout)
+        self._migrate()
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def put(self, request_id: str, sql_query: str | None, question: str = "", timings: dict | None = None) -> None:
+        """Stores the SQL of an answered request.
+
+        Args:
+            request_id (str): The id returned to the client.
+            sql_query (str | None): The final SQL query of the request, None when the Writer/Checker loop produced
+                none. Such requests are kept for their timings and usage, but have no results to fetch.
+            question (str): The question provided by the user.
+            timings (dict | None): Seconds spent per pipeline stage.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO requests (request_id, question, sql, timings, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (request_id, question, sql_query, json.dumps(timings or {}), now, now)
+            )
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % self.prune_every == 0
+        if prune:
+            self.prune()
+
+    def get(self, request_id: str) -> dict | None:
+        """Returns a request (request_id, question, sql, timings, snapshot_path, usage, created_at), or None when unknown or expired."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM requests WHERE request_id = ?", (request_id,)).fetchone()
+            if row is None or row["accessed_at"] < now - self.ttl_seconds:
+                return None
+            conn.execute("UPDATE requests SET accessed_at = ? WHERE request_id = ?", (now, request_id))
+        request = dict(row)
+        request["timings"] = json.loads(request["timings"])
+        request["usage"] = json.loads(request["usage"]) if request["usage"] else None
+        return request
+
+    def get_sql(self, request_id: str) -> str | None:
+        request = self.get(request_id)
+        return None if request is None else request["sql"]
+
+    def update_timings(self, request_id: str, timings: dict) -> None:
+        """Merges stage timings into a stored request, e.g. the Reporter time once the summary is done."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT timings FROM requests WHERE request_id = ?", (request_id,)).fetchone()
+            if row is not None:
+                merged = {**json.loads(row["timings"]), **timings}
+                conn.execute("UPDATE requests SET timings = ? WHERE request_id = ?", (json.dumps(merged), request_id))
+
+    def set_snapshot(self, request_id: str, snapshot_path: str | None) -> None:
+        """Points a request at a materialized copy of its full results, or clears the pointer."""
+        with self._transaction() as conn:
+            conn.execute("UPDATE requests SET snapshot_path = ? WHERE request_id = ?", (snapshot_path, request_id))
+
+    def set_usage(self, request_id: str, usage: dict) -> None:
+        """Stores the model usage of a request, see `usage.finish_request`."""
+        with self._transaction() as conn:
+            conn.execute("UPDATE requests SET usage = ? WHERE request_id = ?", (json.dumps(usage), request_id))
+
+    def prune(self) -> int:
+        """Deletes the expired entries and the least recently accessed ones beyond `max_entries`.
+
+        Returns:
+            int: The number of deleted entries.
+        """
+        with self._transaction() as conn:
+            cutoff = time.time() - self.ttl_seconds
+            rows = conn.execute(
+                "SELECT request_id, snapshot_path FROM requests WHERE accessed_at < ? "
+                "UNION SELECT request_id, snapshot_path FROM requests "
+                "WHERE request_id NOT IN (SELECT request_id FROM requests ORDER BY accessed_at DESC LIMIT ?)",
+                (cutoff, self.max_entries)
+            ).fetchall()
+            conn.executemany("DELETE FROM requests WHERE request_id = ?", [(row["request_id"],) for row in rows])
+        for row in rows:
+            if row["snapshot_path"]:
+                try:
+                    os.remove(row["snapshot_path"])
+                except OSError:
+                    pass
+        return len(rows)
+
+    def _migrate(self) -> None:
+        # Files created before the usage column existed keep their rows; CREATE TABLE IF NOT EXISTS skips them.
+        with self._transaction() as conn:
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(requests)")}
+            if "usage" not in columns:
+                conn.execute("ALTER TABLE requests ADD COLUMN usage TEXT")
+
+    def stats(self) -> dict:
+        with self._transaction() as conn:
+            row = conn.execute("SELECT COUNT(*) AS entries, SUM(snapshot_path IS NOT NULL) AS snapshots FROM requests").fetchone()
+        return {"entries": row["entries"], "snapshots": row["snapshots"] or 0, "max_entries": self.max_entries, "ttl_seconds": self.ttl_seconds}
+
+
+request_store = RequestStore(
+    REQUEST_STORE_PATH,
+    max_entries=REQUEST_STORE_MAX_ENTRIES,
+    ttl_seconds=REQUEST_STORE_TTL_SECONDS,
+    prune_every=REQUEST_STORE_PRUNE_EVERY
+)
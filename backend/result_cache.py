@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_QUOTED = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""")
+
+
+def normalize_sql(query: str) -> str:
+    """Normalizes an SQL query for use as a cache key.
+
+    Collapses whitespace and drops a trailing semicolon, leaving quoted literals and identifiers untouched.
+
+    Args:
+        query (str): The SQL query.
+
+    Returns:
+        str: The normalized query.
+    """
+    parts = _QUOTED.split(query.strip().rstrip(";").strip())
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts)).strip()
+
+
+class ResultCache:
+    """LRU cache of query results under a memory byte budget, with an optional disk tier for large results.
+
+    Results are stored pickled, so the byte budget is exact and callers cannot mutate cached rows. Results larger
+    than `spill_bytes` go to the disk tier, which is a directory of pickle files shared by all workers of the
+    host and trimmed by access time to `disk_max_bytes`. Only successful results should be cached; ChEMBL
+    releases are read-only, so entries never go stale within a version.
+
+    Since unpickling runs code, the disk tier must be private: its directory is created with mode 0700, the tier
+    is disabled when the directory belongs to another user or is writable by others, and only files owned by
+    this user are read.
+    """
+
+    def __init__(self, max_bytes: int, spill_bytes: int, disk_dir: str | None, disk_max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.spill_bytes = spill_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._bytes = 0
+        self._counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "saved_seconds": 0.0}
+        self._lock = threading.Lock()
+        self._disk_checked = False
+
+    @staticmethod
+    def make_key(query: str, limit: int, namespace: str = "") -> str:
+        return hashlib.sha256(f"{namespace}\n{limit}\n{normalize_sql(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> list[dict] | None:
+        """Returns the cached rows for a key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._count_hit("memory_hits", entry[1])
+                return pickle.loads(entry[0])
+        rows = self._read_disk(key)
+        with self._lock:
+            if rows is None:
+                self._counters["misses"] += 1
+            else:
+                self._count_hit("disk_hits", rows[1])
+        return rows[0] if rows is not None else None
+
+    def put(self, key: str, rows: list[dict], elapsed_seconds: float) -> None:
+        """Stores the rows of a query.
+
+        Args:
+            key (str): The cache key, see `make_key`.
+            rows (list[dict]): The query results.
+            elapsed_seconds (float): How long the database took to produce them, reported as saved time on hits.
+        """
+        data = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_entry_bytes:
+            return
+        if len(data) > self.spill_bytes:
+            self._write_disk(key, data, elapsed_seconds)
+            return
+        with self._lock:
+            self._counters["stores"] += 1
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[0])
+            self._entries[key] = (data, elapsed_seconds)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._counters["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters, the time saved on hits, and the size of the memory tier."""
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def _count_hit(self, tier: str, elapsed_seconds: float) -> None:
+        self._counters["hits"] += 1
+        self._counters[tier] += 1
+        self._counters["saved_seconds"] += elapsed_seconds
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def _private_disk_dir(self) -> str | None:
+        """Returns the disk tier directory, creating it private on first use, or None if it is disabled or unsafe."""
+        if self.disk_dir and not self._disk_checked:
+            try:
+                os.makedirs(self.disk_dir, mode=0o700, exist_ok=True)
+                stat = os.stat(self.disk_dir, follow_symlinks=False)
+                if stat.st_uid != os.getuid():
+                    raise PermissionError(f"owned by uid {stat.st_uid}")
+                if stat.st_mode & 0o077:
+                    os.chmod(self.disk_dir, 0o700)
+            except OSError as e:
+                logger.warning(f"Disabling the disk result cache, {self.disk_dir} is not a private directory: {e}")
+                self.disk_dir = None
+            self._disk_checked = True
+        return self.disk_dir
+
+    def _read_disk(self, key: str) -> tuple[list[dict], float] | None:
+        if not self._private_disk_dir():
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                owner = os.fstat(f.fileno()).st_uid
+                if owner != os.getuid():
+                    raise PermissionError(f"owned by uid {owner}")
+                elapsed_seconds = pickle.load(f)
+                rows = pickle.load(f)
+            os.utime(path)
+            return rows, elapsed_seconds
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cached result {path}: {e}")
+            return None
+
+    def _write_disk(self, key: str, data: bytes, elapsed_seconds: float) -> None:
+        if not self._private_disk_dir():
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(elapsed_seconds, f)
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cached result {path}: {e}")
+            return
+        with self._lock:
+            self._counters["stores"] += 1
+        self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_atime, stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, _, size, _ in files)
+        for _, _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,191 @@
+import functools
+import os
+import re
+from dataclasses import dataclass, field
+
+from bm25 import BM25Index, tokenize
+from database_schema import DATABASE_SCHEMA
+
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "8"))
+SCHEMA_ORCHESTRATOR_TOP_K = int(os.getenv("SCHEMA_ORCHESTRATOR_TOP_K", "12"))
+SCHEMA_MAX_TABLES = int(os.getenv("SCHEMA_MAX_TABLES", "24"))
+SCHEMA_CORE_TABLES = tuple(
+    name.strip().upper()
+    for name in os.getenv("SCHEMA_CORE_TABLES", "ACTIVITIES,ASSAYS,TARGET_DICTIONARY,MOLECULE_DICTIONARY").split(",")
+    if name.strip()
+)
+# Tables documented whenever a key table is selected, because its usual questions go through them: gene symbols and
+# accessions of a target are only reachable through its components.
+SCHEMA_LINKED_TABLES = {
+    "TARGET_DICTIONARY": ("TARGET_COMPONENTS", "COMPONENT_SEQUENCES", "COMPONENT_SYNONYMS"),
+    "COMPONENT_SEQUENCES": ("TARGET_COMPONENTS", "COMPONENT_SYNONYMS"),
+}
+
+_TABLE_HEADER = re.compile(r"^([A-Z0-9_]+):\s*$", re.MULTILINE)
+_COLUMN_LINE = re.compile(r"^(?P<keys>[A-Z,]+)?\s+(?P<name>[A-Z0-9_]+)\s+(?P<data_type>\S+)(?:\s+(?P<not_null>NOT NULL))?(?:\s+(?P<comment>.*))?$")
+
+
+@dataclass
+class SchemaColumn:
+    name: str
+    data_type: str
+    keys: tuple[str, ...] = ()
+    nullable: bool = True
+    comment: str = ""
+
+
+@dataclass
+class SchemaTable:
+    name: str
+    description: str
+    text: str
+    columns: list[SchemaColumn] = field(default_factory=list)
+    foreign_keys: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def primary_key(self) -> list[str]:
+        return [column.name for column in self.columns if "PK" in column.keys]
+
+
+def parse_schema(schema: str = DATABASE_SCHEMA) -> dict[str, SchemaTable]:
+    """Splits the schema documentation into one chunk per table and parses its columns and keys.
+
+    Foreign keys are resolved to the table owning the column as its own primary key (the one named in the column
+    comment when several do, e.g. COMPONENT_ID), or else to the first table named in the column comment.
+
+    Args:
+        schema (str): The schema documentation, in the format of `DATABASE_SCHEMA`.
+
+    Returns:
+        dict[str, SchemaTable]: The tables by upper-case name, in documentation order.
+    """
+    headers = list(_TABLE_HEADER.finditer(schema))
+    tables = {}
+    for header, next_header in zip(headers, headers[1:] + [None]):
+        text = schema[header.start():next_header.start() if next_header else len(schema)].strip().rstrip('"').strip()
+        lines = text.splitlines()
+        description = lines[1].strip() if len(lines) > 1 else ""
+        columns = [_parse_column(line) for line in lines[2:] if line.strip() and not line.startswith("KEYS")]
+        tables[header.group(1)] = SchemaTable(header.group(1), description, text, [column for column in columns if column])
+
+    primary_key_owners = {}
+    for table in tables.values():
+        for column in table.columns:
+            if column.keys == ("PK",):
+                primary_key_owners.setdefault(column.name, []).append(table.name)
+    for table in tables.values():
+        for column in table.columns:
+            if "FK" not in column.keys:
+                continue
+            owners = [owner for owner in primary_key_owners.get(column.name, []) if owner != table.name]
+            mentioned = _first_table_mentioned(column.comment, tables, exclude=table.name)
+            target = mentioned if mentioned in owners or not owners else owners[0]
+            if target is not None:
+                table.foreign_keys[column.name] = target
+    return tables
+
+
+def _parse_column(line: str) -> SchemaColumn | None:
+    match = _COLUMN_LINE.match(line)
+    if match is None:
+        return None
+    keys = tuple(match.group("keys").split(",")) if match.group("keys") else ()
+    return SchemaColumn(
+        name=match.group("name"),
+        data_type=match.group("data_type"),
+        keys=keys,
+        nullable=match.group("not_null") is None,
+        comment=(match.group("comment") or "").strip()
+    )
+
+
+def _first_table_mentioned(comment: str, tables: dict[str, SchemaTable], exclude: str) -> str | None:
+    mentions = [
+        (match.start(), name) for name in tables if name != exclude
+        for match in [re.search(rf"\b{name.lower()}\b", comment.lower())] if match
+    ]
+    return min(mentions)[1] if mentions else None
+
+
+TABLES_BY_NAME = parse_schema()
+_TABLE_NAMES = list(TABLES_BY_NAME)
+_SCHEMA_HEADER = DATABASE_SCHEMA.strip().splitlines()[0]
+
+
+def _table_tokens(table: SchemaTable) -> list[str]:
+    name_tokens = tokenize(table.name.replace("_", " "))
+    column_tokens = [token for column in table.columns for token in tokenize(f"{column.name.replace('_', ' ')} {column.comment}")]
+    return name_tokens * 3 + tokenize(table.description) * 2 + column_tokens
+
+
+_bm25 = BM25Index([_table_tokens(TABLES_BY_NAME[name]) for name in _TABLE_NAMES])
+
+
+def rank_tables(text: str, top_k: int) -> list[str]:
+    """Ranks the tables against a question (and any agent output) with BM25.
+
+    Tables named verbatim in the text (e.g. "target_dictionary") are ranked first.
+
+    Args:
+        text (str): The question, optionally followed by the Orchestrator instructions.
+        top_k (int): The number of tables to return.
+
+    Returns:
+        list[str]: The names of the best matching tables, best first.
+    """
+    lowered = text.lower()
+    named = [name for name in _TABLE_NAMES if re.search(rf"\b{name.lower()}\b", lowered)]
+    ranked = [_TABLE_NAMES[i] for i, _ in _bm25.top_k(tokenize(text), len(_TABLE_NAMES))]
+    return list(dict.fromkeys(named + ranked))[:top_k]
+
+
+@functools.lru_cache(maxsize=256)
+def select_tables(text: str, top_k: int = SCHEMA_TOP_K, max_tables: int = SCHEMA_MAX_TABLES) -> list[str]:
+    """Selects the tables to show the agents, so every join path between them is documented. In order of priority:
+        - the core tables and the top-k ranked ones,
+        - the tables linked to them in `SCHEMA_LINKED_TABLES`,
+        - the join tables between them: tables whose foreign keys all reference them, two or more of them (e.g.
+          TARGET_COMPONENTS between TARGET_DICTIONARY and COMPONENT_SEQUENCES),
+        - the tables referenced through foreign keys by all of them but the core tables.
+
+    Args:
+        text (str): The question, optionally followed by the Orchestrator instructions.
+        top_k (int): The number of ranked tables to select.
+        max_tables (int): The maximum number of tables once linked, join and foreign-key tables are added.
+
+    Returns:
+        list[str]: The selected table names, in documentation order.
+    """
+    ranked = rank_tables(text, top_k)
+    selected = list(dict.fromkeys([name for name in SCHEMA_CORE_TABLES if name in TABLES_BY_NAME] + ranked))
+    chosen = list(selected)
+    for name in chosen:
+        selected.extend(linked for linked in SCHEMA_LINKED_TABLES.get(name, ()) if linked in TABLES_BY_NAME)
+    selected = list(dict.fromkeys(selected))
+    for name, table in TABLES_BY_NAME.items():
+        targets = set(table.foreign_keys.values())
+        if name not in selected and len(targets) >= 2 and targets <= set(selected):
+            selected.append(name)
+    for name in ranked + selected[len(chosen):]:
+        for target in TABLES_BY_NAME[name].foreign_keys.values():
+            if target not in selected:
+                selected.append(target)
+    selected = set(selected[:max_tables])
+    return [name for name in _TABLE_NAMES if name in selected]
+
+
+def select_schema(text: str, top_k: int = SCHEMA_TOP_K) -> str:
+    """Returns the schema documentation restricted to the tables relevant to a question.
+
+    Args:
+        text (str): The question, optionally followed by the Orchestrator instructions.
+        top_k (int): The number of ranked tables to select. With 0 or less, the full schema is returned.
+
+    Returns:
+        str: The schema documentation of the selected tables, in the format of `DATABASE_SCHEMA`.
+    """
+    if top_k <= 0:
+        return DATABASE_SCHEMA
+    tables = select_tables(text, top_k)
+    chunks = "\n\n\n".join(TABLES_BY_NAME[name].text for name in tables)
+    return f"\n{_SCHEMA_HEADER} ({len(tables)} of {len(_TABLE_NAMES)} tables, selected for this question)\n\n\n{chunks}\n"
@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
+
+import pyarrow.parquet as pq
+
+from exporters import Batches, ResultColumns, arrow_schema, to_record_batch
+from request_store import request_store
+from utils import CACHE_DIR, iter_query_batches
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS_ENABLED = os.getenv("SNAPSHOTS", "1") != "0"
+# Snapshots are taken on the first download, export job or page of a request. With SNAPSHOT_EAGER, every green
+# answer is snapshotted as soon as it is given, so that first download is served from a snapshot too, at the cost
+# of a second, unlimited query per question on the database.
+SNAPSHOT_EAGER = os.getenv("SNAPSHOT_EAGER", "0") == "1"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(CACHE_DIR, "snapshots"))
+SNAPSHOT_MAX_BYTES = int(os.getenv("SNAPSHOT_MAX_BYTES", str(512 * 1024 * 1024)))
+SNAPSHOT_DIR_MAX_BYTES = int(os.getenv("SNAPSHOT_DIR_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+SNAPSHOT_WORKERS = int(os.getenv("SNAPSHOT_WORKERS", "1"))
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "50000"))
+SNAPSHOT_WAIT_SECONDS = float(os.getenv("SNAPSHOT_WAIT_SECONDS", "30"))
+
+_executor = ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS, thread_name_prefix="snapshot")
+_pending: dict[str, Future] = {}
+_too_large: set[str] = set()
+_pending_lock = threading.Lock()
+_counters = {"written": 0, "too_large": 0, "failed": 0, "served": 0, "evicted": 0}
+
+
+class SnapshotTooLarge(Exception):
+    """Raised when a result outgrows `SNAPSHOT_MAX_BYTES` while it is being materialized."""
+
+
+def snapshot_path(request_id: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"{request_id}.parquet")
+
+
+def schedule_snapshot(request_id: str, sql_query: str) -> Future | None:
+    """Materializes the full results of a request in the background, see `write_snapshot`.
+
+    Args:
+        request_id (str): The id of the request, see `request_store`.
+        sql_query (str): The SQL query accepted by the Checker.
+
+    Returns:
+        Future | None: The background task (the pending one if the request is already being snapshotted), or None
+            when snapshots are disabled or the results are known to be too large.
+    """
+    if not SNAPSHOTS_ENABLED:
+        return None
+    with _pending_lock:
+        if request_id in _too_large:
+            return None
+        if request_id in _pending:
+            return _pending[request_id]
+        future = _executor.submit(write_snapshot, request_id, sql_query)
+        _pending[request_id] = future
+    future.add_done_callback(lambda _: _forget(request_id))
+    return future
+
+
+def _forget(request_id: str) -> None:
+    with _pending_lock:
+        _pending.pop(request_id, None)
+
+
+def write_snapshot(request_id: str, sql_query: str) -> str | None:
+    """Runs a query without row limit and writes its results to a Parquet file, one row group per fetched batch.
+
+    The file is written under a temporary name and renamed once complete, so readers never see a partial
+    snapshot; results outgrowing `SNAPSHOT_MAX_BYTES` are abandoned and downloads fall back to running the SQL.
+    On success, the request points at the snapshot and the snapshot directory is trimmed to
+    `SNAPSHOT_DIR_MAX_BYTES`, least recently used first.
+
+    Args:
+        request_id (str): The id of the request, see `request_store`.
+        sql_query (str): The SQL query accepted by the Checker.
+
+    Returns:
+        str | None: The path of the snapshot, or None when it could not be written.
+    """
+    path = snapshot_path(request_id)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        _write_parquet(iter_query_batches(sql_query, batch_size=SNAPSHOT_BATCH_SIZE), tmp_path, SNAPSHOT_MAX_BYTES)
+        os.replace(tmp_path, path)
+    except SnapshotTooLarge:
+        logger.info(f"Results of request {request_id} exceed {SNAPSHOT_MAX_BYTES} bytes, not snapshotting them")
+        _counters["too_large"] += 1
+        with _pending_lock:
+            _too_large.add(request_id)
+        _remove(tmp_path)
+        return None
+    except Exception:
+        logger.exception(f"Could not snapshot the results of request {request_id}")
+        _counters["failed"] += 1
+        _remove(tmp_path)
+        return None
+    request_store.set_snapshot(request_id, path)
+    _counters["written"] += 1
+    trim_snapshots(SNAPSHOT_DIR_MAX_BYTES)
+    return path
+
+
+def _write_parquet(batches: Batches, path: str, max_bytes: int) -> None:
+    writer = None
+    try:
+        for columns, rows in batches:
+            if writer is None:
+                schema = arrow_schema(columns, rows)
+                writer = pq.ParquetWriter(path, schema, compression="snappy")
+            if rows:
+                writer.write_batch(to_record_batch(schema, rows))
+                if os.path.getsize(path) > max_bytes:
+                    raise SnapshotTooLarge(path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def find_snapshot(request: dict, wait_seconds: float = 0.0, create: bool = True) -> str | None:
+    """Returns the path of a request's snapshot if it exists, scheduling it on first use.
+
+    Args:
+        request (dict): The request, as returned by `request_store.get`.
+        wait_seconds (float): How long to wait for a snapshot being written by this worker, rather than running the
+            query a second time.
+        create (bool): Whether to schedule the snapshot when the request has none yet.
+
+    Returns:
+        str | None: The path of the snapshot, or None when the results must be fetched from the database.
+    """
+    path = request["snapshot_path"] or snapshot_path(request["request_id"])
+    if not os.path.exists(path):
+        with _pending_lock:
+            future = _pending.get(request["request_id"])
+        if future is None and create:
+            future = schedule_snapshot(request["request_id"], request["sql"])
+        if future is not None and wait_seconds > 0:
+            try:
+                future.result(timeout=wait_seconds)
+            except Exception:
+                pass
+        if not os.path.exists(path):
+            return None
+    try:
+        os.utime(path, (time.time(), os.path.getmtime(path)))  # Marks it as used for `trim_snapshots`
+    except OSError:
+        pass
+    return path
+
+
+def iter_snapshot_batches(path: str, batch_size: int = 5000) -> Iterator[tuple[list[str], list[tuple]]]:
+    """Reads a snapshot batch by batch, in the same shape as `utils.iter_query_batches`.
+
+    Args:
+        path (str): The path of the snapshot.
+        batch_size (int): The maximum number of rows per batch.
+
+    Yields:
+        tuple[list[str], list[tuple]]: The column names and a batch of rows. An empty snapshot yields a single
+            empty batch.
+    """
+    _counters["served"] += 1
+    parquet_file = pq.ParquetFile(path)
+    columns = ResultColumns(parquet_file.schema_arrow.names, parquet_file.schema_arrow)
+    if parquet_file.metadata.num_rows == 0:
+        yield columns, []
+        return
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield columns, list(zip(*(column.to_pylist() for column in batch.columns)))
+
+
+def iter_request_batches(request: dict, wait_seconds: float = 0.0) -> Iterator[tuple[list[str], list[tuple]]]:
+    """Yields the full results of a request, from its snapshot when there is one (or one is ready within
+    `wait_seconds`) and from the database otherwise."""
+    path = find_snapshot(request, wait_seconds)
+    if path is not None:
+        return iter_snapshot_batches(path)
+    return iter_query_batches(request["sql"], limit=10000000)
+
+
+def trim_snapshots(max_bytes: int) -> None:
+    """Deletes the least recently used snapshots until the snapshot directory fits in `max_bytes`."""
+    try:
+        entries = [entry for entry in os.scandir(SNAPSHOT_DIR) if entry.name.endswith(".parquet")]
+        files = sorted(((entry.stat().st_atime, entry.stat().st_size, entry.path) for entry in entries), reverse=True)
+    except OSError:
+        return
+    total = 0
+    for _, size, path in files:
+        total += size
+        if total > max_bytes:
+            _remove(path)
+            _counters["evicted"] += 1
+
+
+def stats() -> dict:
+    with _pending_lock:
+        pending = len(_pending)
+    return {**_counters, "pending": pending, "enabled": SNAPSHOTS_ENABLED, "eager": SNAPSHOT_EAGER}
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
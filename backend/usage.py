@@ -0,0 +1,133 @@
+"""Token and prompt-size accounting of the model calls, per agent and per request.
+
+Every call made through `llm_client` records the `usage_metadata` of its response (prompt, output and total
+tokens) with the character count of each named section of its prompt (instructions, schema, examples, query
+result...). The API only reports the token count of the whole prompt, so the tokens of a section are estimated
+from its share of the prompt characters.
+
+Calls are attributed to the request being tracked in the current context (see `track_request`); the summary of a
+request is saved in `request_store` and written to the "usage" logger as one JSON line. Process-wide totals per
+agent are kept for the debug endpoint.
+"""
+import contextvars
+import json
+import logging
+import threading
+from typing import Any
+
+from metrics import LLM_TOKENS
+
+logger = logging.getLogger("usage")
+
+_current: contextvars.ContextVar["UsageTracker | None"] = contextvars.ContextVar("usage_tracker", default=None)
+_totals_lock = threading.Lock()
+_totals: dict[str, dict] = {}
+
+
+class UsageTracker:
+    """Accumulates the usage of the model calls of one request, per agent and per prompt section."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.agents: dict[str, dict] = {}
+
+    def add(self, agent: str, model_name: str, prompt_tokens: int, output_tokens: int, seconds: float, sections: dict[str, int]) -> None:
+        with self._lock:
+            _accumulate(self.agents, agent, model_name, prompt_tokens, output_tokens, seconds, sections)
+
+    def summary(self) -> dict:
+        """Returns the totals of the request and the usage per agent (calls, tokens, seconds, sections)."""
+        with self._lock:
+            agents = json.loads(json.dumps(self.agents))
+        return {
+            "calls": sum(agent["calls"] for agent in agents.values()),
+            "promptTokens": sum(agent["promptTokens"] for agent in agents.values()),
+            "outputTokens": sum(agent["outputTokens"] for agent in agents.values()),
+            "seconds": round(sum(agent["seconds"] for agent in agents.values()), 3),
+            "agents": agents
+        }
+
+
+def track_request() -> UsageTracker:
+    """Starts attributing the model calls of the current context to a new tracker, and returns it.
+
+    asyncio tasks and `asyncio.to_thread` calls started from the context inherit the tracker, but plain threads and
+    executor jobs do not: submit them through `contextvars.copy_context().run`, as `literature_findings` does, for
+    their calls to be counted. Callers must reach `finish_request` in a `finally`, or later calls on the same
+    thread are charged to this request.
+    """
+    tracker = UsageTracker()
+    _current.set(tracker)
+    return tracker
+
+
+def finish_request(tracker: UsageTracker, request_id: str | None) -> dict:
+    """Stops tracking, logs the usage of the request as one JSON line, and returns its summary."""
+    if _current.get() is tracker:
+        _current.set(None)
+    summary = tracker.summary()
+    logger.info(json.dumps({"event": "llm_usage", "requestId": request_id, **summary}))
+    return summary
+
+
+def record(agent: str | None, model_name: str, response: Any, seconds: float, sections: dict[str, int]) -> None:
+    """Records a finished model call, from its response (or last streamed chunk) and its prompt section sizes."""
+    metadata = getattr(response, "usage_metadata", None)
+    prompt_tokens = int(getattr(metadata, "prompt_token_count", 0) or 0)
+    output_tokens = int(getattr(metadata, "candidates_token_count", 0) or 0)
+    agent = agent or "other"
+    LLM_TOKENS.labels(agent, model_name, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(agent, model_name, "output").inc(output_tokens)
+    with _totals_lock:
+        _accumulate(_totals, agent, model_name, prompt_tokens, output_tokens, seconds, sections)
+    tracker = _current.get()
+    if tracker is not None:
+        tracker.add(agent, model_name, prompt_tokens, output_tokens, seconds, sections)
+
+
+def prompt_sizes(contents: list, sections: dict[str, str] | None) -> dict[str, int]:
+    """Returns the character count of each prompt section, or of the whole text of `contents` as "prompt" when the
+    caller did not name its sections. Attached files are counted as "attachments", one character each."""
+    if sections is not None:
+        return {name: len(text) for name, text in sections.items()}
+    sizes = {}
+    for content in contents:
+        for part in getattr(content, "parts", []):
+            text = _part_text(part)
+            name = "prompt" if text is not None else "attachments"
+            sizes[name] = sizes.get(name, 0) + (len(text) if text is not None else 1)
+    return sizes
+
+
+def join_sections(sections: dict[str, str]) -> str:
+    """Builds a prompt from its named sections, in order, separated by blank lines."""
+    return "\n\n".join(sections.values())
+
+
+def stats() -> dict:
+    """Returns the usage per agent of this process since it started."""
+    with _totals_lock:
+        return json.loads(json.dumps(_totals))
+
+
+def _part_text(part: Any) -> str | None:
+    try:
+        return part.text
+    except (AttributeError, ValueError):  # Parts holding a file raise instead of returning no text
+        return None
+
+
+def _accumulate(agents: dict, agent: str, model_name: str, prompt_tokens: int, output_tokens: int, seconds: float,
+                sections: dict[str, int]) -> None:
+    stats = agents.setdefault(agent, {"calls": 0, "models": [], "promptTokens": 0, "outputTokens": 0, "seconds": 0.0, "sections": {}})
+    stats["calls"] += 1
+    if model_name not in stats["models"]:
+        stats["models"].append(model_name)
+    stats["promptTokens"] += prompt_tokens
+    stats["outputTokens"] += output_tokens
+    stats["seconds"] += seconds
+    total_chars = sum(sections.values())
+    for name, chars in sections.items():
+        section = stats["sections"].setdefault(name, {"chars": 0, "tokens": 0})
+        section["chars"] += chars
+        section["tokens"] += round(prompt_tokens * chars / total_chars) if total_chars else 0
@@ -1,53 +1,213 @@
+import asyncio
 import re
+import time
+from typing import Iterator
 from decimal import Decimal
 import mysql.connector
 import os
 
+import query_control
+from db_pool import ConnectionPool
+from exporters import ResultColumns, arrow_schema_from_description
+from metrics import DB_QUERY_SECONDS
+from query_control import CancelToken, cancel_scope, current_token, watch_query
+from result_cache import ResultCache
 
-def execute_query(query: str, limit=100) -> list[dict] | str:
+CHEMBL_VERSION = os.getenv("CHEMBL_VERSION", "chembl_35")
+CACHE_DIR = os.getenv("CACHE_DIR", "/tmp/typetwo")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_PING_IDLE_SECONDS = float(os.getenv("DB_POOL_PING_IDLE_SECONDS", "0"))
+
+# Server-side limits for SELECT statements (MAX_EXECUTION_TIME), in milliseconds. 0 disables the limit.
+DB_INTERACTIVE_TIMEOUT_MS = int(os.getenv("DB_INTERACTIVE_TIMEOUT_MS", "30000"))
+DB_EXPORT_TIMEOUT_MS = int(os.getenv("DB_EXPORT_TIMEOUT_MS", "600000"))
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE", "1") != "0"
+result_cache = ResultCache(
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    spill_bytes=int(os.getenv("RESULT_CACHE_SPILL_BYTES", str(4 * 1024 * 1024))),
+    disk_dir=os.path.join(CACHE_DIR, "results") if os.getenv("RESULT_CACHE_DISK", "1") != "0" else None,
+    disk_max_bytes=int(os.getenv("RESULT_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024))),
+    max_entry_bytes=int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(256 * 1024 * 1024)))
+)
+
+
+def connect_to_chembl():
+    """Opens a connection to the ChEMBL database.
+
+    Connects over TCP when running locally (LOCAL_DEV) or when MYSQL_HOST points at another server, e.g. a local
+    MySQL stand-in, and over the Cloud SQL unix socket otherwise.
+    """
+    params = dict(
+        user=os.getenv("MYSQL_USER", "root"),
+        password=os.getenv("MYSQL_PASSWORD", "chembl"),
+        database=CHEMBL_VERSION
+    )
+    if os.getenv("LOCAL_DEV") or os.getenv("MYSQL_HOST"):  # Checks if running locally
+        params.update(host=os.getenv("MYSQL_HOST", "35.184.138.61"), port=int(os.getenv("MYSQL_PORT", "3306")))
+    else:
+        params.update(unix_socket=os.getenv("MYSQL_UNIX_SOCKET", "/cloudsql/project-1-450712:us-central1:chembl35-instance"))
+    return mysql.connector.connect(**params)
+
+
+connection_pool = ConnectionPool(
+    connect_to_chembl,
+    size=DB_POOL_SIZE,
+    checkout_timeout=DB_POOL_TIMEOUT_SECONDS,
+    ping_idle_seconds=DB_POOL_PING_IDLE_SECONDS,
+    keep_on=(mysql.connector.errors.ProgrammingError,)
+)
+
+
+def execute_query(query: str, limit=100, use_cache: bool = True, offset: int = 0,
+                  timeout_ms: int = DB_INTERACTIVE_TIMEOUT_MS, exact_decimals: bool = False) -> list[dict] | str:
     """Executes an SQL query on the ChEMBL database and returns the results.
 
+    Successful results are cached by normalized SQL, limit and offset, see `result_cache`. The server stops the
+    query after `timeout_ms`, and the query is killed if the current cancel token (see `query_control`) is
+    cancelled while it runs.
+
     Args:
         query (str): The SQL query to execute.
+        limit (int): The maximum number of rows to return.
+        use_cache (bool): Whether the result cache may serve or store this query.
+        offset (int): The number of rows to skip.
+        timeout_ms (int): The server-side execution time limit, in milliseconds. 0 disables it.
+        exact_decimals (bool): Whether to keep DECIMAL values as `Decimal` instead of converting them to floats.
 
     Returns:
         A list of dictionaries representing the query results, where each dictionary represents a row and
-            maps column names to values. Decimal values are converted to floats.
+            maps column names to values. Decimal values are converted to floats unless `exact_decimals` is set.
         A string containing an error message if an exception occurs.
     """
+    start = time.perf_counter()
     try:
-        if os.getenv("LOCAL_DEV"):  # Checks if running locally
-            conn = mysql.connector.connect(
-                host='35.184.138.61',
-                user='root',
-                password='chembl',
-                database='chembl_35'
-            )
-        else:
-            conn = mysql.connector.connect(
-                unix_socket='/cloudsql/project-1-450712:us-central1:chembl35-instance',
-                user='root',
-                password='chembl',
-                database='chembl_35'
-            )
-
         query = remove_limit_clause(query)
-        query += f" LIMIT {limit}"
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
-        results = cursor.fetchall()
+        namespace = f"{CHEMBL_VERSION}:exact" if exact_decimals else CHEMBL_VERSION
+        cache_key = ResultCache.make_key(f"{query} OFFSET {offset}" if offset else query, limit, namespace=namespace)
+        if use_cache and RESULT_CACHE_ENABLED:
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                DB_QUERY_SECONDS.labels("interactive", "cached").observe(time.perf_counter() - start)
+                return cached
 
-        for row in results:
-            for key, value in row.items():
-                if isinstance(value, Decimal):
-                    row[key] = float(value)
+        token = current_token()
+        if token is not None and token.cancelled:
+            return "Error: Query cancelled"
 
-        cursor.close()
-        conn.close()
-        return results
+        with connection_pool.connection() as conn:
+            query += f" LIMIT {limit}" + (f" OFFSET {offset}" if offset else "")
+            _set_execution_time_limit(conn, timeout_ms)
+            cursor = conn.cursor(dictionary=True)
+            try:
+                with watch_query(connect_to_chembl, conn, token):
+                    cursor.execute(query)
+                    results = cursor.fetchall()
+            finally:
+                cursor.close()
+
+        if not exact_decimals:
+            for row in results:
+                for key, value in row.items():
+                    if isinstance(value, Decimal):
+                        row[key] = float(value)
     except Exception as e:
+        query_control.count_error(e)
+        DB_QUERY_SECONDS.labels("interactive", "error").observe(time.perf_counter() - start)
         return f"Error: {e}"
 
+    DB_QUERY_SECONDS.labels("interactive", "ok").observe(time.perf_counter() - start)
+    if use_cache and RESULT_CACHE_ENABLED:
+        result_cache.put(cache_key, results, time.perf_counter() - start)
+    return results
+
+
+async def execute_query_async(query: str, limit=100, use_cache: bool = True, offset: int = 0,
+                              timeout_ms: int = DB_INTERACTIVE_TIMEOUT_MS) -> list[dict] | str:
+    """Executes an SQL query like `execute_query` without blocking the event loop.
+
+    mysql-connector 8.2 has no asyncio driver, so the query runs in a worker thread; the connection pool still
+    bounds the number of queries in flight, and result cache hits return without touching the database. Cancelling
+    the awaiting task, e.g. when the client of a streaming response disconnects, kills the running statement
+    instead of leaving the thread to wait for it. The kill is sent from a background thread (see
+    `query_control.watch_query`), so cancelling never blocks the event loop.
+    """
+    token = CancelToken(parent=current_token())
+
+    def run():
+        with cancel_scope(token):
+            return execute_query(query, limit, use_cache, offset, timeout_ms)
+
+    try:
+        return await asyncio.to_thread(run)
+    except asyncio.CancelledError:
+        token.cancel()
+        raise
+
+
+def iter_query_batches(query: str, limit: int = 10000000, batch_size: int = 5000,
+                       timeout_ms: int = DB_EXPORT_TIMEOUT_MS) -> Iterator[tuple[list[str], list[tuple]]]:
+    """Executes an SQL query with an unbuffered cursor and yields the results batch by batch.
+
+    Rows are fetched from the server as they are consumed, so memory stays bounded by the batch size whatever the
+    size of the result. The results are not cached. If the consumer stops early, e.g. because the client of a
+    download disconnected, the statement is killed and the connection is discarded rather than returned to the
+    pool, since it still has unread rows.
+
+    Args:
+        query (str): The SQL query to execute.
+        limit (int): The maximum number of rows to return.
+        batch_size (int): The number of rows fetched per batch.
+        timeout_ms (int): The server-side execution time limit, in milliseconds. 0 disables it.
+
+    Yields:
+        tuple[list[str], list[tuple]]: The column names, as `ResultColumns` carrying the Arrow schema of the
+            cursor's column types, and a batch of rows. Decimal values are kept exact. An empty result yields a
+            single empty batch, so the columns are always known.
+    """
+    query = f"{remove_limit_clause(query)} LIMIT {limit}"
+    start = time.perf_counter()
+    with connection_pool.connection() as conn:
+        _set_execution_time_limit(conn, timeout_ms)
+        cursor = conn.cursor(buffered=False)
+        try:
+            with watch_query(connect_to_chembl, conn, current_token()):
+                cursor.execute(query)
+                rows = cursor.fetchmany(batch_size)
+                columns = ResultColumns([column[0] for column in cursor.description],
+                                        arrow_schema_from_description(cursor.description, rows))
+                DB_QUERY_SECONDS.labels("export", "ok").observe(time.perf_counter() - start)
+                yield columns, rows
+                while rows:
+                    rows = cursor.fetchmany(batch_size)
+                    if rows:
+                        yield columns, rows
+        except GeneratorExit:
+            query_control.count("abandoned_streams")
+            query_control.kill_query(connect_to_chembl, conn.connection_id)
+            raise
+        except Exception as e:
+            query_control.count_error(e)
+            DB_QUERY_SECONDS.labels("export", "error").observe(time.perf_counter() - start)
+            raise
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+def _set_execution_time_limit(conn, timeout_ms: int) -> None:
+    """Sets MAX_EXECUTION_TIME for the next statements of a connection. It is set before every query, since
+    pooled connections are shared by interactive queries and exports and may have reconnected since the last one."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SET SESSION MAX_EXECUTION_TIME = {max(0, int(timeout_ms))}")
+    finally:
+        cursor.close()
+
 
 def remove_limit_clause(sql_query):
     pattern = r'\bLIMIT\s+\d+(?:\s*(?:,|\bOFFSET\b)\s*\d+)?\s*$'